@@ -0,0 +1,57 @@
+import datetime, hashlib, json, os, pathlib
+from typing import Any, Dict, Iterable, Optional
+
+# Model artifacts: a joblib payload plus a <name>.meta.json sidecar describing it, so
+# callers can check dimension/version/provenance without unpickling (or importing
+# sklearn). Loaded artifacts are cached per process and keyed by file version.
+
+_LOADED: Dict[str, tuple] = {}
+
+def meta_path(path) -> pathlib.Path:
+    path = pathlib.Path(path)
+    return path.with_name(path.name + ".meta.json")
+
+def version(path) -> int:
+    """mtime_ns of the artifact (0 if missing); every save changes it."""
+    path = pathlib.Path(path)
+    return path.stat().st_mtime_ns if path.exists() else 0
+
+def input_hash(items: Iterable[Any]) -> str:
+    h = hashlib.sha1()
+    for x in items:
+        h.update(x if isinstance(x, bytes) else str(x).encode("utf-8")); h.update(b"\0")
+    return h.hexdigest()
+
+def save(obj, path, dim: Optional[int] = None, input_hash: Optional[str] = None, **extra) -> Dict[str, Any]:
+    """Atomically dump obj and write its sidecar; returns the metadata."""
+    import joblib
+    path = pathlib.Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    joblib.dump(obj, tmp); os.replace(tmp, path)
+    meta = {"artifact": path.name, "model_version": version(path), "dim": dim, "input_hash": input_hash,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), **extra}
+    mp = meta_path(path); tmp = mp.with_name(mp.name + ".tmp")
+    tmp.write_text(json.dumps(meta, indent=1)); os.replace(tmp, mp)
+    _LOADED.pop(str(path.resolve()), None)
+    return meta
+
+def meta(path) -> Optional[Dict[str, Any]]:
+    """Sidecar of the artifact as currently on disk; None if there is none or it describes an older file."""
+    mp = meta_path(path)
+    if not mp.exists(): return None
+    m = json.loads(mp.read_text())
+    return m if m.get("model_version") == version(path) else None
+
+def load(path, mmap: bool = True):
+    """joblib.load with numpy arrays memory-mapped read-only, once per process per artifact version."""
+    path = pathlib.Path(path); key = str(path.resolve()); v = version(path)
+    hit = _LOADED.get(key)
+    if hit is not None and hit[0] == v:
+        return hit[1]
+    import joblib
+    obj = joblib.load(path, mmap_mode="r" if mmap else None)
+    _LOADED[key] = (v, obj)
+    return obj
+
+def clear():
+    _LOADED.clear()
@@ -0,0 +1,49 @@
+import pathlib, numpy as np
+from typing import Dict, Hashable, Iterable, Optional, Sequence
+from agents.common import artifacts
+
+# Isolation Forests as written by agents.train_iforest: a global forest, optionally with
+# per-(region, category) forests for segments that had enough history. Detectors go through
+# outliers()/anomaly_score() with each row's segment; rows of segments without a forest of
+# their own (and every row, for a plain IsolationForest) use the global one. sklearn is only
+# imported by unpickling.
+
+class SegmentForest:
+    def __init__(self, base, segments: Optional[Dict[Hashable, object]] = None):
+        self.base = base; self.segments = dict(segments or {})
+
+    def _apply(self, method: str, X, segments: Optional[Iterable[Hashable]]):
+        out = getattr(self.base, method)(X)
+        if not self.segments or segments is None: return out
+        ids = {k: i for i, k in enumerate(self.segments)}
+        sid = np.fromiter((ids.get(k, -1) for k in segments), dtype=np.int64, count=len(X))
+        for k, i in ids.items():
+            ix = np.flatnonzero(sid == i)
+            if len(ix): out[ix] = getattr(self.segments[k], method)(X[ix])
+        return out
+
+    def predict(self, X, segments=None):
+        return self._apply("predict", np.asarray(X, dtype=float), segments)
+
+    def decision_function(self, X, segments=None):
+        return self._apply("decision_function", np.asarray(X, dtype=float), segments)
+
+def outliers(clf, X, segments: Optional[Iterable[Hashable]] = None) -> np.ndarray:
+    """Boolean mask of the rows the model labels -1; `segments` (consumed only by a SegmentForest) keys each row."""
+    pred = clf.predict(X, segments) if isinstance(clf, SegmentForest) else clf.predict(X)
+    return pred == -1
+
+def anomaly_score(clf, X, segments: Optional[Iterable[Hashable]] = None) -> np.ndarray:
+    """Higher = more anomalous (sklearn's decision_function/score_samples are higher for inliers)."""
+    if isinstance(clf, SegmentForest): return -clf.decision_function(X, segments)
+    return -(clf.decision_function(X) if hasattr(clf, "decision_function") else clf.score_samples(X))
+
+def load(path, features: Sequence[str]):
+    """The model at path; None when there is none or its metadata says it was trained on other features."""
+    path = pathlib.Path(path)
+    if not path.exists(): return None
+    m = artifacts.meta(path)
+    if m and m.get("features") not in (None, list(features)):
+        print(f"Ignoring {path.name}: trained on {m['features']}, expected {list(features)} (retrain with python -m agents.train_iforest)")
+        return None
+    return artifacts.load(path)
@@ -1,26 +1,387 @@
-import json, pathlib
-from typing import List, Dict, Any
+import abc, atexit, json, os, pathlib, shutil
+import numpy as np
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence
 from typing import Union
 
+FORMATS = ("jsonl", "columnar")
+
 def ensure_dir(p: Union[str, pathlib.Path]):
     pathlib.Path(p).mkdir(parents=True, exist_ok=True)
 
 
+class BufferedWriter(abc.ABC):
+    """Append-only writer for one topic: records are buffered and written in batches of batch_size."""
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.buf: List[Any] = []
+        self.count = 0
+        self.closed = False
+
+    def encode(self, record: Dict[str, Any]) -> Any:
+        return record
+
+    @abc.abstractmethod
+    def write(self, buf: List[Any]):
+        """Append a batch of encoded records to the topic."""
+
+    def produce(self, record: Dict[str, Any]):
+        self.buf.append(self.encode(record))
+        self.count += 1
+        if len(self.buf) >= self.batch_size:
+            self.flush()
+
+    def produce_many(self, records: Iterable[Dict[str, Any]]):
+        for r in records:
+            self.produce(r)
+
+    def flush(self):
+        if self.buf:
+            self.write(self.buf)
+            self.buf = []
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TopicWriter(BufferedWriter):
+    """Buffered JSONL writer; keeps the file open."""
+    def __init__(self, path: pathlib.Path, batch_size: int = 1000):
+        super().__init__(batch_size)
+        self.path = path
+        self.f = open(path, "a", encoding="utf-8")
+
+    def encode(self, record: Dict[str, Any]) -> str:
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def write(self, buf: List[str]):
+        self.f.write("".join(buf))
+
+    def flush(self):
+        super().flush()
+        self.f.flush()
+
+    def close(self):
+        super().close()
+        if not self.f.closed:
+            self.f.close()
+
+
+class _OffsetReader(abc.ABC):
+    """Chunked topic reader with a committable position; subclasses define what a position counts."""
+    def __init__(self, path: pathlib.Path, offset_path: Optional[pathlib.Path] = None, chunk_size: int = 1000):
+        self.path = path
+        self.offset_path = offset_path
+        self.chunk_size = chunk_size
+        self.position = self.committed()
+
+    def committed(self) -> int:
+        if self.offset_path is None or not self.offset_path.exists():
+            return 0
+        return int(self.offset_path.read_text().strip() or 0)
+
+    @abc.abstractmethod
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        """Chunks of records from the current position on, advancing it."""
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        for chunk in self:
+            yield from chunk
+
+    @abc.abstractmethod
+    def end(self) -> int:
+        """Position just past the last complete record currently in the topic."""
+
+    def commit(self, position: Optional[int] = None):
+        if self.offset_path is None:
+            raise ValueError("commit() needs a consumer group")
+        if position is not None:
+            self.position = position
+        ensure_dir(self.offset_path.parent)
+        tmp = self.offset_path.with_suffix(".tmp")
+        tmp.write_text(str(self.position))
+        os.replace(tmp, self.offset_path)
+
+
+class TopicReader(_OffsetReader):
+    """Lazy chunked reader that tracks a byte offset and can commit it per consumer group.
+
+    Only complete lines are consumed, so a reader never splits a record that a
+    producer is still writing.
+    """
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.position)
+            chunk = []
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.position += len(line)
+                line = line.strip()
+                if line:
+                    chunk.append(json.loads(line))
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def end(self) -> int:
+        if not self.path.exists():
+            return 0
+        with open(self.path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            while pos > 0:  # scan back to the last newline; a partial tail line is not consumable yet
+                step = min(1 << 16, pos); f.seek(pos - step)
+                i = f.read(step).rfind(b"\n")
+                if i >= 0:
+                    return pos - step + i + 1
+                pos -= step
+        return 0
+
+
+# Columnar topics: <topic>.cols/index.json lists segments; each segment stores one
+# .npy per column. Scalars keep their numeric dtype; strings and anything nested
+# (JSON-encoded) are a uint8 blob plus int64 offsets, so every file is memory-mappable.
+
+def _column_kind(vals: list) -> str:
+    if all(type(v) is bool for v in vals): return "bool"
+    if all(type(v) is int for v in vals): return "int"
+    if all(type(v) in (int, float) for v in vals): return "float"
+    if all(type(v) is str for v in vals): return "str"
+    return "json"
+
+def _write_segment(seg_dir: pathlib.Path, records: List[Dict[str, Any]]) -> Dict[str, str]:
+    ensure_dir(seg_dir)
+    names = list(dict.fromkeys(k for r in records for k in r))
+    kinds = {}
+    for c in names:
+        vals = [r.get(c) for r in records]
+        kind = kinds[c] = _column_kind(vals) if all(c in r for r in records) else "json"
+        if kind in ("bool", "int", "float"):
+            np.save(seg_dir / f"{c}.npy", np.array(vals, dtype={"bool": bool, "int": np.int64, "float": np.float64}[kind]))
+        else:
+            enc = [(v if kind == "str" else json.dumps(v, ensure_ascii=False)).encode("utf-8") for v in vals]
+            off = np.zeros(len(enc)+1, dtype=np.int64)
+            np.cumsum([len(e) for e in enc], out=off[1:])
+            np.save(seg_dir / f"{c}.offsets.npy", off)
+            np.save(seg_dir / f"{c}.data.npy", np.frombuffer(b"".join(enc), dtype=np.uint8))
+    return kinds
+
+def _read_segment_column(seg_dir: pathlib.Path, col: str, kind: str, start: int = 0, stop: Optional[int] = None):
+    if kind in ("bool", "int", "float"):
+        return np.load(seg_dir / f"{col}.npy", mmap_mode="r")[start:stop]
+    off = np.load(seg_dir / f"{col}.offsets.npy", mmap_mode="r")
+    stop = len(off)-1 if stop is None else stop
+    data = np.load(seg_dir / f"{col}.data.npy", mmap_mode="r")
+    off = off[start:stop+1]
+    raw = data[off[0]:off[-1]].tobytes(); off = off - off[0]
+    vals = [raw[a:b].decode("utf-8") for a, b in zip(off[:-1], off[1:])]
+    if kind == "json":
+        vals = [json.loads(v) for v in vals]
+    out = np.empty(len(vals), dtype=object); out[:] = vals
+    return out
+
+
+class ColumnarTopic:
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.index_path = root / "index.json"
+
+    def exists(self) -> bool:
+        return self.index_path.exists()
+
+    def segments(self) -> List[Dict[str, Any]]:
+        if not self.exists():
+            return []
+        return json.loads(self.index_path.read_text())["segments"]
+
+    def append_segment(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        segs = self.segments()
+        name = f"seg-{len(segs):06d}"
+        kinds = _write_segment(self.root / name, records)
+        segs.append({"name": name, "rows": len(records), "columns": kinds})
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"segments": segs}, indent=1))
+        os.replace(tmp, self.index_path)
+
+    def __len__(self):
+        return sum(s["rows"] for s in self.segments())
+
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(c for s in self.segments() for c in s["columns"]))
+
+    def read_columns(self, columns: Optional[Sequence[str]] = None, segments: Optional[List[Dict[str, Any]]] = None,
+                     start: int = 0) -> Dict[str, np.ndarray]:
+        segs = self.segments() if segments is None else segments
+        columns = list(columns) if columns is not None else list(dict.fromkeys(c for s in segs for c in s["columns"]))
+        out = {}
+        for c in columns:
+            parts = []; numeric = True
+            for i, s in enumerate(segs):
+                lo = start if i == 0 else 0
+                if c in s["columns"]:
+                    parts.append(_read_segment_column(self.root / s["name"], c, s["columns"][c], lo))
+                    numeric &= s["columns"][c] in ("bool", "int", "float")
+                else:
+                    parts.append(np.full(s["rows"]-lo, None, dtype=object)); numeric = False
+            if not parts:
+                out[c] = np.empty(0, dtype=object)
+            elif len(parts) == 1:
+                out[c] = parts[0]
+            elif numeric:
+                out[c] = np.concatenate(parts)
+            else:
+                out[c] = np.concatenate([p.astype(object) for p in parts])
+        return out
+
+
+def to_columns(recs: List[Dict[str, Any]], columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """Object arrays per column (None where a record lacks the key), the shape read_columns returns."""
+    columns = list(columns) if columns is not None else list(dict.fromkeys(k for r in recs for k in r))
+    out = {}
+    for c in columns:
+        a = np.empty(len(recs), dtype=object); a[:] = [r.get(c) for r in recs]
+        out[c] = a
+    return out
+
+
+def _to_records(cols: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    names = list(cols)
+    vals = [cols[c].tolist() for c in names]
+    return [dict(zip(names, row)) for row in zip(*vals)]
+
+
+class ColumnarWriter(BufferedWriter):
+    """Buffers records and writes each flushed batch as one columnar segment."""
+    def __init__(self, topic: ColumnarTopic, batch_size: int = 50000):
+        super().__init__(batch_size)
+        self.topic = topic
+
+    def write(self, buf: List[Dict[str, Any]]):
+        self.topic.append_segment(buf)
+
+
+class ColumnarReader(_OffsetReader):
+    """Chunked reader over a columnar topic; the committed offset is a row number."""
+    def __init__(self, topic: ColumnarTopic, offset_path: Optional[pathlib.Path] = None, chunk_size: int = 1000,
+                 columns: Optional[Sequence[str]] = None):
+        super().__init__(topic.root, offset_path, chunk_size)
+        self.topic = topic
+        self.columns = columns
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        row0 = 0
+        for s in self.topic.segments():
+            lo = max(0, self.position - row0)
+            if lo < s["rows"]:
+                recs = _to_records(self.topic.read_columns(self.columns, [s], start=lo))
+                for i in range(0, len(recs), self.chunk_size):
+                    chunk = recs[i:i+self.chunk_size]
+                    self.position += len(chunk)
+                    yield chunk
+            row0 += s["rows"]
+
+    def end(self) -> int:
+        return len(self.topic)
+
+
+_buffering: set = set()  # FSBus instances whose produce() holds records not written yet
+
+@atexit.register
+def _flush_buffered():
+    for bus in list(_buffering): bus.flush()
+
+
 class FSBus:
-    def __init__(self, topics_dir: str):
+    def __init__(self, topics_dir: str, fmt: str = "jsonl"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown topic format {fmt!r}; expected one of {FORMATS}")
         self.topics_dir = pathlib.Path(topics_dir)
+        self.fmt = fmt
+        self.pending: Dict[str, ColumnarWriter] = {}  # produce() buffers for columnar topics
         ensure_dir(self.topics_dir)
 
     def topic_path(self, topic: str) -> pathlib.Path:
         return self.topics_dir / f"{topic}.jsonl"
 
+    def columnar(self, topic: str) -> ColumnarTopic:
+        return ColumnarTopic(self.topics_dir / f"{topic}.cols")
+
+    def stored_format(self, topic: str) -> str:
+        """Configured format, unless only the other one has data for this topic."""
+        if self.fmt == "columnar" and not self.columnar(topic).exists() and self.topic_path(topic).exists():
+            return "jsonl"
+        if self.fmt == "jsonl" and not self.topic_path(topic).exists() and self.columnar(topic).exists():
+            return "columnar"
+        return self.fmt
+
+    def offset_path(self, topic: str, group: str) -> pathlib.Path:
+        return self.topics_dir / "_offsets" / group / f"{topic}.offset"
+
     def produce(self, topic: str, record: Dict[str, Any]):
+        """Append one record. Columnar topics buffer it in a per-topic ColumnarWriter that writes a
+        segment per batch; reads through this bus, flush() and interpreter exit write the rest
+        (a bus is only held for the exit flush while it has records buffered)."""
+        if self.fmt == "columnar":
+            w = self.pending.get(topic)
+            if w is None:
+                w = self.pending[topic] = self.producer(topic); _buffering.add(self)
+            w.produce(record); return
         p = self.topic_path(topic)
-        ensure_dir(p.parent)
         with open(p, "a", encoding="utf-8") as f:
             f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
+    def flush(self, topic: Optional[str] = None):
+        """Write records produce() is still buffering (for one topic, or all)."""
+        for t in [topic] if topic is not None else list(self.pending):
+            w = self.pending.pop(t, None)
+            if w is not None: w.close()
+        if not self.pending: _buffering.discard(self)
+
+    def producer(self, topic: str, batch_size: Optional[int] = None) -> BufferedWriter:
+        if self.fmt == "columnar":
+            return ColumnarWriter(self.columnar(topic), batch_size=batch_size or 50000)
+        return TopicWriter(self.topic_path(topic), batch_size=batch_size or 1000)
+
+    def consumer(self, topic: str, group: Optional[str] = None, chunk_size: int = 1000) -> _OffsetReader:
+        self.flush(topic)
+        op = self.offset_path(topic, group) if group else None
+        if self.stored_format(topic) == "columnar":
+            return ColumnarReader(self.columnar(topic), op, chunk_size=chunk_size)
+        return TopicReader(self.topic_path(topic), op, chunk_size=chunk_size)
+
+    def read_columns(self, topic: str, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Column arrays for a topic; columnar topics only map the requested columns."""
+        self.flush(topic)
+        if self.stored_format(topic) == "columnar":
+            return self.columnar(topic).read_columns(columns)
+        return to_columns(self.read_all(topic), columns)
+
+    def truncate(self, topic: str):
+        """Drop a topic in both formats, and every consumer group's offset for it."""
+        self.pending.pop(topic, None)
+        if not self.pending: _buffering.discard(self)
+        self.topic_path(topic).unlink(missing_ok=True)
+        shutil.rmtree(self.columnar(topic).root, ignore_errors=True)
+        for p in (self.topics_dir / "_offsets").glob(f"*/{topic}.offset"):
+            p.unlink()
+
     def read_all(self, topic: str) -> List[Dict[str, Any]]:
+        self.flush(topic)
+        if self.stored_format(topic) == "columnar":
+            return _to_records(self.columnar(topic).read_columns())
         p = self.topic_path(topic)
         if not p.exists():
             return []
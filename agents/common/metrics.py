@@ -0,0 +1,275 @@
+import contextlib, contextvars, datetime, itertools, json, os, pathlib, re, resource, sys, threading, time
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Optional
+
+# Run instrumentation. An agent's main() opens metrics.run(name, cfg); inside it, stage()
+# (the agent itself, or one per pipeline/stream stage) and phase() record wall time,
+# count() adds to counters (records_in / records_out) and observe() feeds latency
+# histograms. When the run ends it is written to <paths.metrics_dir>/<name>.json and
+# <name>.prom (Prometheus text format, for the node_exporter textfile collector), and a
+# one-line summary is appended to runs.jsonl. Outside a run every call is a no-op.
+#
+# Profiling is opt-in (--profile, AGENT_PROFILE or metrics.profile): "cprofile" dumps
+# <name>[.<stage>].prof for each stage's thread and lists the top functions in the
+# report; "tracemalloc" adds the traced peak and the top allocation sites. Work done in
+# pool worker processes is timed by the phase that waits for it but not profiled.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+PROFILERS = ("cprofile", "tracemalloc")
+
+_RUN = None
+_stage = contextvars.ContextVar("metrics_stage", default=None)
+_phase = contextvars.ContextVar("metrics_phase", default=())
+_profiling = threading.local()
+
+def _forked():
+    global _RUN
+    _RUN = None  # pool workers report through the parent's phases, and must not touch its lock
+os.register_at_fork(after_in_child=_forked)
+
+class Histogram:
+    """Prometheus-style histogram over fixed latency buckets (seconds)."""
+    __slots__ = ("counts","sum","n","max")
+    def __init__(self):
+        self.counts = [0]*(len(BUCKETS)+1); self.sum = 0.0; self.n = 0; self.max = 0.0
+
+    def add(self, v: float):
+        self.counts[bisect_left(BUCKETS, v)] += 1; self.sum += v; self.n += 1
+        if v > self.max: self.max = v
+
+    def cumulative(self):
+        return list(zip([*map(str, BUCKETS), "+Inf"], itertools.accumulate(self.counts)))
+
+    def to_dict(self):
+        return {"count": self.n, "seconds": round(self.sum, 6), "max": round(self.max, 6),
+                "buckets": {le: c for le, c in zip([*map(str, BUCKETS), "+Inf"], self.counts) if c}}  # per bucket, not cumulative
+
+def parse_profile(spec) -> tuple:
+    """"cprofile,tracemalloc" → ("cprofile", "tracemalloc"); "", "none" or "0" → ()."""
+    if not spec or str(spec).lower() in ("none", "0", "off", "false"): return ()
+    got = tuple(p.strip().lower() for p in str(spec).split(",") if p.strip())
+    if "all" in got: return PROFILERS
+    unknown = set(got) - set(PROFILERS)
+    if unknown: raise SystemExit(f"Unknown profiler(s) {sorted(unknown)}; choose from {list(PROFILERS)}")
+    return got
+
+
+class Run:
+    def __init__(self, name: str, cfg, profile=()):
+        mc = cfg["metrics"]
+        self.name = name; self.dir = pathlib.Path(cfg["paths"]["metrics_dir"])
+        self.profile = profile; self.top = mc["top"]; self.flush_s = mc["flush_s"]
+        self.lock = threading.Lock()
+        self.started = datetime.datetime.now(datetime.timezone.utc); self.t0 = time.perf_counter(); self.flushed = self.t0
+        self.stages: Dict[str, dict] = {}
+        self.phases: Dict[tuple, Histogram] = {}    # (stage, phase path) -> wall time
+        self.counters: Dict[tuple, float] = {}      # (stage, name) -> total
+        self.hists: Dict[tuple, Histogram] = {}     # (stage, name) -> observed values
+        self.profiles: Dict[str, dict] = {}
+        self.tracemalloc = None
+
+    def _hist(self, table, key) -> Histogram:
+        h = table.get(key)
+        if h is None: h = table[key] = Histogram()
+        return h
+
+    def start_profile(self):
+        """A cProfile for the calling thread, unless profiling is off or the thread already has one."""
+        if "cprofile" not in self.profile or getattr(_profiling, "on", False): return None
+        import cProfile
+        p = cProfile.Profile(); _profiling.on = True; p.enable()
+        return p
+
+    def stop_profile(self, p, stage):
+        p.disable(); _profiling.on = False
+        import pstats
+        path = self.dir / (f"{self.name}.prof" if stage == self.name else f"{self.name}.{stage}.prof")
+        path.parent.mkdir(parents=True, exist_ok=True); p.dump_stats(path)
+        rows = sorted(pstats.Stats(p).stats.items(), key=lambda kv: kv[1][3], reverse=True)[:self.top]
+        top = [{"function": f"{f}:{line}({fn})", "calls": nc, "tottime": round(tt, 4), "cumtime": round(ct, 4)}
+               for (f, line, fn), (_, nc, tt, ct, _) in rows]
+        with self.lock: self.profiles[stage] = {"file": str(path), "top": top}
+
+    def report(self, status: str) -> dict:
+        secs = time.perf_counter() - self.t0
+        with self.lock:
+            stages = {s: dict(v) for s, v in self.stages.items()}
+            for (s, name), v in self.counters.items():
+                st = stages.setdefault(s, {"seconds": None, "status": "running"})
+                st[name] = v
+            for st in stages.values():
+                if st.get("records_in") and st.get("seconds"): st["records_in_per_s"] = round(st["records_in"] / st["seconds"], 1)
+            phases, hists, counters = {}, {}, {}
+            for (s, p), h in sorted(self.phases.items()): phases.setdefault(s, {})[p] = h.to_dict()
+            for (s, n), h in sorted(self.hists.items()): hists.setdefault(s, {})[n] = h.to_dict()
+            for (s, n), v in sorted(self.counters.items()): counters.setdefault(s, {})[n] = v
+            profiles = dict(self.profiles)
+        return {"run": self.name, "status": status, "started": self.started.isoformat(timespec="seconds"),
+                "seconds": round(secs, 4), "pid": os.getpid(), "argv": sys.argv,
+                "peak_rss_mb": round(_maxrss(resource.RUSAGE_SELF), 1),
+                "children_peak_rss_mb": round(_maxrss(resource.RUSAGE_CHILDREN), 1),
+                "profile": list(self.profile), "stages": stages, "phases": phases,
+                "counters": counters, "histograms": hists, "profiles": profiles,
+                **({"tracemalloc": self.tracemalloc} if self.tracemalloc else {})}
+
+    def prometheus(self, rep: dict) -> str:
+        out = []
+        def family(name, typ, help, samples):
+            if samples: out.extend([f"# HELP {name} {help}", f"# TYPE {name} {typ}", *samples])
+        def hist_samples(name, h, **labels):
+            rows = [f"{name}_bucket{_labels(**labels, le=le)} {c}" for le, c in h.cumulative()]
+            return rows + [f"{name}_sum{_labels(**labels)} {h.sum:.6f}", f"{name}_count{_labels(**labels)} {h.n}"]
+        run = self.name
+        family("agent_run_duration_seconds", "gauge", "Wall time of the last run.", [f"agent_run_duration_seconds{_labels(run=run)} {rep['seconds']}"])
+        family("agent_run_success", "gauge", "1 if the last run finished without error.",
+               [f"agent_run_success{_labels(run=run)} {int(rep['status'] == 'ok')}"])
+        family("agent_run_last_timestamp_seconds", "gauge", "Unix time the last run report was written.",
+               [f"agent_run_last_timestamp_seconds{_labels(run=run)} {time.time():.0f}"])
+        family("agent_peak_rss_bytes", "gauge", "Peak resident set size of the run's process.",
+               [f"agent_peak_rss_bytes{_labels(run=run)} {int(rep['peak_rss_mb'] * 2**20)}"])
+        family("agent_stage_duration_seconds", "gauge", "Wall time of each stage in the last run.",
+               [f"agent_stage_duration_seconds{_labels(run=run, stage=s, status=v['status'])} {v['seconds']}"
+                for s, v in rep["stages"].items() if v.get("seconds") is not None])
+        with self.lock:
+            by_name = lambda kv: (kv[0][1], kv[0][0])
+            phases = sorted(self.phases.items()); counters = sorted(self.counters.items(), key=by_name)
+            hists = sorted(self.hists.items(), key=by_name)
+        family("agent_phase_duration_seconds", "histogram", "Wall time of agent phases.",
+               [r for (s, p), h in phases for r in hist_samples("agent_phase_duration_seconds", h, run=run, stage=s, phase=p)])
+        for name, rows in itertools.groupby(counters, key=lambda kv: kv[0][1]):
+            m = f"agent_{_metric_name(name)}_total"
+            family(m, "counter", f"{name} in the last run.", [f"{m}{_labels(run=run, stage=s)} {v:g}" for (s, _), v in rows])
+        for name, rows in itertools.groupby(hists, key=lambda kv: kv[0][1]):
+            m = f"agent_{_metric_name(name)}"
+            family(m, "histogram", f"{name} observed in the last run.",
+                   [r for (s, _), h in rows for r in hist_samples(m, h, run=run, stage=s)])
+        return "\n".join(out) + "\n"
+
+    def write(self, status: str, summary: bool = True) -> pathlib.Path:
+        rep = self.report(status)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / f"{self.name}.json"
+        _atomic_write(path, json.dumps(rep, indent=1, default=str))
+        _atomic_write(self.dir / f"{self.name}.prom", self.prometheus(rep))
+        if summary:
+            line = {k: rep[k] for k in ("run", "status", "started", "seconds", "peak_rss_mb")}
+            line["stages"] = {s: v.get("seconds") for s, v in rep["stages"].items()}
+            with open(self.dir / "runs.jsonl", "a") as f: f.write(json.dumps(line) + "\n")
+        self.flushed = time.perf_counter()
+        return path
+
+def _maxrss(who) -> float:
+    r = resource.getrusage(who).ru_maxrss
+    return r / 2**20 if sys.platform == "darwin" else r / 1024
+
+def _atomic_write(path: pathlib.Path, text: str):
+    tmp = path.with_name(path.name + ".tmp"); tmp.write_text(text); os.replace(tmp, path)
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def _labels(**kw) -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kw.items()) + "}"
+
+
+def active() -> bool:
+    return _RUN is not None
+
+@contextlib.contextmanager
+def run(name: str, cfg, profile=None) -> Iterator[Optional[Run]]:
+    """Instrument everything inside as run `name`; inside another run this is just a stage of it."""
+    global _RUN
+    if _RUN is not None:
+        with stage(name): yield _RUN
+        return
+    prof = parse_profile(profile if profile is not None else os.environ.get("AGENT_PROFILE") or cfg["metrics"]["profile"])
+    r = _RUN = Run(name, cfg, prof)
+    if "tracemalloc" in prof:
+        import tracemalloc; tracemalloc.start()
+    status = "failed"
+    try:
+        with stage(name): yield r
+        status = "ok"
+    except BaseException as e:
+        if not isinstance(e, Exception): status = "interrupted"
+        raise
+    finally:
+        _RUN = None
+        if "tracemalloc" in prof:
+            snap = tracemalloc.take_snapshot(); peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+            r.tracemalloc = {"peak_mb": round(peak / 2**20, 2),
+                             "top": [{"site": str(s.traceback[0]), "mb": round(s.size / 2**20, 3), "blocks": s.count}
+                                     for s in snap.statistics("lineno")[:r.top]]}
+        path = r.write(status)
+        if prof: print(f"Run report → {path}" + "".join(f", {p['file']}" for p in r.profiles.values()))
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[dict]:
+    """Attribute phases, counters and histograms inside to stage `name`; yields its record (set "status" to override "ok")."""
+    r = _RUN
+    if r is None:
+        yield {}; return
+    rec = {"seconds": None, "status": "running"}
+    tok, ptok = _stage.set(name), _phase.set(())
+    prof = r.start_profile(); t = time.perf_counter()
+    try:
+        yield rec
+        if rec["status"] == "running": rec["status"] = "ok"
+    except BaseException as e:
+        rec["status"] = "failed" if isinstance(e, Exception) else "interrupted"
+        raise
+    finally:
+        rec["seconds"] = round(time.perf_counter() - t, 4)
+        if prof is not None: r.stop_profile(prof, name)
+        with r.lock: r.stages[name] = rec
+        _stage.reset(tok); _phase.reset(ptok)
+
+def _record(path: tuple, secs: float):
+    r = _RUN
+    if r is None: return
+    key = (_stage.get() or r.name, "/".join(path))
+    with r.lock: r._hist(r.phases, key).add(secs)
+
+@contextlib.contextmanager
+def phase(name: str):
+    """Time the block as phase `name` of the current stage (nested phases are recorded as outer/inner)."""
+    if _RUN is None:
+        yield; return
+    path = _phase.get() + (name,); tok = _phase.set(path); t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(path, time.perf_counter() - t); _phase.reset(tok)
+
+def timed(name: str, it: Iterable) -> Iterator:
+    """Iterate `it`, timing each step as phase `name`: for lazy sources such as sales.chunks."""
+    if _RUN is None:
+        yield from it; return
+    it = iter(it); path = _phase.get() + (name,)
+    while True:
+        t = time.perf_counter()
+        try:
+            x = next(it)
+        except StopIteration:
+            return
+        _record(path, time.perf_counter() - t)
+        yield x
+
+def count(name: str, n: float = 1):
+    r = _RUN
+    if r is None: return
+    key = (_stage.get() or r.name, name)
+    with r.lock: r.counters[key] = r.counters.get(key, 0) + n
+
+def observe(name: str, value: float):
+    r = _RUN
+    if r is None: return
+    key = (_stage.get() or r.name, name)
+    with r.lock: r._hist(r.hists, key).add(value)
+
+def flush():
+    """Rewrite the current run's report if metrics.flush_s has passed since the last write (long-running agents)."""
+    r = _RUN
+    if r is not None and time.perf_counter() - r.flushed >= r.flush_s:
+        r.write("running", summary=False)
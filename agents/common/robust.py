@@ -0,0 +1,58 @@
+import numpy as np
+from typing import Optional, Tuple
+
+def window_positions(group_ids: np.ndarray) -> np.ndarray:
+    """Offset of each row within its run of equal group ids (rows must already be grouped)."""
+    g = np.asarray(group_ids)
+    if not len(g): return np.empty(0, dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(g[1:] != g[:-1]) + 1]
+    return np.arange(len(g)) - np.repeat(starts, np.diff(np.r_[starts, len(g)]))
+
+def _sorted_windows(x, ends, pos, w):
+    """Trailing windows ending at `ends`, sorted per row; out-of-series slots and NaNs sort last as +inf.
+
+    Also returns each window's count of non-NaN values and whether it holds a NaN."""
+    offs = np.arange(-(w-1), 1)
+    idx = ends[:, None] + offs
+    ok = offs[None, :] >= -np.minimum(pos[ends], w-1)[:, None]
+    W = np.where(ok, x[np.where(ok, idx, 0)], np.inf)
+    nan = np.isnan(W)
+    W[nan] = np.inf
+    W.sort(axis=1)
+    return W, np.isfinite(W).sum(axis=1), nan.any(axis=1)
+
+def _median_sorted(S, k):
+    r = np.arange(len(S)); lo = np.maximum((k-1)//2, 0); hi = np.maximum(k//2, 0)
+    return (S[r, lo] + S[r, hi]) / 2
+
+def rolling_median_mad(x, window: int, min_periods: int = 1, pos: Optional[np.ndarray] = None,
+                       chunk: int = 1 << 16) -> Tuple[np.ndarray, np.ndarray]:
+    """Trailing rolling median and median absolute deviation without per-window Python calls.
+
+    Each window is gathered into a row, sorted once for the median, and the absolute
+    deviations sorted once more for the MAD. As with rolling().apply(np.median) and
+    Rolling.mad_z, a window holding a NaN gives NaN, and so does one with fewer than
+    `min_periods` non-NaN values. `pos` (offset of each row within its series, see
+    window_positions) keeps windows from crossing series boundaries; by default x is a
+    single series. Values equal np.median over the same window exactly.
+    """
+    x = np.asarray(x, dtype=float); n = len(x)
+    pos = np.arange(n) if pos is None else np.asarray(pos)
+    med = np.full(n, np.nan); mad = np.full(n, np.nan)
+    for s in range(0, n, chunk):
+        ends = np.arange(s, min(n, s+chunk))
+        S, k, nan = _sorted_windows(x, ends, pos, window)
+        ok = (k >= max(min_periods, 1)) & ~nan
+        m = _median_sorted(S, k)
+        with np.errstate(invalid="ignore"):  # windows of NaNs only: inf - inf
+            D = np.abs(S - m[:, None])
+        D.sort(axis=1)
+        med[ends[ok]] = m[ok]; mad[ends[ok]] = _median_sorted(D, k)[ok]
+    return med, mad
+
+def rolling_mad_z(x, window: int, min_periods: int = 1, pos: Optional[np.ndarray] = None,
+                  scale: float = 0.6745, floor: float = 1e-6) -> np.ndarray:
+    """scale*(x - median)/MAD over trailing windows; a zero MAD is replaced by `floor`. NaN where undefined."""
+    med, mad = rolling_median_mad(x, window, min_periods, pos)
+    mad[mad == 0] = floor
+    return scale*(np.asarray(x, dtype=float) - med)/mad
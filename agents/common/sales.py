@@ -0,0 +1,162 @@
+import hashlib, json, os, pathlib, shutil, uuid, numpy as np
+from typing import Iterator, List, Optional, Sequence
+from agents.common.text import standardize_columns
+from agents.common.vectors import file_lock
+
+# Columnar cache of the standardized sales table. The CSV is parsed once, in chunks,
+# into <cache>/<build>/<column>.npy sorted by (sku, date): region/category/sku as
+# category codes, date as datetime64[ns], units/sales as float32 where that is exact,
+# and row (the CSV line) for callers whose result depends on the source order.
+# Each SKU is a contiguous partition (bounds.npy), so readers memory-map only the
+# rows they need. <cache>/current.json names the live build and the source it was
+# built from (size, mtime, SHA-1); a changed source is re-hashed and rebuilt.
+
+FORMAT = 2
+CATEGORICAL = ["sku", "region", "category"]
+NUMERIC = ["units", "sales"]
+COLUMNS = ["date"] + CATEGORICAL + NUMERIC + ["row"]
+
+def _sha1(path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    return h.hexdigest()
+
+def _settings(cfg):
+    return cfg["sales"]["csv_chunk_rows"], cfg["sales"]["float32"]
+
+def _current(root: pathlib.Path, src: pathlib.Path, policy: str) -> Optional[dict]:
+    """The live build if it was made from src as it is now, else None."""
+    cp = root / "current.json"
+    if not cp.exists(): return None
+    cur = json.loads(cp.read_text())
+    if cur.get("format") != FORMAT or cur["source"] != str(src) or cur["float32"] != policy or not (root / cur["dir"]).exists():
+        return None
+    s = src.stat()
+    if cur["size"] != s.st_size: return None
+    if cur["mtime_ns"] != s.st_mtime_ns:  # touched: still valid if the bytes are the same
+        if _sha1(src) != cur["sha1"]: return None
+        cur["mtime_ns"] = s.st_mtime_ns; _write_json(cp, cur)
+    return cur
+
+def _write_json(path: pathlib.Path, obj):
+    tmp = path.with_name(path.name + ".tmp"); tmp.write_text(json.dumps(obj, indent=1)); os.replace(tmp, path)
+
+def _build(root: pathlib.Path, src: pathlib.Path, chunk_rows: int, policy: str) -> dict:
+    import pandas as pd
+    s = src.stat(); sha1 = _sha1(src)
+    out = root / f"build-{uuid.uuid4().hex[:12]}"; raw = out / "raw"; raw.mkdir(parents=True)
+    codes = {c: {} for c in CATEGORICAL}; n = 0
+    files = {c: open(raw / c, "wb") for c in COLUMNS}
+    try:
+        for chunk in pd.read_csv(src, chunksize=chunk_rows):
+            chunk = standardize_columns(chunk)
+            files["date"].write(chunk["date"].to_numpy("datetime64[ns]").tobytes())
+            for c in CATEGORICAL:
+                local, uniq = pd.factorize(chunk[c])
+                ids = np.array([codes[c].setdefault(v, len(codes[c])) for v in uniq.tolist()] + [-1], dtype=np.int32)
+                files[c].write(ids[local].tobytes())  # local code -1 (missing) picks the trailing -1
+            for c in NUMERIC:
+                files[c].write(chunk[c].to_numpy(dtype=np.float64).tobytes())
+            files["row"].write(np.arange(n, n+len(chunk), dtype=np.int64).tobytes())
+            n += len(chunk)
+    finally:
+        for f in files.values(): f.close()
+
+    def column(c, dtype):
+        return np.memmap(raw / c, dtype=dtype, mode="r", shape=(n,)) if n else np.empty(0, dtype)
+    cats, rank = {}, {}
+    for c in CATEGORICAL:
+        seen = pd.Index(list(codes[c]))
+        order = seen.argsort() if len(seen) else np.empty(0, np.int64)
+        cats[c] = seen[order].tolist()
+        rank[c] = np.empty(len(seen) + 1, dtype=np.int32); rank[c][order] = np.arange(len(seen)); rank[c][-1] = -1
+    # sort key: sku rank (missing last), then date (NaT last)
+    sku = rank["sku"][column("sku", np.int32)]
+    date = column("date", np.int64)
+    order = np.lexsort((np.where(date == np.iinfo(np.int64).min, np.iinfo(np.int64).max, date),
+                        np.where(sku < 0, len(cats["sku"]), sku)))
+    bounds = np.searchsorted(np.where(sku < 0, len(cats["sku"]), sku)[order], np.arange(len(cats["sku"]) + 2))
+    del sku, date
+
+    dtypes = {"date": "datetime64[ns]", **{c: "int32" for c in CATEGORICAL}, "row": "int32" if n < 2**31 else "int64"}
+    for c in NUMERIC:
+        x = column(c, np.float64)
+        exact = all(np.array_equal(x[i:i+chunk_rows].astype(np.float32).astype(np.float64), x[i:i+chunk_rows], equal_nan=True)
+                    for i in range(0, n, chunk_rows))
+        dtypes[c] = "float32" if policy == "always" or exact else "float64"
+    for c in COLUMNS:
+        src_col = column(c, np.int32 if c in CATEGORICAL else np.float64 if c in NUMERIC else np.int64)
+        dst = np.lib.format.open_memmap(out / f"{c}.npy", mode="w+", dtype=dtypes[c], shape=(n,))
+        for i in range(0, n, chunk_rows):
+            v = src_col[order[i:i+chunk_rows]]
+            dst[i:i+chunk_rows] = rank[c][v] if c in CATEGORICAL else v.view("datetime64[ns]") if c == "date" else v
+        dst.flush(); del dst
+    np.save(out / "bounds.npy", bounds)
+    shutil.rmtree(raw)
+
+    _write_json(out / "meta.json", {"rows": n, "dtypes": dtypes, "categories": cats})
+    cur = {"format": FORMAT, "dir": out.name, "source": str(src), "size": s.st_size, "mtime_ns": s.st_mtime_ns,
+           "sha1": sha1, "float32": policy}
+    _write_json(root / "current.json", cur)
+    for d in root.glob("build-*"):  # older builds; readers that still map them keep their inodes
+        if d.name != out.name: shutil.rmtree(d, ignore_errors=True)
+    return cur
+
+
+class SalesCache:
+    """Read side of the cache: columns of whole SKU partitions as a pandas DataFrame."""
+    def __init__(self, cfg):
+        self.root = pathlib.Path(cfg["paths"]["sales_cache"])
+        src = pathlib.Path(cfg["paths"]["sales_csv"]); chunk_rows, policy = _settings(cfg)
+        cur = _current(self.root, src, policy)
+        if cur is None:
+            with file_lock(self.root / ".build.lock", timeout=3600):
+                cur = _current(self.root, src, policy) or _build(self.root, src, chunk_rows, policy)
+        self.dir = self.root / cur["dir"]
+        self.meta = json.loads((self.dir / "meta.json").read_text())
+        self.bounds = np.load(self.dir / "bounds.npy")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @property
+    def skus(self) -> list:
+        return self.meta["categories"]["sku"]
+
+    def partitions(self, skus: Optional[Sequence] = None) -> List[tuple]:
+        """(start, stop) row ranges of the given SKUs (all rows, including missing SKUs, when None)."""
+        if skus is None: return [(0, len(self))]
+        ix = {s: i for i, s in enumerate(self.skus)}
+        return [(int(self.bounds[ix[s]]), int(self.bounds[ix[s]+1])) for s in skus if s in ix]
+
+    def frame(self, ranges: Sequence[tuple], columns: Optional[Sequence[str]] = None):
+        import pandas as pd
+        columns = list(columns or COLUMNS); data = {}
+        for c in columns:
+            m = np.load(self.dir / f"{c}.npy", mmap_mode="r")
+            v = np.concatenate([m[a:b] for a, b in ranges]) if ranges else m[:0].copy()
+            data[c] = pd.Categorical.from_codes(v, categories=self.meta["categories"][c]) if c in CATEGORICAL else v
+        return pd.DataFrame(data, columns=columns)
+
+    def chunks(self, rows: int, columns: Optional[Sequence[str]] = None, skus: Optional[Sequence[int]] = None) -> Iterator:
+        """DataFrames of whole SKUs (all, or those at the given category positions), about `rows` rows each (0 = one frame)."""
+        b = self.bounds
+        ix = range(len(b)-1) if skus is None else skus
+        ranges, n = [], 0
+        for i in ix:
+            if b[i+1] == b[i]: continue
+            ranges.append((int(b[i]), int(b[i+1]))); n += b[i+1] - b[i]
+            if rows and n >= rows:
+                yield self.frame(ranges, columns); ranges, n = [], 0
+        if ranges or not rows:
+            yield self.frame(ranges, columns)
+
+
+def load(cfg, columns: Optional[Sequence[str]] = None, skus: Optional[Sequence] = None):
+    """Standardized sales table (date, sku, region, category, units, sales, row) sorted by (sku, date), built on first use."""
+    c = SalesCache(cfg)
+    return c.frame(c.partitions(skus), columns)
+
+def chunks(cfg, rows: int, columns: Optional[Sequence[str]] = None) -> Iterator:
+    return SalesCache(cfg).chunks(rows, columns)
@@ -0,0 +1,185 @@
+import abc, asyncio, json, time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from agents.common.io import FSBus
+from agents.common import metrics
+
+# Streaming transport. A StreamBus publishes record batches to topics and hands out
+# subscriptions that yield (records, position) chunks; committing a position records a
+# consumer group's progress. micro_batches() is the consumer loop every streaming agent
+# runs on top of it.
+
+class Subscription(abc.ABC):
+    @abc.abstractmethod
+    def batches(self) -> AsyncIterator[Tuple[List[Dict[str, Any]], Any]]:
+        """(records, position after them) chunks, as they arrive."""
+
+    @abc.abstractmethod
+    async def commit(self, position):
+        """Record the consumer group's progress up to `position`."""
+
+
+class StreamBus(abc.ABC):
+    @abc.abstractmethod
+    async def publish(self, topic: str, records: List[Dict[str, Any]]):
+        """Append records to a topic."""
+
+    @abc.abstractmethod
+    def subscribe(self, topic: str, group: Optional[str] = None, chunk_size: int = 500,
+                  start: str = "earliest") -> Subscription:
+        """Records after the group's committed position; `start` (earliest | latest) applies when it has none."""
+
+    async def close(self):
+        pass
+
+
+class LocalBroker(StreamBus):
+    """In-process broker on the FS topics: the topic files are the durable log and offsets are
+    the FSBus consumer-group offsets, so batch and streaming runs share state. Publishing wakes
+    this process's subscribers at once; writes by other processes are picked up by polling."""
+    def __init__(self, fs: FSBus, poll_interval: float = 0.5):
+        self.fs = fs
+        self.poll_interval = poll_interval
+        self._wake: Dict[str, asyncio.Event] = {}
+
+    def _event(self, topic: str) -> asyncio.Event:
+        return self._wake.setdefault(topic, asyncio.Event())
+
+    async def publish(self, topic, records):
+        if not records: return
+        def append():
+            with self.fs.producer(topic) as w:
+                w.produce_many(records)
+        await asyncio.to_thread(append)
+        self._event(topic).set()
+
+    def subscribe(self, topic, group=None, chunk_size=500, start="earliest"):
+        return _LocalSubscription(self, topic, group, chunk_size, start)
+
+
+class _LocalSubscription(Subscription):
+    def __init__(self, broker: LocalBroker, topic, group, chunk_size, start):
+        self.broker = broker; self.topic = topic; self.group = group
+        self.reader = broker.fs.consumer(topic, group, chunk_size=chunk_size)
+        if start == "latest" and not (group and broker.fs.offset_path(topic, group).exists()):
+            self.reader.position = self.reader.end()
+
+    async def batches(self):
+        ev = self.broker._event(self.topic)
+        while True:
+            ev.clear()
+            it = iter(self.reader)
+            while (chunk := await asyncio.to_thread(next, it, None)) is not None:
+                yield chunk, self.reader.position
+            try:
+                await asyncio.wait_for(ev.wait(), self.broker.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def commit(self, position):
+        if self.group:
+            await asyncio.to_thread(self.reader.commit, position)
+
+
+class KafkaBus(StreamBus):
+    """Kafka backend (requires aiokafka); records are JSON values, positions per-partition offsets."""
+    def __init__(self, bootstrap_servers: str):
+        try:
+            import aiokafka
+        except ImportError:
+            raise SystemExit("transport.mode kafka needs aiokafka: pip install aiokafka")
+        self.aiokafka = aiokafka
+        self.servers = bootstrap_servers
+        self._producer = None
+
+    async def publish(self, topic, records):
+        if not records: return
+        if self._producer is None:
+            self._producer = self.aiokafka.AIOKafkaProducer(
+                bootstrap_servers=self.servers, value_serializer=lambda r: json.dumps(r, ensure_ascii=False).encode("utf-8"))
+            await self._producer.start()
+        for r in records:
+            await self._producer.send(topic, r)
+        await self._producer.flush()
+
+    def subscribe(self, topic, group=None, chunk_size=500, start="earliest"):
+        return _KafkaSubscription(self, topic, group, chunk_size, start)
+
+    async def close(self):
+        if self._producer is not None:
+            await self._producer.stop()
+
+
+class _KafkaSubscription(Subscription):
+    def __init__(self, bus: KafkaBus, topic, group, chunk_size, start):
+        self.bus = bus; self.topic = topic; self.group = group; self.chunk_size = chunk_size; self.start = start
+        self.consumer = None
+
+    async def batches(self):
+        self.consumer = self.bus.aiokafka.AIOKafkaConsumer(
+            self.topic, bootstrap_servers=self.bus.servers, group_id=self.group, enable_auto_commit=False,
+            auto_offset_reset=self.start, value_deserializer=lambda b: json.loads(b.decode("utf-8")))
+        await self.consumer.start()
+        try:
+            while True:
+                got = await self.consumer.getmany(timeout_ms=500, max_records=self.chunk_size)
+                for tp, msgs in got.items():
+                    if msgs:
+                        yield [m.value for m in msgs], {tp: msgs[-1].offset + 1}
+        finally:
+            await self.consumer.stop()
+
+    async def commit(self, position):
+        if self.group and self.consumer is not None:
+            await self.consumer.commit(position)
+
+
+def make_bus(cfg, fs: FSBus, mode: Optional[str] = None) -> StreamBus:
+    mode = mode or cfg["transport"]["mode"]
+    if mode == "kafka":
+        return KafkaBus(cfg["transport"]["kafka"]["bootstrap_servers"])
+    return LocalBroker(fs, cfg["transport"]["stream"]["poll_interval_s"])
+
+
+def _merge(pos, p):
+    return {**pos, **p} if isinstance(p, dict) and isinstance(pos, dict) else p
+
+async def micro_batches(sub: Subscription, handler: Callable[[list], list], publish: Optional[Callable] = None,
+                        batch_size: int = 500, max_wait: float = 1.0, queue_chunks: int = 4, name: str = ""):
+    """Consume `sub` until it ends (live subscriptions never do): chunks go through a bounded queue
+    (a slow handler stops the fetcher, which stops reading the log), are grouped into batches of up
+    to batch_size records or max_wait seconds after the first arrives, handled in a worker thread,
+    published, then committed."""
+    q: asyncio.Queue = asyncio.Queue(maxsize=queue_chunks)
+    async def fetch():
+        async for chunk, pos in sub.batches():
+            await q.put((chunk, pos))
+    fetcher = asyncio.create_task(fetch())
+    loop = asyncio.get_running_loop()
+    with metrics.stage(name or "stream"):
+        try:
+            while True:
+                get = asyncio.ensure_future(q.get())
+                done, _ = await asyncio.wait({get, fetcher}, return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    recs, pos = get.result()
+                else:
+                    get.cancel(); fetcher.result()  # fetcher died: surface its error
+                    if q.empty(): return  # subscription exhausted and every chunk handled
+                    recs, pos = q.get_nowait()
+                recs = list(recs)
+                deadline = loop.time() + max_wait
+                while len(recs) < batch_size and loop.time() < deadline:
+                    if q.empty():
+                        await asyncio.sleep(min(0.05, max(0.0, deadline - loop.time()))); continue
+                    chunk, p = q.get_nowait(); recs.extend(chunk); pos = _merge(pos, p)
+                t0 = time.perf_counter()
+                out = await asyncio.to_thread(handler, recs)
+                if publish is not None and out:
+                    await publish(out)
+                await sub.commit(pos)
+                secs = time.perf_counter()-t0
+                metrics.count("records_in", len(recs)); metrics.count("records_out", len(out or []))
+                metrics.observe("batch_seconds", secs); metrics.flush()
+                print(f"[{name}] {len(recs)} in → {len(out or [])} out in {secs:.2f}s", flush=True)
+        finally:
+            fetcher.cancel()
@@ -0,0 +1,117 @@
+import numpy as np, pandas as pd
+from typing import Iterator, Dict, Any, List
+
+REGIONS = ["EU","NA","APAC","LATAM"]
+CATEGORIES = {"Electronics": ["Laptops","Smartphones","Tablets"], "Apparel": ["Shirts","Shoes"], "Grocery": ["Beverages","Snacks"]}
+EVENTS = ["RegulatoryChange","LaborStrike","SupplyChainDisruption","ProductRecall","WeatherDisaster"]
+PLANTED = ["price_jump","units_drop","units_spike"]
+
+def _rng(seed: int, *key: int) -> np.random.Generator:
+    return np.random.default_rng(np.random.SeedSequence([seed, *key]))
+
+def sku_table(n_skus: int, seed: int = 42) -> pd.DataFrame:
+    """Static per-SKU attributes: segment, brand and demand/price levels."""
+    rng = _rng(seed, 0)
+    cats = np.array(list(CATEGORIES))
+    cat = cats[rng.integers(0, len(cats), n_skus)]
+    sub = np.array([CATEGORIES[c][i % len(CATEGORIES[c])] for c, i in zip(cat, rng.integers(0, 6, n_skus))])
+    return pd.DataFrame({
+        "SKU": [f"SKU_{i+1}" for i in range(n_skus)],
+        "Product_Category": cat, "Sub_Category": sub,
+        "Brand": np.array(["Brand_A","Brand_B","Brand_C","Brand_D"])[rng.integers(0, 4, n_skus)],
+        "Region": np.array(REGIONS)[rng.integers(0, len(REGIONS), n_skus)],
+        "base_units": rng.lognormal(3.0, 0.4, n_skus),
+        "base_price": rng.lognormal(4.0, 0.6, n_skus),
+    })
+
+def synth_sales_chunks(n_skus: int, n_days: int, seed: int = 42, anomaly_rate: float = 0.01,
+                       start: str = "2025-01-01", chunk_skus: int = 10000) -> Iterator[pd.DataFrame]:
+    """Daily sales for n_skus × n_days in the input CSV schema, generated in SKU blocks.
+
+    Each block has its own seeded stream, so output is reproducible for a given
+    (seed, chunk_skus) and memory stays bounded at 10⁷+ rows. Planted anomalies
+    are labelled in the Planted_Anomaly column ("" for normal rows).
+    """
+    skus = sku_table(n_skus, seed)
+    days = pd.date_range(start, periods=n_days, freq="D")
+    dow = np.asarray(days.dayofweek)
+    for b, s in enumerate(range(0, n_skus, chunk_skus)):
+        t = skus.iloc[s:s+chunk_skus]; m = len(t); rng = _rng(seed, 1, b)
+        season = 1.0 + 0.15*np.sin(2*np.pi*np.arange(n_days)/7.0)[None, :] + 0.1*(dow[None, :]>=5)
+        lam = t["base_units"].to_numpy()[:, None]*season*rng.lognormal(0, 0.1, (m, n_days))
+        price = t["base_price"].to_numpy()[:, None]*rng.normal(1.0, 0.03, (m, n_days))
+
+        kind = np.full((m, n_days), "", dtype=object)
+        hit = rng.random((m, n_days)) < anomaly_rate
+        hit[:, :14] = False  # leave a warm-up period for the rolling detectors
+        k = rng.integers(0, len(PLANTED), hit.sum())
+        kind[hit] = np.array(PLANTED)[k]
+        mag = rng.uniform(1.8, 3.0, hit.sum())
+        price[hit] = np.where(k==0, price[hit]*mag, price[hit])
+        lam[hit] = np.where(k==1, lam[hit]/mag, np.where(k==2, lam[hit]*mag, lam[hit]))
+        units = np.maximum(rng.poisson(lam), 1)
+
+        promo = rng.random((m, n_days)) < 0.1
+        yield pd.DataFrame({
+            "Date": np.tile(days.strftime("%Y-%m-%d").to_numpy(), m),
+            "SKU": np.repeat(t["SKU"].to_numpy(), n_days),
+            "Product_Category": np.repeat(t["Product_Category"].to_numpy(), n_days),
+            "Brand": np.repeat(t["Brand"].to_numpy(), n_days),
+            "Region": np.repeat(t["Region"].to_numpy(), n_days),
+            "Sales_Amount": np.round(units*price, 2).ravel(),
+            "Units_Sold": units.ravel(),
+            "Promotion_Applied": np.where(promo, "Yes", "No").ravel(),
+            "Holiday_Season": np.where(np.isin(np.asarray(days.month), [11,12]), "Yes", "No")[None, :].repeat(m, 0).ravel(),
+            "Sub_Category": np.repeat(t["Sub_Category"].to_numpy(), n_days),
+            "Planted_Anomaly": kind.ravel(),
+        })
+
+def write_sales_csv(path, n_skus: int, n_days: int, seed: int = 42, anomaly_rate: float = 0.01, **kw) -> pd.DataFrame:
+    """Stream synthetic sales to CSV; returns the planted anomalies (Date, SKU, Region, Product_Category, Planted_Anomaly)."""
+    planted = []
+    for i, chunk in enumerate(synth_sales_chunks(n_skus, n_days, seed, anomaly_rate, **kw)):
+        chunk.to_csv(path, mode="w" if i==0 else "a", header=i==0, index=False)
+        planted.append(chunk.loc[chunk["Planted_Anomaly"]!="", ["Date","SKU","Region","Product_Category","Planted_Anomaly"]])
+    return pd.concat(planted, ignore_index=True) if planted else pd.DataFrame()
+
+TITLES = {
+    "RegulatoryChange": ["New tariff policy impacts {c} in {r}", "{c} duties revised across {r}"],
+    "LaborStrike": ["Labor strike disrupts {c} logistics in {r}", "Union action halts shipments for {c} in {r}"],
+    "SupplyChainDisruption": ["Port congestion delays {c} deliveries in {r}", "Global shipping backlog hits {c} in {r}"],
+    "ProductRecall": ["Safety recall announced for {c} across {r}", "Quality issue triggers {c} product recall in {r}"],
+    "WeatherDisaster": ["Severe weather impacts {c} distribution in {r}", "Flooding disrupts {c} warehouses in {r}"],
+    "GeneralEvent": ["{c} market watch across {r}"],
+}
+
+def synth_news(dates, regions, categories, seed: int = 42, event_types=None, prefix: str = "news") -> List[Dict[str, Any]]:
+    """Raw news items (raw.news.html schema) for parallel arrays of dates/regions/categories.
+
+    Event types, templates and source scores are drawn in bulk; titles and summaries
+    are formatted once per distinct (event, template, category, region).
+    """
+    n = len(dates); rng = _rng(seed, 2)
+    evts = np.asarray(event_types) if event_types is not None else np.array(EVENTS)[rng.integers(0, len(EVENTS), n)]
+    tmpl = rng.integers(0, 2, n)
+    score = np.round(rng.uniform(0.6, 0.95, n), 2)
+    ts = pd.DatetimeIndex(pd.to_datetime(dates)) + pd.to_timedelta(rng.integers(0, 86400, n), unit="s")
+    day = ts.strftime("%Y-%m-%d"); iso = ts.strftime("%Y-%m-%dT%H:%M:%S")
+    text = {}
+    out = []
+    for i, (e, t, c, r) in enumerate(zip(evts, tmpl, categories, regions)):
+        key = (e, t, c, r)
+        if key not in text:
+            opts = TITLES.get(e, TITLES["GeneralEvent"]); title = opts[t % len(opts)].format(c=c, r=r)
+            summary = f"{title}. Analysts expect short-term volatility. Category={c}, Region={r}."
+            text[key] = (title, summary, f"<html><body><h1>{title}</h1><p>{summary}</p></body></html>")
+        title, summary, html = text[key]
+        out.append({"news_id": f"{prefix}-{day[i]}-{i:08d}", "published_at": iso[i], "title": title, "summary": summary,
+                    "html": html, "region": r, "categories": [c], "event_type": e, "source_score": float(score[i])})
+    return out
+
+def background_news(start: str, n_days: int, per_day: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Uncorrelated news across all segments, per_day items per day."""
+    rng = _rng(seed, 3); n = n_days*per_day
+    dates = np.repeat(pd.date_range(start, periods=n_days, freq="D"), per_day)
+    return synth_news(dates, np.array(REGIONS)[rng.integers(0, len(REGIONS), n)],
+                      np.array(list(CATEGORIES))[rng.integers(0, len(CATEGORIES), n)],
+                      seed=seed+1, event_types=np.array(EVENTS+["GeneralEvent"])[rng.integers(0, len(EVENTS)+1, n)], prefix="bg")
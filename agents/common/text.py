@@ -1,14 +1,18 @@
-import re
-import pandas as pd
+import functools, json, pathlib, re, warnings
+from typing import TYPE_CHECKING, Optional, Sequence
+if TYPE_CHECKING:
+    import pandas as pd
 
 WS = re.compile(r"\s+")
+WORD_CHAR = re.compile(r"\w")
 
 def clean_text(s: str) -> str:
     s = (s or "").replace("\u00A0"," ")
     s = WS.sub(" ", s).strip()
     return s
 
-def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
+def standardize_columns(df: "pd.DataFrame") -> "pd.DataFrame":
+    import pandas as pd  # only the sales-table agents need it
     cols = {c.lower(): c for c in df.columns}
     # date
     if "date" in cols:
@@ -41,31 +45,132 @@ def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
     df["avg_price"] = df["sales"] / df["units"].replace(0, pd.NA)
     return df
 
+class KeywordClassifier:
+    """Event type, region and category of news text from one scan (the `taxonomy` config).
+
+    Every field's keywords compile into a single regex shaped like a trie, so shared
+    prefixes are tested once. Texts are split on whitespace and each distinct token is
+    matched once and memoized, so the cost per text is a dict lookup per word whatever
+    the size of the taxonomy; keywords spanning words ("united states") are checked
+    only in texts that contain them. Keywords match whole words ("eu" is not found in
+    "neutral"); a trailing "*" also accepts longer words ("tariff*" → "tariffs"), and
+    keywords with capitals ("US") are case-sensitive. Within a field the first label in
+    table order with a hit wins.
+    """
+    MEMO_MAX = 1 << 20
+
+    def __init__(self, taxonomy: dict):
+        self.fields = list(taxonomy)
+        self.fallback = {f: t.get("fallback") for f, t in taxonomy.items()}
+        self.labels = {f: list(t["labels"]) for f, t in taxonomy.items()}
+        self.exact, self.folded = {}, {}  # keyword -> ((field, label position, prefix), ...), case-sensitive / lowercased
+        words, phrases = [], []
+        for f, t in taxonomy.items():
+            for pos, kws in enumerate(t["labels"].values()):
+                for w in kws:
+                    prefix = w.endswith("*"); w = " ".join(w.rstrip("*").split())
+                    cs = w != w.lower(); key = w if cs else w.lower()
+                    table = self.exact if cs else self.folded
+                    table[key] = table.get(key, ()) + ((f, pos, prefix),)
+                    (phrases if " " in key else words).append((key, cs, prefix))
+        self.rx = _keyword_regex(words)
+        self.phrase_rx = _keyword_regex(phrases)
+        self.needles = sorted({k.lower().split()[0] for k, _, _ in phrases})  # cheap pre-check: first words
+        self.memo = {}
+
+    def _hits(self, text: str, rx) -> tuple:
+        out = []
+        for m in rx.finditer(text):
+            g = m.group(); longer = None  # whether the word goes on past the keyword
+            for f, pos, prefix in self.exact.get(g, ()) + self.folded.get(g.lower(), ()):
+                if not prefix:
+                    if longer is None: longer = WORD_CHAR.match(text, m.end()) is not None
+                    if longer: continue  # the same keyword is a prefix keyword elsewhere
+                out.append((f, pos))
+        return tuple(out)
+
+    def _best(self, text: str) -> dict:
+        best = {}
+        if not text: return best
+        hits = []
+        if self.rx is not None:
+            memo = self.memo; toks = text.split()
+            if len(memo) > self.MEMO_MAX: memo.clear()
+            for tok in set(toks).difference(memo): memo[tok] = self._hits(tok, self.rx)
+            for h in filter(None, map(memo.__getitem__, toks)): hits.extend(h)
+        if self.phrase_rx is not None:
+            low = text.lower()
+            if any(n in low for n in self.needles):
+                hits.extend(self._hits(" ".join(text.split()), self.phrase_rx))
+        for f, pos in hits:
+            if pos < best.get(f, len(self.labels[f])): best[f] = pos
+        return best
+
+    def classify(self, text: str, fields: Optional[Sequence[str]] = None, **fallback) -> dict:
+        """{field: label} for one text; fallback=... overrides a field's configured fallback."""
+        best = self._best(text)
+        return {f: self.labels[f][best[f]] if f in best else fallback.get(f, self.fallback[f]) for f in fields or self.fields}
+
+    def batch(self, texts, fields: Optional[Sequence[str]] = None, fallback: Optional[dict] = None) -> dict:
+        """{field: [label per text]} for a list or Series; a fallback may be a scalar or one value per text.
+        Repeated texts are scanned once."""
+        fields = list(fields or self.fields)
+        texts = texts.tolist() if hasattr(texts, "tolist") else list(texts)
+        fb = {f: (fallback or {}).get(f, self.fallback[f]) for f in fields}
+        fb = {f: v if v is None or isinstance(v, str) else v.tolist() if hasattr(v, "tolist") else list(v) for f, v in fb.items()}
+        seen = {}; out = {f: [] for f in fields}
+        for i, t in enumerate(texts):
+            best = seen.get(t)
+            if best is None: best = seen[t] = self._best(t)
+            for f in fields:
+                out[f].append(self.labels[f][best[f]] if f in best else fb[f] if fb[f] is None or isinstance(fb[f], str) else fb[f][i])
+        return out
+
+def _keyword_regex(keywords):
+    """One regex for (keyword, case-sensitive, prefix) triples, None if there are none."""
+    tries = ({}, {})
+    for key, cs, prefix in keywords:
+        node = tries[not cs]
+        for ch in key: node = node.setdefault(ch, {})
+        node[""] = node.get("", False) or prefix
+    alts = [f"(?-i:{_trie_regex(tries[0])})"] if tries[0] else []
+    if tries[1]: alts.append(_trie_regex(tries[1]))
+    return re.compile(r"(?<!\w)(?:" + "|".join(alts) + ")", re.I) if alts else None
+
+def _trie_regex(node: dict) -> str:
+    """Alternation for a trie of {char: subtrie}; "" marks a keyword end (True = prefix keyword).
+    Longer continuations come first, so the longest keyword that fits wins."""
+    alts = [re.escape(ch) + _trie_regex(sub) for ch, sub in sorted(node.items()) if ch]
+    if "" in node: alts.append("" if node[""] else r"(?!\w)")
+    return alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+
+_CLASSIFIERS = {}
+
+def classifier(cfg) -> KeywordClassifier:
+    """The compiled classifier for cfg["taxonomy"], built once per process."""
+    key = json.dumps(cfg["taxonomy"], sort_keys=True)
+    if key not in _CLASSIFIERS: _CLASSIFIERS[key] = KeywordClassifier(cfg["taxonomy"])
+    return _CLASSIFIERS[key]
+
+# Deprecated single-text helpers from before KeywordClassifier; they classify with the
+# taxonomy in the repository's config/config.yaml.
+
+@functools.lru_cache(maxsize=1)
+def _default_classifier() -> KeywordClassifier:
+    import yaml
+    return KeywordClassifier(yaml.safe_load(open(pathlib.Path(__file__).resolve().parents[2] / "config" / "config.yaml"))["taxonomy"])
+
+def _deprecated(name: str):
+    warnings.warn(f"text.{name} is deprecated; use text.classifier(cfg).classify() or .batch()", DeprecationWarning, stacklevel=3)
+
 def infer_event_type(t: str) -> str:
-    t = (t or "").lower()
-    if any(k in t for k in ["tariff","regulation","policy","duty","compliance"]):
-        return "RegulatoryChange"
-    if any(k in t for k in ["strike","walkout","labor","union"]):
-        return "LaborStrike"
-    if any(k in t for k in ["port","shipping","logistics","congestion","suez"]):
-        return "SupplyChainDisruption"
-    if any(k in t for k in ["recall","defect","safety"]):
-        return "ProductRecall"
-    if any(k in t for k in ["storm","flood","earthquake","cyclone"]):
-        return "WeatherDisaster"
-    return "GeneralEvent"
+    _deprecated("infer_event_type")
+    return _default_classifier().classify(t or "", ["event_type"])["event_type"]
 
 def infer_region(title: str, fallback="EU") -> str:
-    t = (title or "").lower()
-    if any(k in t for k in ["eu","europe","germany","france","italy"]): return "EU"
-    if any(k in t for k in ["united states","us "," usa","america"]): return "NA"
-    if any(k in t for k in ["india","china","apac","japan","korea"]): return "APAC"
-    if any(k in t for k in ["brazil","latam","mexico","argentina"]): return "LATAM"
-    return fallback
+    _deprecated("infer_region")
+    return _default_classifier().classify(title or "", ["region"], region=fallback)["region"]
 
 def infer_category(text: str, fallback="Electronics") -> str:
-    t = (text or "").lower()
-    if any(k in t for k in ["laptop","smartphone","semiconductor","electronics","device"]): return "Electronics"
-    if any(k in t for k in ["apparel","clothing","fashion"]): return "Apparel"
-    if any(k in t for k in ["grocery","food","beverage"]): return "Grocery"
-    return fallback
+    _deprecated("infer_category")
+    return _default_classifier().classify(text or "", ["category"], category=fallback)["category"]
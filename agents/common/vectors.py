@@ -1,34 +1,157 @@
-import pathlib, joblib, numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
+import contextlib, hashlib, json, os, pathlib, shutil, time, uuid, numpy as np
+from agents.common import artifacts
+
+# sklearn and annoy are imported where they are used: a run served from the embedding
+# cache and the vector store never needs them.
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path, timeout: float = 60.0):
+    """Exclusive lock via an O_EXCL lock file (portable); timeout=0 fails at once if it is held."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.monotonic()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY); break
+        except FileExistsError:
+            if time.monotonic() - t0 >= timeout:
+                raise TimeoutError(f"{path} is held; remove it if no other writer is running")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd); os.unlink(path)
+
+
+class EmbeddingCache:
+    """Content-addressed embeddings for one model version.
+
+    <root>/<version>/vectors.f32 holds float32 rows and keys.bin the SHA-1 of each
+    row's text; both are append-only, so a reader only trusts the rows present in both,
+    and a writer first cuts both back to those rows (a crash can leave one file ahead).
+    """
+    def __init__(self, root: pathlib.Path, version: int, dim: int):
+        self.dir = pathlib.Path(root) / str(version)
+        self.dim = dim
+        self._n = -1; self._sorted = None; self._order = None; self._M = None
+
+    @staticmethod
+    def keys(texts) -> np.ndarray:
+        return np.array([hashlib.sha1(t.encode("utf-8")).digest() for t in texts], dtype="S20")
+
+    def _rows(self) -> int:
+        kp, vp = self.dir / "keys.bin", self.dir / "vectors.f32"
+        return min(kp.stat().st_size // 20 if kp.exists() else 0, vp.stat().st_size // (4*self.dim) if vp.exists() else 0)
+
+    def _refresh(self):
+        n = self._rows()
+        if n == self._n: return
+        kp, vp = self.dir / "keys.bin", self.dir / "vectors.f32"
+        if 0 <= self._n < n:  # appended since: merge the new keys into the sorted index, O(N + k log k)
+            new = np.fromfile(kp, dtype="S20", count=n-self._n, offset=20*self._n)
+            o = np.argsort(new, kind="stable"); at = np.searchsorted(self._sorted, new[o], side="right")
+            self._sorted = np.insert(self._sorted, at, new[o]); self._order = np.insert(self._order, at, o + self._n)
+        else:
+            keys = np.fromfile(kp, dtype="S20", count=n) if n else np.empty(0, dtype="S20")
+            self._order = np.argsort(keys, kind="stable"); self._sorted = keys[self._order]
+        self._M = np.memmap(vp, dtype=np.float32, mode="r", shape=(n, self.dim)) if n else np.empty((0, self.dim), np.float32)
+        self._n = n
+
+    def __len__(self):
+        self._refresh(); return self._n
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Row of each key, -1 where the text has not been embedded under this version."""
+        self._refresh()
+        if not self._n: return np.full(len(keys), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self._sorted, keys), self._n-1)
+        return np.where(self._sorted[i] == keys, self._order[i], -1)
+
+    def get(self, rows: np.ndarray) -> np.ndarray:
+        self._refresh(); return np.asarray(self._M[rows])
+
+    def add(self, keys: np.ndarray, Z: np.ndarray):
+        with file_lock(self.dir / ".lock"):
+            n = self._rows()
+            for f, size in (("vectors.f32", 4*self.dim*n), ("keys.bin", 20*n)):
+                if (self.dir / f).exists(): os.truncate(self.dir / f, size)
+            with open(self.dir / "vectors.f32", "ab") as f: f.write(np.ascontiguousarray(Z, dtype=np.float32).tobytes())
+            with open(self.dir / "keys.bin", "ab") as f: f.write(np.asarray(keys, dtype="S20").tobytes())
+
 
 class Vectorizer:
-    def __init__(self, models_dir: str, n_components: int = 256):
+    def __init__(self, models_dir: str, n_components: int = 256, cache: bool = True):
         self.models_dir = pathlib.Path(models_dir)
         self.models_dir.mkdir(parents=True, exist_ok=True)
         self.vec_path = self.models_dir / "tfidf.joblib"
         self.svd_path = self.models_dir / "svd.joblib"
+        self.cache_dir = self.models_dir / "embcache"
         self.vectorizer = None
         self.svd = None
         self.n_components = n_components
+        self.cache = cache
+        self._cache = None
+        self._loaded = None  # version of the model held in memory
 
     def fit(self, texts: list[str]):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.decomposition import TruncatedSVD
         self.vectorizer = TfidfVectorizer(ngram_range=(1,2), min_df=2, max_features=60000)
         X = self.vectorizer.fit_transform(texts)
         k = min(self.n_components, min(X.shape)-1)
         self.svd = TruncatedSVD(n_components=k)
         Z = self.svd.fit_transform(X)
-        joblib.dump(self.vectorizer, self.vec_path)
-        joblib.dump(self.svd, self.svd_path)
-        return self._l2(Z)
+        h = artifacts.input_hash(texts)
+        artifacts.save(self.vectorizer, self.vec_path, input_hash=h, n_features=len(self.vectorizer.vocabulary_))
+        artifacts.save(self.svd, self.svd_path, dim=k, input_hash=h, n_texts=len(texts))
+        self._loaded = self.version()
+        Z = self._l2(Z)
+        if self.cache:
+            for d in self.cache_dir.glob("*"):  # embeddings of older fits are unreachable now
+                if d.is_dir() and d.name != str(self.version()): shutil.rmtree(d, ignore_errors=True)
+            keys, first = np.unique(EmbeddingCache.keys(texts), return_index=True)
+            self.embedding_cache().add(keys, Z[first])
+        return Z
+
+    def version(self) -> int:
+        """Changes whenever the model is refitted; vectors from different versions are not comparable."""
+        return artifacts.version(self.svd_path)
+
+    @property
+    def dim(self) -> int:
+        """Embedding size, from the SVD sidecar when there is one (no unpickling)."""
+        m = artifacts.meta(self.svd_path)
+        if m and m.get("dim"): return m["dim"]
+        if self.svd is None: self.load()
+        return self.svd.components_.shape[0]
 
     def load(self):
-        self.vectorizer = joblib.load(self.vec_path)
-        self.svd = joblib.load(self.svd_path)
+        self._loaded = self.version()
+        self.vectorizer = artifacts.load(self.vec_path)
+        self.svd = artifacts.load(self.svd_path)
+
+    def embedding_cache(self) -> EmbeddingCache:
+        v = self.version()
+        if self._cache is None or self._cache.dir.name != str(v):
+            self._cache = EmbeddingCache(self.cache_dir, v, self.dim)
+            self._cache.dir.mkdir(parents=True, exist_ok=True)
+        return self._cache
 
     def transform(self, texts: list[str]) -> np.ndarray:
-        if self.vectorizer is None or self.svd is None:
-            self.load()
+        """Unit vectors for texts; with the cache on, already-embedded texts are read back (float32) instead of recomputed."""
+        if not self.cache:
+            return self._embed(texts)
+        c = self.embedding_cache(); keys = EmbeddingCache.keys(texts)
+        rows = c.lookup(keys)
+        miss = np.flatnonzero(rows < 0)
+        if len(miss):
+            uk, first = np.unique(keys[miss], return_index=True)
+            c.add(uk, self._embed([texts[miss[j]] for j in first]))
+            rows = c.lookup(keys)
+        return c.get(rows)
+
+    def _embed(self, texts):
+        if self.vectorizer is None or self.svd is None or self._loaded != self.version():
+            self.load()  # first use, or refitted by another process since
         X = self.vectorizer.transform(texts)
         Z = self.svd.transform(X)
         return self._l2(Z)
@@ -38,3 +161,179 @@ class Vectorizer:
         Z = np.asarray(Z)
         n = np.linalg.norm(Z, axis=1, keepdims=True) + 1e-9
         return Z / n
+
+
+class VectorStore:
+    """Append-only news vectors keyed by row id (a curated item's vec_index).
+
+    A compacted base segment is searched with Annoy; rows appended since the last
+    compaction live in small delta segments that are searched exactly. Appends never
+    touch existing rows, compaction folds the deltas into a new base generation, and a
+    refit rewrites every row under the same ids. vectors/manifest.json names the live
+    files and is replaced atomically, so readers always see a consistent set.
+    """
+    def __init__(self, models_dir: str, n_trees: int = 10):
+        self.root = pathlib.Path(models_dir)
+        self.dir = self.root / "vectors"
+        self.manifest_path = self.dir / "manifest.json"
+        self.n_trees = n_trees
+        self.m = self._read()
+        self._ann = None; self._base = None; self._deltas = []
+
+    def _read(self):
+        if self.manifest_path.exists():
+            return json.loads(self.manifest_path.read_text())
+        if (self.root / "annoy.index").exists():  # index built before the store existed
+            return {"generation": 0, "model_version": None, "dim": None, "fitted_rows": None,
+                    "base": {"index": "annoy.index", "vectors": None, "rows": None}, "deltas": []}
+        return None
+
+    def exists(self) -> bool:
+        return self.m is not None
+
+    @property
+    def dim(self): return self.m and self.m["dim"]
+
+    @property
+    def model_version(self): return self.m and self.m["model_version"]
+
+    @property
+    def base_rows(self) -> int:
+        return self.m["base"]["rows"] or 0
+
+    @property
+    def delta_rows(self) -> int:
+        return sum(d["rows"] for d in self.m["deltas"])
+
+    def __len__(self):
+        return self.base_rows + self.delta_rows if self.m else 0
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with file_lock(self.dir / ".manifest.lock"):
+            self.m = self._read()
+            yield
+
+    def _commit(self, m):
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(m, indent=1))
+        os.replace(tmp, self.manifest_path)
+        self.m = m; self._ann = None; self._base = None; self._deltas = []
+
+    def write_base(self, Z: np.ndarray, model_version) -> None:
+        """Replace the whole store with Z (rows 0..len(Z)-1), e.g. after a (re)fit."""
+        self._write_base(np.asarray(Z, dtype=np.float32), model_version, fitted_rows=len(Z))
+
+    def _write_base(self, Z, model_version, fitted_rows, keep_from=None, expect_gen=None):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tag = uuid.uuid4().hex[:12]
+        vec_name, idx_name = f"base-{tag}.npy", f"base-{tag}.annoy"
+        np.save(self.dir / vec_name, Z)
+        from annoy import AnnoyIndex
+        idx = AnnoyIndex(Z.shape[1], "angular")
+        for i, v in enumerate(Z):
+            idx.add_item(i, v.tolist())
+        idx.build(self.n_trees)
+        idx.save(str(self.dir / idx_name))
+        with self._locked():
+            old = self.m
+            if expect_gen is not None and old["generation"] != expect_gen:  # refitted meanwhile: drop this result
+                (self.dir / vec_name).unlink(); (self.dir / idx_name).unlink(); return
+            gen = old["generation"] + 1 if old else 0
+            deltas = [d for d in old["deltas"] if d["start"] >= keep_from] if (old and keep_from is not None) else []
+            self._commit({"generation": gen, "model_version": model_version, "dim": int(Z.shape[1]), "fitted_rows": int(fitted_rows),
+                          "base": {"index": f"vectors/{idx_name}", "vectors": f"vectors/{vec_name}", "rows": int(len(Z))},
+                          "deltas": deltas})
+        self._gc(old)
+
+    def _gc(self, old):
+        """Delete files the previous manifest used and the current one does not (readers keep open mmaps)."""
+        if not old: return
+        live = {self.m["base"]["index"], self.m["base"]["vectors"]} | {d["vectors"] for d in self.m["deltas"]}
+        for f in [old["base"]["index"], old["base"]["vectors"]] + [d["vectors"] for d in old["deltas"]]:
+            if f and f not in live and f != "annoy.index":
+                (self.root / f).unlink(missing_ok=True)
+
+    def append(self, Z: np.ndarray, model_version) -> np.ndarray:
+        """Add rows as a new delta segment; returns their ids. Z must come from the store's model."""
+        Z = np.asarray(Z, dtype=np.float32)
+        if not len(Z): return np.empty(0, dtype=np.int64)
+        if not self.exists():
+            self.write_base(Z, model_version); return np.arange(len(Z))
+        if model_version != self.model_version:
+            raise ValueError("vectors come from a different model than the store; refit instead of appending")
+        name = f"vectors/delta-{uuid.uuid4().hex[:12]}.npy"
+        np.save(self.root / name, Z)
+        with self._locked():
+            start = len(self)
+            self._commit({**self.m, "deltas": self.m["deltas"] + [{"vectors": name, "start": start, "rows": int(len(Z))}]})
+        return np.arange(start, start + len(Z))
+
+    def needs_compaction(self, max_deltas: int = 8, ratio: float = 0.2) -> bool:
+        return bool(self.m and self.m["deltas"]) and (len(self.m["deltas"]) > max_deltas or self.delta_rows > ratio*max(self.base_rows, 1))
+
+    def compact(self) -> bool:
+        """Fold the deltas present now into a new base; deltas appended meanwhile are kept.
+        Returns False at once if another compaction is already running."""
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(file_lock(self.dir / ".compact.lock", timeout=0))
+            except TimeoutError:
+                print(f"Compaction skipped: {self.dir / '.compact.lock'} is held by another compaction"); return False
+            self.load()
+            n = len(self)
+            if not self.m["deltas"]: return True
+            self._write_base(self.vectors(np.arange(n)), self.model_version, self.m["fitted_rows"], keep_from=n,
+                             expect_gen=self.m["generation"])
+            return True
+
+    # Annoy-compatible read side, so callers can use a store wherever they used an AnnoyIndex.
+    def load(self, dim: int = None):
+        if self._ann is not None: return self
+        if not self.exists(): raise FileNotFoundError(f"No vector store under {self.root}; run news_curation first")
+        f = self.dim or dim
+        if f is None: raise ValueError("legacy annoy.index without a manifest: pass dim")
+        from annoy import AnnoyIndex
+        self._ann = AnnoyIndex(f, "angular"); self._ann.load(str(self.root / self.m["base"]["index"]))  # mmap
+        b = self.m["base"]
+        self._base = np.load(self.root / b["vectors"], mmap_mode="r") if b["vectors"] else None
+        if b["rows"] is None: self.m = {**self.m, "dim": f, "base": {**b, "rows": self._ann.get_n_items()}}
+        self._deltas = [(d["start"], np.load(self.root / d["vectors"], mmap_mode="r")) for d in self.m["deltas"]]
+        return self
+
+    @property
+    def f(self) -> int:
+        return self.load()._ann.f
+
+    def get_n_items(self) -> int:
+        self.load(); return len(self)
+
+    def get_item_vector(self, i: int) -> list:
+        return self.vectors(np.array([i]))[0].tolist()
+
+    def vectors(self, ids: np.ndarray) -> np.ndarray:
+        """float32 rows for the given ids."""
+        self.load()
+        ids = np.asarray(ids, dtype=np.int64); out = np.empty((len(ids), self.f), dtype=np.float32)
+        base = ids < self.base_rows
+        if self._base is not None: out[base] = self._base[ids[base]]
+        else:
+            for j in np.flatnonzero(base): out[j] = self._ann.get_item_vector(int(ids[j]))
+        for start, D in self._deltas:
+            m = (ids >= start) & (ids < start + len(D))
+            out[m] = D[ids[m] - start]
+        return out
+
+    def get_nns_by_vector(self, v, n: int, include_distances: bool = False):
+        self.load()
+        ids, ds = self._ann.get_nns_by_vector(v, n, include_distances=True)
+        if self._deltas:
+            q = np.asarray(v, dtype=float); q = q / (np.linalg.norm(q) + 1e-12)
+            ids = [ids]; ds = [ds]
+            for start, D in self._deltas:
+                cos = (D @ q) / (np.linalg.norm(D, axis=1) + 1e-12)
+                ids.append(start + np.arange(len(D))); ds.append(np.sqrt(np.maximum(0.0, 2.0 - 2.0*cos)))
+            ids = np.concatenate(ids); ds = np.concatenate(ds)
+            o = np.argsort(ds, kind="stable")[:n]
+            ids = ids[o].tolist(); ds = ds[o].tolist()
+        return (ids, ds) if include_distances else ids
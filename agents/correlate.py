@@ -1,12 +1,14 @@
 #!/usr/bin/env python
-import argparse, yaml, json, pathlib
+import argparse, yaml, json, pathlib, os, threading, numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from dateutil import parser as dtp
-from annoy import AnnoyIndex
 from agents.common.io import FSBus
-from agents.common.vectors import Vectorizer
+from agents.common.vectors import Vectorizer, VectorStore
 from agents.common.rules import direction_bonus
+from agents.common import metrics
 
 TOPIC_CUR="news.curated"; TOPIC_EXT="news.anomalies"; TOPIC_INT="internal.anomalies"
+N_NEIGHBOURS=100; MAX_DAYS=7; MIN_SCORE=0.65
 
 def sig_internal(a: dict) -> str:
     m=a.get("metrics",{}); reg=a.get("region","EU"); cat=a.get("category","Electronics")
@@ -23,47 +25,316 @@ def cat_match(c_ext, c_int):
     s=set([x.lower() for x in c_ext or []])
     return 1.0 if (c_int or "").lower() in s else (0.5 if any((c_int or "").lower() in x for x in s) else 0.0)
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    ap.add_argument("--topk", type=int, default=3)
-    args = ap.parse_args()
+def time_align_days(d, max_days=7):
+    """Vectorized time_align over an array of day differences (t_int - t_ext)."""
+    return np.where(d<0, np.maximum(0.0, 1.0 + d/2.0), np.where(d<=max_days, (max_days - d)/max_days, 0.0))
 
-    cfg = yaml.safe_load(open("config/config.yaml","r"))
-    bus = FSBus(cfg["paths"]["topics_dir"])
-    cur = bus.read_all(TOPIC_CUR); ext = bus.read_all(TOPIC_EXT); itn = bus.read_all(TOPIC_INT)
-    if not (cur and ext and itn):
-        print("Missing inputs for correlation."); return
+def day_ordinal(s: str) -> int:
+    return dtp.parse(s).date().toordinal()
 
-    vec = Vectorizer(cfg["paths"]["models_dir"])
-    d = vec.transform(["probe"]).shape[1]
-    ann = AnnoyIndex(d, "angular")
-    ann.load(str(pathlib.Path(cfg["paths"]["models_dir"]) / "annoy.index"))
+class NewsTable:
+    """Curated news pre-parsed once into arrays the batched scorer can gather from."""
+    def __init__(self, cur: list):
+        self.cur = cur
+        self.day = np.array([day_ordinal(n["published_at"]) for n in cur], dtype=np.int64)
+        self.geo = np.array([(n.get("region") or "")[:1].upper() for n in cur], dtype=object)
+        self.events, self.evt = np.unique([n.get("event_type","GeneralEvent") for n in cur], return_inverse=True)
+        self.cats = [n.get("categories") for n in cur]
+        self._cat_cache = {}
+        self.vid = np.array([n.get("vec_index", i) for i, n in enumerate(cur)], dtype=np.int64)
+        self.pos = np.full(self.vid.max()+1 if len(cur) else 0, -1, dtype=np.int64)
+        self.pos[self.vid[::-1]] = np.arange(len(cur))[::-1]  # first item wins for repeated ids
+
+    def positions(self, ids) -> np.ndarray:
+        """Positions in cur for vector-store ids; -1 for ids without a curated item."""
+        ids = np.asarray(ids, dtype=np.int64); out = np.full(len(ids), -1, dtype=np.int64)
+        ok = ids < len(self.pos); out[ok] = self.pos[ids[ok]]
+        return out
+
+    def cat_scores(self, c_int: str) -> np.ndarray:
+        if c_int not in self._cat_cache:
+            self._cat_cache[c_int] = np.array([cat_match(c, c_int) for c in self.cats])
+        return self._cat_cache[c_int]
+
+class SegmentIndex:
+    """Curated news keyed by (region initial, lowercased category), each posting list sorted by day.
 
+    candidates() returns every item that can score on time, geo and category for an
+    anomaly, i.e. t_int - t_ext in [-1, max_days-1] and a matching segment, so the
+    work per anomaly depends on its segment's volume rather than on corpus size.
+    """
+    def __init__(self, news: NewsTable, max_days=MAX_DAYS):
+        self.max_days = max_days
+        postings = {}
+        for i, cats in enumerate(news.cats):
+            for c in set(x.lower() for x in cats or []):
+                postings.setdefault((news.geo[i], c), []).append(i)
+        self.postings = {}
+        for key, ix in postings.items():
+            ix = np.array(ix, dtype=np.int64); o = np.argsort(news.day[ix], kind="stable")
+            self.postings[key] = (news.day[ix][o], ix[o])
+        self.by_geo = {}
+        for g, c in self.postings:
+            self.by_geo.setdefault(g, []).append(c)
+
+    def candidates(self, geo: str, cat: str, day: int) -> np.ndarray:
+        c_int = (cat or "").lower(); parts = []
+        for c in self.by_geo.get(geo, []):
+            if c_int in c:
+                days, ix = self.postings[(geo, c)]
+                lo = np.searchsorted(days, day-(self.max_days-1), "left"); hi = np.searchsorted(days, day+1, "right")
+                parts.append(ix[lo:hi])
+        if not parts: return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts)) if len(parts)>1 else parts[0]
+
+class NewsVectors:
+    """Lazily fetched copy of the stored news vectors (already unit length), indexed by vector id."""
+    def __init__(self, ann):
+        self.ann = ann; self.M = None; self.have = None
+    def get(self, ix: np.ndarray) -> np.ndarray:
+        if hasattr(self.ann, "vectors"): return self.ann.vectors(ix)
+        if self.M is None:
+            n = self.ann.get_n_items(); self.M = np.zeros((n, self.ann.f), dtype=np.float32); self.have = np.zeros(n, dtype=bool)
+        miss = np.unique(ix[~self.have[ix]])
+        for i in miss: self.M[i] = self.ann.get_item_vector(int(i))
+        self.have[miss] = True
+        return self.M[ix]
+
+def ann_pairs(ann, V, n, news: NewsTable, rows=None):
+    """Bulk nearest-neighbour lookup flattened to (row, news position, angular distance) triples."""
+    a_ix, n_ix, dists = [], [], []
+    for r in (range(len(V)) if rows is None else rows):
+        ix, ds = ann.get_nns_by_vector(V[r].tolist(), n, include_distances=True)
+        a_ix.extend([r]*len(ix)); n_ix.extend(ix); dists.extend(ds)
+    a_ix = np.array(a_ix, dtype=np.int64); n_ix = news.positions(n_ix); dists = np.array(dists, dtype=float)
+    ok = n_ix >= 0
+    return a_ix[ok], n_ix[ok], dists[ok]
+
+def segment_pairs(anoms, V, index: SegmentIndex, nvec: NewsVectors, ann, n, news: NewsTable):
+    """Exact text distances over each anomaly's segment/time candidates; Annoy for anomalies with none."""
+    a_ix, n_ix, fallback = [], [], []
+    for r, a in enumerate(anoms):
+        ix = index.candidates((a.get("region") or "")[:1].upper(), a.get("category"), day_ordinal(a["date"]))
+        if len(ix): a_ix.append(np.full(len(ix), r, dtype=np.int64)); n_ix.append(ix)
+        else: fallback.append(r)
+    a_ix = np.concatenate(a_ix) if a_ix else np.empty(0, dtype=np.int64)
+    n_ix = np.concatenate(n_ix) if n_ix else np.empty(0, dtype=np.int64)
+    N = nvec.get(news.vid[n_ix]).astype(float)
+    cos = np.einsum("ij,ij->i", V[a_ix], N) / (np.linalg.norm(N, axis=1)+1e-9)
+    dists = np.sqrt(np.maximum(0.0, 2.0 - 2.0*cos))
+    if fallback:
+        fa, fn, fd = ann_pairs(ann, V, n, news, fallback)
+        a_ix = np.r_[a_ix, fa]; n_ix = np.r_[n_ix, fn]; dists = np.r_[dists, fd]
+        o = np.argsort(a_ix, kind="stable"); a_ix, n_ix, dists = a_ix[o], n_ix[o], dists[o]
+    return a_ix, n_ix, dists
+
+def score_pairs(anoms, news: NewsTable, a_ix, n_ix, dists):
+    """time/geo/category/text/direction scores for flattened (anomaly, candidate) pairs."""
+    t_int = np.array([day_ordinal(a["date"]) for a in anoms], dtype=np.int64)
+    t_score = time_align_days(t_int[a_ix] - news.day[n_ix], MAX_DAYS)
+    g_int = np.array([(a.get("region") or "")[:1].upper() for a in anoms], dtype=object)
+    g_score = (news.geo[n_ix] == g_int[a_ix]).astype(float)
+    cats, c_code = np.unique([str(a.get("category")) if a.get("category") is not None else "" for a in anoms], return_inverse=True)
+    c_score = np.zeros(len(a_ix))
+    for u, c in enumerate(cats):
+        m = c_code[a_ix]==u
+        c_score[m] = news.cat_scores(c)[n_ix[m]]
+    text_score = np.maximum(0.0, 1.0 - dists/2.0)
+    bonus = np.array([[direction_bonus(e, a.get("category","Electronics"), a.get("metrics",{})) for e in news.events] for a in anoms])
+    score = 0.30*t_score + 0.20*g_score + 0.20*c_score + 0.30*text_score
+    score += bonus[a_ix, news.evt[n_ix]]
+    return score, t_score, g_score, c_score, text_score
+
+class Corpus:
+    """Per-process news context: parsed table, segment index and fetched vectors are built once and reused."""
+    def __init__(self, cur, ann, candidates="segment"):
+        self.cur = cur
+        self.news = NewsTable(cur)
+        self.index = SegmentIndex(self.news) if candidates=="segment" else None
+        self.nvec = NewsVectors(ann)
+
+def correlate_batched(itn, cur, vec, ann, topk=3, chunk=4096, candidates="segment", corpus=None):
+    corpus = corpus or Corpus(cur, ann, candidates)
+    news, index, nvec = corpus.news, corpus.index, corpus.nvec
+    results=[]
+    for s in range(0, len(itn), chunk):
+        anoms = itn[s:s+chunk]
+        with metrics.phase("embed"):
+            V = vec.transform([sig_internal(a) for a in anoms])
+        with metrics.phase("candidates"):
+            if index is not None:
+                a_ix, n_ix, dists = segment_pairs(anoms, V, index, nvec, ann, N_NEIGHBOURS, news)
+            else:
+                a_ix, n_ix, dists = ann_pairs(ann, V, N_NEIGHBOURS, news)
+        with metrics.phase("score"):
+            score, t_score, g_score, c_score, text_score = score_pairs(anoms, news, a_ix, n_ix, dists)
+        bounds = np.searchsorted(a_ix, np.arange(len(anoms)+1))
+        for r, a in enumerate(anoms):
+            cands=[]
+            for j in bounds[r] + np.flatnonzero(score[bounds[r]:bounds[r+1]]>=MIN_SCORE):
+                cands.append({"news_id": cur[n_ix[j]]["news_id"], "overall": round(float(score[j]),3),
+                              "subs":{"time":round(float(t_score[j]),3),"geo":float(g_score[j]),"cat":float(c_score[j]),"text":round(float(text_score[j]),3)}})
+            cands=sorted(cands, key=lambda x: x["overall"], reverse=True)[:topk]
+            results.append({"internal_anomaly_id": a["anomaly_id"], "top_matches": cands})
+    return results
+
+def correlate_reference(itn, cur, vec, ann, topk=3, candidates="ann"):
+    by_vid={}
+    for i, n in enumerate(cur): by_vid.setdefault(n.get("vec_index", i), n)
     results=[]
     for a in itn:
         v_int = vec.transform([sig_internal(a)])[0]
-        ids, dists = ann.get_nns_by_vector(v_int.tolist(), 100, include_distances=True)
+        ids, dists = ann.get_nns_by_vector(v_int.tolist(), N_NEIGHBOURS, include_distances=True)
         cands=[]
         t_int = dtp.parse(a["date"]).date()
         for ix, dist in zip(ids, dists):
-            n = cur[ix]
-            t_score = time_align(dtp.parse(n["published_at"]).date(), t_int, max_days=7)
+            if ix not in by_vid: continue
+            n = by_vid[ix]
+            t_score = time_align(dtp.parse(n["published_at"]).date(), t_int, max_days=MAX_DAYS)
             g_score = geo_match(n.get("region"), a.get("region"))
             c_score = cat_match(n.get("categories"), a.get("category"))
             text_score = max(0.0, 1.0 - dist/2.0)
             score = 0.30*t_score + 0.20*g_score + 0.20*c_score + 0.30*text_score
             score += direction_bonus(n.get("event_type","GeneralEvent"), a.get("category","Electronics"), a.get("metrics",{}))
-            if score>=0.65:
+            if score>=MIN_SCORE:
                 cands.append({"news_id": n["news_id"], "overall": round(score,3),
                               "subs":{"time":round(t_score,3),"geo":g_score,"cat":c_score,"text":round(text_score,3)}})
-        cands=sorted(cands, key=lambda x: x["overall"], reverse=True)[:args.topk]
+        cands=sorted(cands, key=lambda x: x["overall"], reverse=True)[:topk]
         results.append({"internal_anomaly_id": a["anomaly_id"], "top_matches": cands})
+    return results
+
+ENGINES = {"batched": correlate_batched, "reference": correlate_reference}
+
+def load_ann(cfg, vec):
+    """The news vector store behind an Annoy-compatible interface (base index is mmapped, so pages are shared across processes)."""
+    store = VectorStore(cfg["paths"]["models_dir"])
+    return store.load(dim=None if store.dim else vec.dim)
+
+_WORKER = {}
+
+def _init_worker(cfg, topk, candidates):
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    cur = bus.read_all(TOPIC_CUR)
+    vec = Vectorizer(cfg["paths"]["models_dir"]); vec.load()
+    ann = load_ann(cfg, vec)
+    _WORKER.update(cur=cur, vec=vec, ann=ann, topk=topk, corpus=Corpus(cur, ann, candidates))
+
+def _run_shard(anoms):
+    w = _WORKER
+    return correlate_batched(anoms, w["cur"], w["vec"], w["ann"], w["topk"], corpus=w["corpus"])
+
+def correlate_parallel(itn, cfg, workers, topk=3, candidates="segment", shard_size=None):
+    """Contiguous shards over a process pool; results come back in shard order, so output order matches the input."""
+    shard_size = shard_size or max(256, -(-len(itn) // (workers*4)))
+    shards = [itn[s:s+shard_size] for s in range(0, len(itn), shard_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cfg, topk, candidates)) as ex:
+        return [r for part in ex.map(_run_shard, shards) for r in part]
+
+class StreamCorrelator:
+    """Correlations kept current as curated news and internal anomalies arrive (segment candidates).
+
+    A news item can only enter the candidate set of anomalies dated within its time
+    window (t_int - t_ext in [-1, MAX_DAYS-1]), so only those, plus anomalies that
+    had no candidates and fell back to Annoy, are rescored (all of them after a
+    refit); the report is rewritten after every batch.
+    """
+    def __init__(self, cfg, topk=3):
+        self.cfg = cfg; self.topk = topk
+        self.vec = Vectorizer(cfg["paths"]["models_dir"])
+        self.cur = []; self.itn = []; self.results = []
+        self.by_day = {}; self.fallback = set(); self.corpus = None; self.version = self.vec.version()
+        self.lock = threading.Lock()
+        self.out = pathlib.Path(cfg["paths"]["outputs"]) / "reports" / "correlations.json"
+
+    def add_news(self, recs) -> list:
+        with self.lock:
+            self.cur.extend(recs); self.corpus = None
+            hit = set(self.fallback)
+            for d in {day_ordinal(n["published_at"]) for n in recs}:
+                for t in range(d-1, d+MAX_DAYS): hit.update(self.by_day.get(t, ()))
+            self._rescore(sorted(hit))
+        return []
+
+    def add_anomalies(self, recs) -> list:
+        with self.lock:
+            start = len(self.itn); self.itn.extend(recs); self.results.extend({"internal_anomaly_id": a["anomaly_id"], "top_matches": []} for a in recs)
+            for i, a in enumerate(recs, start): self.by_day.setdefault(day_ordinal(a["date"]), []).append(i)
+            self._rescore(list(range(start, len(self.itn))))
+        return []
+
+    def _rescore(self, ix):
+        if self.vec.version() != self.version:  # refitted: every text score is stale
+            self.version = self.vec.version(); self.corpus = None; ix = range(len(self.itn))
+        if ix and self.cur:
+            ann = load_ann(self.cfg, self.vec)  # reopened each batch to see newly appended vectors
+            if self.corpus is None: self.corpus = Corpus(self.cur, ann, "segment")
+            self.corpus.nvec = NewsVectors(ann)
+            anoms = [self.itn[i] for i in ix]
+            for i, a, r in zip(ix, anoms, correlate_batched(anoms, self.cur, self.vec, ann, self.topk, corpus=self.corpus)):
+                self.results[i] = r
+                empty = not len(self.corpus.index.candidates((a.get("region") or "")[:1].upper(), a.get("category"), day_ordinal(a["date"])))
+                (self.fallback.add if empty else self.fallback.discard)(i)
+        self.out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.out.with_suffix(".tmp")
+        with open(tmp,"w") as f: json.dump(self.results, f, indent=2)
+        os.replace(tmp, self.out)
+
+def run(cfg, bus, cur=None, ext=None, itn=None, topk=3, engine="batched", candidates=None, verify=False, workers=1) -> list:
+    """Correlate internal anomalies with curated news and write the report; inputs not passed in are read from their topics."""
+    with metrics.phase("read"):
+        cur = bus.read_all(TOPIC_CUR) if cur is None else cur
+        ext = bus.read_all(TOPIC_EXT) if ext is None else ext
+        itn = bus.read_all(TOPIC_INT) if itn is None else itn
+    if not (cur and ext and itn):
+        print("Missing inputs for correlation."); return []
+    metrics.count("records_in", len(itn))
+
+    vec = Vectorizer(cfg["paths"]["models_dir"])
+    with metrics.phase("load_index"):
+        ann = load_ann(cfg, vec)
+
+    candidates = candidates or cfg["correlate"]["candidates"]
+    if engine=="reference" and candidates!="ann":
+        print("Reference engine only supports ANN candidates; using --candidates ann."); candidates="ann"
+    workers = workers or os.cpu_count()
+    with metrics.phase("match"):
+        if workers>1 and engine=="batched":
+            results = correlate_parallel(itn, cfg, workers, topk, candidates)
+        else:
+            results = ENGINES[engine](itn, cur, vec, ann, topk, candidates=candidates)
+    if verify:
+        if candidates!="ann": raise SystemExit("--verify compares against the ANN-only reference; use --candidates ann")
+        other = "reference" if engine=="batched" else "batched"
+        with metrics.phase("verify"):
+            same = ENGINES[other](itn, cur, vec, ann, topk, candidates="ann") == results
+        if not same:
+            raise SystemExit(f"{engine} and {other} correlation engines disagree")
+        print(f"Verified {engine} against {other}: {len(results)} identical entries")
 
     outp = pathlib.Path(cfg["paths"]["outputs"]) / "reports" / "correlations.json"
     outp.parent.mkdir(parents=True, exist_ok=True)
-    json.dump(results, open(outp,"w"), indent=2)
+    with metrics.phase("write"):
+        json.dump(results, open(outp,"w"), indent=2)
+    metrics.count("records_out", sum(len(r["top_matches"]) for r in results))
     print(f"Wrote correlations → {outp}")
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--topk", type=int, default=3)
+    ap.add_argument("--engine", choices=list(ENGINES), default="batched")
+    ap.add_argument("--candidates", choices=["segment","ann"], default=None,
+                    help="segment: exact scoring over the (region, category, day) index with Annoy fallback; ann: 100 nearest neighbours")
+    ap.add_argument("--verify", action="store_true", help="also run the other engine and fail on any mismatch (ann candidates only)")
+    ap.add_argument("--workers", type=int, default=1, help="shard anomalies across N processes (0 = all cores; batched engine only)")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    with metrics.run("correlate", cfg, args.profile):
+        run(cfg, bus, topk=args.topk, engine=args.engine, candidates=args.candidates, verify=args.verify, workers=args.workers)
 
 if __name__ == "__main__":
     main()
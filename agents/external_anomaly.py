@@ -1,11 +1,16 @@
 #!/usr/bin/env python
-import argparse, yaml, numpy as np, pathlib, joblib
+import argparse, yaml, numpy as np, pathlib, joblib, os
+from itertools import repeat
 from dateutil import parser as dtp
-from agents.common.io import FSBus
-from agents.common.vectors import Vectorizer
+from agents.common.io import FSBus, to_columns
+from agents.common import forest, metrics
+from agents.common.vectors import Vectorizer, VectorStore
 
 TOPIC_CUR = "news.curated"
 TOPIC_EXT = "news.anomalies"
+GROUP = "external_anomaly"
+MODEL = "external_iforest.joblib"
+FEATURES = ["burst_z","novelty","support","source_score"]
 
 def ewma_z(series, alpha=0.3):
     mu=0.0; dev=1e-6; z=0.0
@@ -15,80 +20,272 @@ def ewma_z(series, alpha=0.3):
         z = (x-mu)/max(dev,1e-6)
     return float(z)
 
+class BurstStats:
+    """ewma_z over one key's trailing `window` daily counts, updated once per day, z read in O(1).
+
+    Only the last `window` counts are kept, so each day costs one ewma_z over at most that
+    many values and a resumed run scores exactly as a replay of the whole history would.
+    """
+    __slots__ = ("alpha","window","counts","z","last_day")
+    def __init__(self, alpha=0.3, window=30):
+        self.alpha=alpha; self.window=window; self.counts=[]; self.z=0.0; self.last_day=None
+
+    @property
+    def count(self):
+        return self.counts[-1] if self.counts else 0
+
+    def update(self, x: float, day=None) -> float:
+        self.counts.append(x); del self.counts[:-self.window]
+        self.z = ewma_z(self.counts, self.alpha)
+        self.last_day = day
+        return self.z
+
+    def add(self, n: int, day) -> float:
+        """n more items on `day`: a repeat of the last day redoes that day's update with the larger
+        count, an older day leaves the state alone (late arrival), a newer day starts a new one."""
+        if self.last_day is not None and day < self.last_day:
+            return self.z
+        if day == self.last_day:
+            self.counts[-1] += n; self.z = ewma_z(self.counts, self.alpha)
+            return self.z
+        return self.update(n, day)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d):
+        b = cls(d["alpha"], d["window"])
+        b.counts = list(d["counts"])
+        b.z = d["z"]; b.last_day = d["last_day"]
+        return b
+
 def novelty(vec, hist):
     if not hist: return 1.0
     H = np.vstack(hist)
     sims = (H @ vec) / (np.linalg.norm(H,axis=1)*np.linalg.norm(vec)+1e-9)
     return float(1.0 - float(sims.max()))
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    args = ap.parse_args()
+class RecentVectors:
+    """Preallocated ring buffer of the last k embeddings for one (region, category).
 
-    cfg = yaml.safe_load(open("config/config.yaml","r"))
-    bus = FSBus(cfg["paths"]["topics_dir"])
-    cur = bus.read_all(TOPIC_CUR)
-    if not cur:
-        print("No curated news found."); return
+    Vectorizer output is already L2-normalized, so novelty against the buffer is a
+    single matrix product with no per-row norms.
+    """
+    def __init__(self, k: int, d: int):
+        self.k = k; self.M = np.zeros((max(k,1), d)); self.n = 0; self.pos = 0
 
-    vec = Vectorizer(cfg["paths"]["models_dir"])
-    texts = [c["title"]+" "+c["summary"] for c in cur]
-    Z = vec.transform(texts)
+    def extend(self, V: np.ndarray):
+        if self.k <= 0: return
+        V = V[-self.k:]
+        end = self.pos + len(V)
+        if end <= self.k:
+            self.M[self.pos:end] = V
+        else:
+            cut = self.k - self.pos
+            self.M[self.pos:] = V[:cut]; self.M[:end-self.k] = V[cut:]
+        self.pos = end % self.k; self.n = min(self.k, self.n + len(V))
+
+    def novelty(self, V: np.ndarray) -> np.ndarray:
+        """1 - max cosine similarity of each row of V to the buffered vectors (1.0 when empty)."""
+        if self.n == 0: return np.ones(len(V))
+        return 1.0 - (V @ self.M[:self.n].T).max(axis=1)
+
+    def to_dict(self):
+        return {"k": self.k, "M": self.M, "n": self.n, "pos": self.pos}
+
+    @classmethod
+    def from_dict(cls, d):
+        r = cls.__new__(cls)
+        r.k, r.M, r.n, r.pos = d["k"], d["M"], d["n"], d["pos"]
+        return r
+
+def embed(cur, todo, vec, store):
+    """Curated vectors for rows `todo`: read from the vector store by vec_index when it holds the
+    current model's vectors (curation embedded the same title + summary text), else via the cache."""
+    if not todo: return np.zeros((0, 0))
+    vix = [cur["vec_index"][i] for i in todo]
+    if store.exists() and store.model_version == vec.version() and None not in vix and max(vix) < len(store):
+        return store.vectors(np.array(vix, dtype=np.int64))
+    return vec.transform([cur["title"][i]+" "+cur["summary"][i] for i in todo])
+
+# Checkpoints hold plain dicts, lists and arrays (to_dict), never BurstStats/RecentVectors
+# objects: a pickled class is recorded under the module that defined it, which is __main__
+# under `python -m agents.external_anomaly`, and no other entry point could load the file.
+
+def load_checkpoint(path, vec):
+    """Burst stats always resume; ring buffers are dropped if the embedding model changed since they were saved."""
+    path = pathlib.Path(path)
+    if not path.exists(): return {"keys": {}}
+    raw = joblib.load(path)
+    same_model = raw.get("model_version") == vec.version()
+    keys = {}
+    for key, st in raw["keys"].items():
+        keys[key] = {"burst": BurstStats.from_dict(st["burst"]),
+                     "recent": RecentVectors.from_dict(st["recent"]) if same_model else RecentVectors(0, 0)}
+    return {"keys": keys}
+
+def save_checkpoint(path, state, vec):
+    path = pathlib.Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    raw = {"model_version": vec.version(),
+           "keys": {k: {"burst": st["burst"].to_dict(), "recent": st["recent"].to_dict()} for k, st in state["keys"].items()}}
+    tmp = path.with_suffix(path.suffix+".tmp")
+    joblib.dump(raw, tmp); os.replace(tmp, path)
+
+COLUMNS = ["news_id","published_at","title","summary","region","categories","event_type","source_score","vec_index"]
 
-    model_path = pathlib.Path(cfg["paths"]["models_dir"]) / "external_iforest.joblib"
-    clf = joblib.load(model_path) if model_path.exists() else None
+def group_items(cur, days, state, skip_seen=True):
+    """{(region, category): {day: [row, ...]}}; skip_seen drops the rows a key's burst state already
+    covers: days before its last day, and the first `count` rows of the last day (topics are append-only)."""
+    by_key = {}; seen = {}
+    for i, d in enumerate(days):
+        key = (cur["region"][i], cur["categories"][i][0])
+        st = state["keys"].get(key)
+        if skip_seen and st is not None and st["burst"].last_day is not None:
+            if d < st["burst"].last_day: continue
+            if d == st["burst"].last_day:
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] <= st["burst"].count: continue
+        by_key.setdefault(key, {}).setdefault(d, []).append(i)
+    return by_key
 
-    by_key = {}
-    for item, z in zip(cur, Z):
-        d = dtp.parse(item["published_at"]).date()
-        key = (item["region"], item["categories"][0])
-        by_key.setdefault(key, {}).setdefault(d, []).append((item, z))
+def signals(cur, by_key, Z, row, state, ea):
+    """Burst/novelty/support for the grouped rows, advancing `state`, one key-day block at a time.
 
-    emitted=0
+    Returns (rows, F): rows are (key, row, burst_z, novelty, support, statistical score) and F
+    their feature matrix in FEATURES order. Rows of a day the burst state has already seen are
+    folded into that day's count (BurstStats.add) instead of starting a new day.
+    """
+    rows=[]; feats=[]
     for key, daymap in by_key.items():
-        days = sorted(daymap.keys())
-        hist_vecs=[]; counts=[]
-        for d in days:
-            items = daymap[d]
-            counts.append(len(items))
-            for item, z in items:
-                b = ewma_z(counts[-min(30,len(counts)):], alpha=cfg["external_anomaly"]["ewma_alpha"])
-                n = novelty(z, hist_vecs[-cfg["external_anomaly"]["recent_k"]:] if hist_vecs else [])
-                s = len(items)
-                b_term = max(0.0, min(1.0, b/3.0))
-                s_term = min(1.0, s / max(1, cfg["external_anomaly"]["min_support"]))
-                stat_score = 0.35*b_term + 0.45*n + 0.20*s_term
-
-                ml_score = None
-                if clf is not None:
-                    import numpy as np
-                    feat = np.array([[b, n, s, item.get("source_score",0.7)]])
-                    pred = clf.decision_function(feat) if hasattr(clf,"decision_function") else -clf.score_samples(feat)
-                    ml_score = float(1/(1+np.exp(-pred)))
-
-                final = stat_score
-                det = "statistical"
-                if ml_score is not None:
-                    final = 0.5*stat_score + 0.5*ml_score
-                    det = "both" if stat_score>=cfg["external_anomaly"]["threshold"] else "ml"
-
-                if final >= cfg["external_anomaly"]["threshold"]:
-                    bus.produce(TOPIC_EXT, {
-                        "anomaly_id": f"ext_{item['news_id']}",
-                        "news_id": item["news_id"],
-                        "published_at": item["published_at"],
-                        "region": key[0],
-                        "categories": [key[1]],
-                        "event_type": item["event_type"],
-                        "detector": det,
-                        "signals": {"burst_z": round(b,2), "novelty": round(n,3), "support": s},
-                        "score": round(final,3)
-                    })
-                    emitted += 1
-            for _, z in items: hist_vecs.append(z)
-
-    print(f"Emitted {emitted} external anomalies → {cfg['paths']['topics_dir']}/{TOPIC_EXT}.jsonl")
+        st = state["keys"].get(key)
+        if st is None or st["recent"].M.shape[1] != Z.shape[1] or st["recent"].k != ea["recent_k"]:
+            st = state["keys"][key] = {"burst": st["burst"] if st else BurstStats(ea["ewma_alpha"]),
+                                       "recent": RecentVectors(ea["recent_k"], Z.shape[1])}
+        burst, recent = st["burst"], st["recent"]
+        for d in sorted(daymap.keys()):
+            ix = np.array(daymap[d]); Zd = Z[row[ix]]
+            b = burst.add(len(ix), d)
+            nov = recent.novelty(Zd).astype(float)
+            s = burst.count
+            b_term = max(0.0, min(1.0, b/3.0))
+            s_term = min(1.0, s / max(1, ea["min_support"]))
+            stat_score = 0.35*b_term + 0.45*nov + 0.20*s_term
+            rows += zip(repeat(key), ix.tolist(), repeat(b), nov.tolist(), repeat(s), stat_score.tolist())
+            src = [cur["source_score"][i] if cur["source_score"][i] is not None else 0.7 for i in ix]
+            feats.append(np.c_[np.full(len(ix), b), nov, np.full(len(ix), s), src])
+            recent.extend(Zd)
+    return rows, (np.concatenate(feats) if feats else np.zeros((0, len(FEATURES))))
+
+def score(cur, by_key, Z, row, state, ea, clf) -> list:
+    """signals() blended with the ML model's anomaly score; returns anomalies over threshold."""
+    rows, F = signals(cur, by_key, Z, row, state, ea)
+    ml_scores = [None]*len(rows)
+    if clf is not None and rows:
+        ml_scores = (1/(1+np.exp(-forest.anomaly_score(clf, F, (r[0] for r in rows))))).tolist()
+
+    emitted=[]
+    for (key, i, b, n, s, stat_score), ml_score in zip(rows, ml_scores):
+        final = stat_score
+        det = "statistical"
+        if ml_score is not None:
+            final = 0.5*stat_score + 0.5*ml_score
+            det = "both" if stat_score>=ea["threshold"] else "ml"
+
+        if final >= ea["threshold"]:
+            emitted.append({
+                "anomaly_id": f"ext_{cur['news_id'][i]}",
+                "news_id": cur["news_id"][i],
+                "published_at": cur["published_at"][i],
+                "region": key[0],
+                "categories": [key[1]],
+                "event_type": cur["event_type"][i],
+                "detector": det,
+                "signals": {"burst_z": round(b,2), "novelty": round(n,3), "support": s},
+                "score": round(final,3)
+            })
+    return emitted
+
+def _model(cfg):
+    return forest.load(pathlib.Path(cfg["paths"]["models_dir"]) / MODEL, FEATURES)
+
+def run(cfg, bus, cur=None, incremental=False, reset=False) -> list:
+    """Score curated news (the topic, or `cur` records already in memory) and return the emitted anomalies.
+
+    Afterwards the topic's position is committed for the external_anomaly group, so the
+    streaming scorer picks up after what this run has already published.
+    """
+    cons = bus.consumer(TOPIC_CUR, GROUP); cons.position = cons.end()
+    with metrics.phase("read"):
+        cur = bus.read_columns(TOPIC_CUR, COLUMNS) if cur is None else to_columns(cur, COLUMNS)
+    if not len(cur["news_id"]):
+        print("No curated news found."); return []
+    metrics.count("records_in", len(cur["news_id"]))
+
+    vec = Vectorizer(cfg["paths"]["models_dir"])
+    days = [dtp.parse(p).date() for p in cur["published_at"]]
+
+    ckpt = cfg["external_anomaly"]["checkpoint"]
+    if reset and pathlib.Path(ckpt).exists():
+        pathlib.Path(ckpt).unlink()
+    state = load_checkpoint(ckpt, vec) if incremental else {"keys": {}}
+
+    by_key = group_items(cur, days, state)
+    todo = sorted(i for daymap in by_key.values() for ix in daymap.values() for i in ix)
+    with metrics.phase("embed"):
+        Z = embed(cur, todo, vec, VectorStore(cfg["paths"]["models_dir"]))
+    row = np.full(len(days), -1); row[todo] = np.arange(len(todo))
+    with metrics.phase("score"):
+        emitted = score(cur, by_key, Z, row, state, cfg["external_anomaly"], _model(cfg))
+
+    with metrics.phase("write"), bus.producer(TOPIC_EXT) as w:
+        w.produce_many(emitted)
+    if incremental:
+        with metrics.phase("checkpoint"):
+            save_checkpoint(ckpt, state, vec)
+        print(f"Checkpoint {ckpt}: {len(state['keys'])} keys")
+    cons.commit()
+    metrics.count("records_out", len(emitted))
+    print(f"Emitted {len(emitted)} external anomalies → {cfg['paths']['topics_dir']}/{TOPIC_EXT}.jsonl")
+    return emitted
+
+class StreamScorer:
+    """Long-lived scorer for the streaming runner: state stays in memory between micro-batches
+    and is checkpointed after each one (shared with --incremental)."""
+    def __init__(self, cfg):
+        self.cfg = cfg; self.ckpt = cfg["external_anomaly"]["checkpoint"]
+        self.vec = Vectorizer(cfg["paths"]["models_dir"])
+        self.state = load_checkpoint(self.ckpt, self.vec)
+        self.version = self.vec.version()
+
+    def __call__(self, records: list) -> list:
+        if self.vec.version() != self.version:  # refitted: buffered vectors are from the old model
+            self.version = self.vec.version()
+            for st in self.state["keys"].values(): st["recent"] = RecentVectors(st["recent"].k, 0)
+        cur = to_columns(records, COLUMNS)
+        days = [dtp.parse(p).date() for p in cur["published_at"]]
+        by_key = group_items(cur, days, self.state, skip_seen=False)  # the consumer offset already dedupes
+        with metrics.phase("embed"):
+            Z = embed(cur, list(range(len(days))), self.vec, VectorStore(self.cfg["paths"]["models_dir"]))
+        with metrics.phase("score"):
+            emitted = score(cur, by_key, Z, np.arange(len(days)), self.state, self.cfg["external_anomaly"],
+                            _model(self.cfg))  # a retrained model is picked up at the next batch
+        with metrics.phase("checkpoint"):
+            save_checkpoint(self.ckpt, self.state, self.vec)
+        return emitted
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--incremental", action="store_true", help="resume burst/novelty state from the checkpoint and only score news it has not seen")
+    ap.add_argument("--reset", action="store_true", help="discard the incremental checkpoint before running")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    with metrics.run("external_anomaly", cfg, args.profile):
+        run(cfg, bus, incremental=args.incremental, reset=args.reset)
 
 if __name__ == "__main__":
     main()
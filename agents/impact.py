@@ -1,59 +1,202 @@
 #!/usr/bin/env python
-import argparse, yaml, json, pathlib, numpy as np, pandas as pd
+import argparse, yaml, json, pathlib, os, numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from dateutil import parser as dtp
+from agents.common import metrics
+
+PRE_DAYS = 28; MIN_WINDOW = 14
+
+def its_design(n, t0_idx):
+    x=np.arange(n); I=(x>=t0_idx).astype(float)
+    return np.c_[np.ones_like(x), x, I, (x-t0_idx)*I]
 
 def its_effect(series, t0_idx, horizon=7):
-    y=np.array(series,dtype=float); x=np.arange(len(y))
+    y=np.array(series,dtype=float)
     pre=slice(0,t0_idx); post=slice(t0_idx, min(len(y), t0_idx+horizon))
-    I=(x>=t0_idx).astype(float)
-    X=np.c_[np.ones_like(x), x, I, (x-t0_idx)*I]
+    X=its_design(len(y), t0_idx)
     beta,*_=np.linalg.lstsq(X[pre], y[pre], rcond=None)
     yhat=X@beta
     eff=y[post]-yhat[post]
     delta=float(eff.sum()); rel=float(delta/(yhat[post].sum()+1e-9))*100.0
     return {"effect_abs": round(delta,2), "effect_pct": round(rel,2)}
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    ap.add_argument("--horizon", type=int, default=7)
-    args = ap.parse_args()
+def its_effect_batch(Y, t0_idx, horizon=7):
+    """its_effect for every row of Y (m windows of the same length and t0) in one least-squares pass."""
+    Y=np.asarray(Y,dtype=float); n=Y.shape[1]
+    pre=slice(0,t0_idx); post=slice(t0_idx, min(n, t0_idx+horizon))
+    X=its_design(n, t0_idx)
+    B,*_=np.linalg.lstsq(X[pre], Y[:,pre].T, rcond=None)
+    Yhat=(X@B).T
+    delta=(Y[:,post]-Yhat[:,post]).sum(axis=1); rel=delta/(Yhat[:,post].sum(axis=1)+1e-9)*100.0
+    return [{"effect_abs": round(float(d),2), "effect_pct": round(float(r),2)} for d, r in zip(delta, rel)]
 
-    cfg=yaml.safe_load(open("config/config.yaml","r"))
+def trend_fit(Y, x, W=None):
+    """OLS intercept/slope of each row of Y on x, optionally weighted by a 0/1 mask W (same shape as Y).
+
+    This is the counterfactual its_effect extrapolates: in the pre-period the level
+    and slope-change columns of the ITS design are zero, so only [1, x] is fitted.
+    """
+    W=np.ones_like(Y) if W is None else W
+    s0=W.sum(axis=-1); xm=(W*x).sum(axis=-1)/s0; ym=(W*Y).sum(axis=-1)/s0
+    dx=x-xm[...,None]
+    b=(W*dx*(Y-ym[...,None])).sum(axis=-1)/((W*dx*dx).sum(axis=-1)+1e-12)
+    return ym-b*xm, b
+
+def its_uncertainty(series, t0_idx, horizon=7, n_boot=1000, method="residual", block=7, level=0.95, seed=0, pre=None):
+    """Bootstrap CI for the ITS effect plus a placebo-date p-value, all resamples solved as one batch.
+
+    The effect is fitted on the last `pre` observations before t0 (default: all of them).
+    Pre-period residuals are resampled i.i.d. (residual) or in moving blocks (block),
+    added back onto the fitted trend to refit B counterfactuals at once, and reused as
+    post-period noise. A placebo is every earlier date with `pre` observations of its own
+    history and its horizon ending before t0, fitted exactly like the effect, so series
+    need history beyond `pre` to get any; p = (1 + #|placebo| >= |effect|) / (1 + P).
+    """
+    y=np.asarray(series,dtype=float); n=len(y); x=np.arange(n,dtype=float)
+    m=t0_idx; post=slice(m, min(n, m+horizon)); h=post.stop-m
+    pre=m if pre is None else min(pre, m); k=m-pre
+    if pre<3 or h<1: return None
+    rng=np.random.default_rng(seed)
+    a, b = trend_fit(y[k:m], x[k:m])
+    fit=a+b*x; res=y[k:m]-fit[k:m]
+
+    if method=="block":
+        L=min(block, pre); nb=-(-(pre+h)//L)
+        idx=(rng.integers(0, pre-L+1, size=(n_boot, nb))[:,:,None] + np.arange(L)).reshape(n_boot, -1)[:, :pre+h]
+    else:
+        idx=rng.integers(0, pre, size=(n_boot, pre+h))
+    E=res[idx]
+    A, B = trend_fit(fit[k:m] + E[:, :pre], x[k:m])
+    cf=A[:,None] + B[:,None]*x[post] + E[:, pre:]
+    eff=(y[post]-cf).sum(axis=1); rel=eff/(cf.sum(axis=1)+1e-9)*100.0
+    q=[(1-level)/2, 1-(1-level)/2]
+    lo, hi = np.quantile(eff, q); plo, phi = np.quantile(rel, q)
+
+    point=float((y[post]-fit[post]).sum())
+    ps=np.arange(pre, m-h+1)
+    p_value=None
+    if len(ps):
+        W=((x[:m][None,:] >= (ps-pre)[:,None]) & (x[:m][None,:] < ps[:,None])).astype(float)
+        Ap, Bp = trend_fit(np.broadcast_to(y[:m], (len(ps), m)), x[:m], W)
+        win=ps[:,None] + np.arange(h)
+        placebo=(y[win] - (Ap[:,None] + Bp[:,None]*x[win])).sum(axis=1)
+        p_value=round(float((1 + (np.abs(placebo) >= abs(point)).sum()) / (1 + len(ps))), 4)
+
+    return {"method": method, "n_boot": n_boot, "level": level,
+            "ci_abs": [round(float(lo),2), round(float(hi),2)], "ci_pct": [round(float(plo),2), round(float(phi),2)],
+            "p_value": p_value, "n_placebo": int(len(ps))}
+
+def _uncertainty_task(args):
+    return its_uncertainty(*args)
+
+def uncertainty_parallel(tasks, workers=1):
+    """Map its_uncertainty over (series, t0_idx, horizon, n_boot, method, block, level, seed, pre) tuples, in order."""
+    if workers<=1 or len(tasks)<2:
+        return [_uncertainty_task(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_uncertainty_task, tasks, chunksize=max(1, len(tasks)//(workers*4))))
+
+class SeriesStore:
+    """One sort by (key, date); each key is a contiguous slice of timestamp/value arrays, so windows are two binary searches."""
+    def __init__(self, df: pd.DataFrame, key="sku", value="sales"):
+        d=df[df["date"].notna()].sort_values([key,"date"], kind="stable")
+        self.t=d["date"].to_numpy("datetime64[ns]").view(np.int64)
+        self.y=d[value].to_numpy(dtype=float)
+        keys=d[key].to_numpy()
+        starts=np.r_[0, np.flatnonzero(keys[1:]!=keys[:-1])+1] if len(keys) else np.empty(0, dtype=np.int64)
+        ends=np.r_[starts[1:], len(keys)]
+        self.span={keys[s]:(s,e) for s, e in zip(starts, ends)}
+
+    def window(self, key, lo: pd.Timestamp, hi: pd.Timestamp):
+        """(timestamps, values) for lo <= date <= hi, or None if the key is unknown."""
+        if key not in self.span: return None
+        s, e = self.span[key]; t=self.t[s:e]
+        a=s+np.searchsorted(t, lo.value, "left"); b=s+np.searchsorted(t, hi.value, "right")
+        return self.t[a:b], self.y[a:b]
+
+def run(cfg, corr=None, df=None, horizon=7, uncertainty=False, workers=1) -> list:
+    """ITS effects for correlated anomalies (the correlations report unless `corr` is given); df is the standardized sales table if already loaded."""
     corr_path=pathlib.Path(cfg["paths"]["outputs"]) / "reports" / "correlations.json"
-    if not corr_path.exists(): print("Run correlate first."); return
-    corr=json.load(open(corr_path,"r"))
+    if corr is None:
+        if not corr_path.exists(): print("Run correlate first."); return []
+        corr=json.load(open(corr_path,"r"))
 
-    df=pd.read_csv("data/input/Adjusted_Retail_Sales_Data_with_Anomalies.csv")
-    from agents.common.text import standardize_columns
-    df=standardize_columns(df)
+    metrics.count("records_in", len(corr))
+    with metrics.phase("load"):
+        if df is None:
+            from agents.common import sales
+            df=sales.load(cfg, columns=["date","sku","sales"], skus={e["internal_anomaly_id"].rsplit("_",1)[0] for e in corr})
+        store=SeriesStore(df)
+
+    # With --uncertainty the window also reaches impact.placebo_days further back, so that
+    # placebo dates get the same PRE_DAYS of history as the effect; the effect itself is
+    # always fitted on the last PRE_DAYS only (the window's tail from `lo` on).
+    back=PRE_DAYS + (cfg["impact"]["placebo_days"] if uncertainty else 0)
+    with metrics.phase("windows"):
+        jobs=[]
+        for entry in corr:
+            if not entry["top_matches"]: continue
+            anom_id=entry["internal_anomaly_id"]
+            sku, date_str = anom_id.rsplit("_",1)
+            t0 = pd.Timestamp(dtp.parse(date_str).date())
+            win = store.window(sku, t0-pd.Timedelta(days=back), t0+pd.Timedelta(days=horizon))
+            if win is None: continue
+            lo = int(np.searchsorted(win[0], (t0-pd.Timedelta(days=PRE_DAYS)).value, "left"))
+            t, y = win[0][lo:], win[1][lo:]
+            if len(t)<MIN_WINDOW: continue
+            t0_idx = int(np.searchsorted(t, t0.value, "left"))  # first observation on/after the anomaly day
+            if t0_idx==0 or t0_idx>=len(t): continue
+            jobs.append((entry, t, y, t0_idx, win[1], lo))
+
+    groups={}
+    for j, (_, t, _, t0_idx, _, _) in enumerate(jobs):
+        groups.setdefault((len(t), t0_idx), []).append(j)
+    effects=[None]*len(jobs)
+    with metrics.phase("effects"):
+        for (_, t0_idx), js in groups.items():
+            for j, eff in zip(js, its_effect_batch(np.vstack([jobs[j][2] for j in js]), t0_idx, horizon=horizon)):
+                effects[j]=eff
+
+    unc=[None]*len(jobs)
+    if uncertainty:
+        ic=cfg["impact"]
+        tasks=[(yl, lo+t0_idx, horizon, ic["n_boot"], ic["bootstrap"], ic["block"], ic["ci_level"], [ic["seed"], j], t0_idx)
+               for j, (_, _, _, t0_idx, yl, lo) in enumerate(jobs)]
+        with metrics.phase("uncertainty"):
+            unc=uncertainty_parallel(tasks, workers or os.cpu_count())
 
     results=[]
-    for entry in corr:
-        if not entry["top_matches"]: continue
-        anom_id=entry["internal_anomaly_id"]
-        sku, date_str = anom_id.rsplit("_",1)
-        t0 = dtp.parse(date_str).date()
-        g=df[df["sku"]==sku].sort_values("date")
-        if g.empty: continue
-        window = g[(g["date"] >= (pd.Timestamp(t0)-pd.Timedelta(days=28))) & (g["date"] <= (pd.Timestamp(t0)+pd.Timedelta(days=args.horizon)))]
-        if len(window)<14: continue
-        series = window["sales"].to_list()
-        t0_idx = (window["date"]==pd.Timestamp(t0)).idxmax() - window.index.min()
-        eff = its_effect(series, t0_idx, horizon=args.horizon)
+    for (entry, t, *_), eff, u in zip(jobs, effects, unc):
+        if u is not None: eff={**eff, **u}
         results.append({
-            "internal_anomaly_id": anom_id,
+            "internal_anomaly_id": entry["internal_anomaly_id"],
             "best_cause": entry["top_matches"][0],
             "impact": eff,
             "metric": "sales",
-            "window_start": str(window["date"].min().date()),
-            "window_end": str(window["date"].max().date())
+            "window_start": str(pd.Timestamp(t[0]).date()),
+            "window_end": str(pd.Timestamp(t[-1]).date())
         })
 
     outp=pathlib.Path(cfg["paths"]["outputs"]) / "reports" / "impact.json"
     outp.parent.mkdir(parents=True, exist_ok=True)
-    json.dump(results, open(outp,"w"), indent=2)
+    with metrics.phase("write"):
+        json.dump(results, open(outp,"w"), indent=2)
+    metrics.count("records_out", len(results))
     print(f"Wrote impact → {outp}")
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--horizon", type=int, default=7)
+    ap.add_argument("--uncertainty", action="store_true", help="add bootstrap confidence intervals and a placebo p-value to each effect")
+    ap.add_argument("--workers", type=int, default=1, help="processes for --uncertainty (0 = all cores)")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg=yaml.safe_load(open("config/config.yaml","r"))
+    with metrics.run("impact", cfg, args.profile):
+        run(cfg, horizon=args.horizon, uncertainty=args.uncertainty, workers=args.workers)
 
 if __name__ == "__main__":
     main()
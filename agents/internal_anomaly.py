@@ -1,16 +1,22 @@
 #!/usr/bin/env python
-import argparse, yaml, pandas as pd, numpy as np, pathlib, joblib
+import argparse, yaml, json, numpy as np, pathlib, joblib, math, os, heapq, zlib
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from agents.common.io import FSBus
-from agents.common.text import standardize_columns
+from agents.common import forest, metrics, robust, sales
 
 TOPIC_INT = "internal.anomalies"
+KEYS = ["sku","region","category"]
+MODEL = "internal_iforest.joblib"
+FEATURES = ["units","sales","price"]
+MIN_PERIODS = 7
 
 class Rolling:
     def __init__(self, w=28):
-        self.w=w; self.buf=[]
+        self.w=w; self.buf=deque(maxlen=w)
     def push(self, x: float):
         self.buf.append(float(x))
-        if len(self.buf)>self.w: self.buf.pop(0)
     def z(self):
         arr=np.array(self.buf,dtype=float)
         if len(arr)<7: return 0.0
@@ -22,54 +28,295 @@ class Rolling:
         med=np.median(arr); mad=np.median(np.abs(arr-med)) or 1e-6
         return float(0.6745*(arr[-1]-med)/mad)
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    args = ap.parse_args()
+class RollingState:
+    """Checkpointable sliding window: running sums for z, a sorted copy for median/MAD.
 
-    cfg = yaml.safe_load(open("config/config.yaml","r"))
-    bus = FSBus(cfg["paths"]["topics_dir"])
-    df = pd.read_csv("data/input/Adjusted_Retail_Sales_Data_with_Anomalies.csv")
-    df = standardize_columns(df).sort_values("date")
+    push is O(log w) (bisect into the sorted window) and z is O(1); mad_z walks
+    outwards from the median, so it touches at most w/2+1 elements. The sums are
+    re-accumulated exactly once per w pushes to keep float drift bounded.
+    """
+    __slots__ = ("w","buf","srt","s","q","k")
+    def __init__(self, w=28):
+        self.w=w; self.buf=deque(); self.srt=[]; self.s=0.0; self.q=0.0; self.k=0
+    def push(self, x: float):
+        x=float(x); self.buf.append(x); insort(self.srt, x); self.s+=x; self.q+=x*x
+        if len(self.buf)>self.w:
+            old=self.buf.popleft(); del self.srt[bisect_left(self.srt, old)]
+            self.s-=old; self.q-=old*old
+        self.k+=1
+        if self.k>=self.w:
+            self.k=0; self.s=math.fsum(self.buf); self.q=math.fsum(v*v for v in self.buf)
+    def z(self):
+        n=len(self.buf)
+        if n<MIN_PERIODS: return 0.0
+        mu=self.s/n; sd=math.sqrt(max(0.0, (self.q - self.s*mu)/(n-1))) or 1e-6
+        return float((self.buf[-1]-mu)/sd)
+    def mad_z(self):
+        a=self.srt; n=len(a)
+        if n<MIN_PERIODS: return 0.0
+        med=(a[(n-1)//2]+a[n//2])/2
+        l=(n-1)//2; r=l+1; devs=[]
+        while len(devs)<=n//2:
+            if r>=n or (l>=0 and med-a[l]<=a[r]-med): devs.append(med-a[l]); l-=1
+            else: devs.append(a[r]-med); r+=1
+        mad=(devs[(n-1)//2]+devs[n//2])/2 or 1e-6
+        return float(0.6745*(self.buf[-1]-med)/mad)
+    def __getstate__(self):
+        return (self.w, list(self.buf), self.k)
+    def __setstate__(self, st):
+        w, buf, k = st
+        self.w=w; self.buf=deque(buf); self.srt=sorted(buf)
+        self.s=math.fsum(buf); self.q=math.fsum(v*v for v in buf); self.k=k
+    @classmethod
+    def from_state(cls, st):
+        r=cls.__new__(cls); r.__setstate__(st); return r
 
-    model_path = pathlib.Path(cfg["paths"]["models_dir"]) / "internal_iforest.joblib"
-    clf = joblib.load(model_path) if model_path.exists() else None
+def classify(zu, zs, zp, ml_flag, cfg):
+    a_type=None
+    if abs(zp)>=cfg["internal_anomaly"]["mad_th"]:
+        a_type="Price jump"
+    elif abs(zu)>=cfg["internal_anomaly"]["z_th"] or abs(zs)>=cfg["internal_anomaly"]["z_th"]:
+        a_type="KPI anomaly"
+    det = "statistical" if a_type else None
+    if ml_flag:
+        if not a_type: a_type="ML anomaly"
+        det = "ml" if det is None else "both"
+    return a_type, det
 
-    emitted=0
-    for (sku, reg, cat), g in df.groupby(["sku","region","category"]):
+def make_record(sku, reg, cat, date, a_type, det, units, sales, price, zu, zs, zp):
+    return {
+        "anomaly_id": f"{sku}_{date}",
+        "date": date,
+        "sku": sku, "category": cat, "region": reg, "type": a_type,
+        "detector": det,
+        "metrics": {"units": units, "sales": sales, "avg_price": price,
+                    "z_units": zu, "z_sales": zs, "mad_z_price": zp}
+    }
+
+def detect_reference(df, cfg, clf=None):
+    """Per-row replay through Rolling buffers; kept as the reference for the vectorized engine."""
+    for (sku, reg, cat), g in df.groupby(KEYS, observed=True):
         ru, rs, rp = Rolling(cfg["internal_anomaly"]["window"]), Rolling(cfg["internal_anomaly"]["window"]), Rolling(cfg["internal_anomaly"]["window"])
         for _, row in g.iterrows():
             units=float(row["units"]); sales=float(row["sales"]); price=sales/max(units,1e-6)
             ru.push(units); rs.push(sales); rp.push(price)
             zu, zs, zp = ru.z(), rs.z(), rp.mad_z()
 
-            a_type=None
-            if abs(zp)>=cfg["internal_anomaly"]["mad_th"]:
-                a_type="Price jump"
-            elif abs(zu)>=cfg["internal_anomaly"]["z_th"] or abs(zs)>=cfg["internal_anomaly"]["z_th"]:
-                a_type="KPI anomaly"
-            det = "statistical" if a_type else None
-
+            ml_flag=False
             if clf is not None:
-                import numpy as np
                 feat = np.array([[units, sales, price]])
-                pred = clf.predict(feat)[0]  # -1 anomaly, 1 normal
-                if pred==-1:
-                    if not a_type: a_type="ML anomaly"
-                    det = "ml" if det is None else "both"
+                ml_flag = forest.outliers(clf, feat, [(reg, cat)])[0]
+
+            a_type, det = classify(zu, zs, zp, ml_flag, cfg)
+            if a_type:
+                yield make_record(sku, reg, cat, str(row["date"].date()), a_type, det, units, sales, price, zu, zs, zp)
+
+def _windows(x, ends, L):
+    return x[ends[:,None] - (L-1) + np.arange(L)]
+
+def rolling_z(x, pos, w, chunk=1<<18):
+    """Trailing-window z of x[i] against the last min(pos+1, w) values of its series (pos = offset within series)."""
+    out = np.zeros(len(x)); n = np.minimum(pos+1, w)
+    for L in range(MIN_PERIODS, w+1):
+        ends = np.flatnonzero(n==L)
+        for s in range(0, len(ends), chunk):
+            e = ends[s:s+chunk]; W = _windows(x, e, L)
+            sd = W.std(axis=1, ddof=1); sd[sd==0] = 1e-6
+            out[e] = (x[e] - W.mean(axis=1)) / sd
+    return out
+
+def rolling_mad_z(x, pos, w):
+    z = robust.rolling_mad_z(x, w, MIN_PERIODS, pos)
+    return np.where(np.minimum(pos+1, w) < MIN_PERIODS, 0.0, z)
+
+def detect_vectorized(df, cfg, clf=None):
+    """Grouped rolling windows for all series at once, one batched Isolation Forest call."""
+    if df.empty: return
+    w = cfg["internal_anomaly"]["window"]
+    gid = df.groupby(KEYS, sort=True, observed=True).ngroup()
+    df = df[gid.notna()]; gid = gid[gid.notna()].to_numpy(dtype=np.int64)  # groupby drops NaN keys
+    if df.empty: return
+    order = np.argsort(gid, kind="stable")
+    df = df.iloc[order]; gid = gid[order]
+    pos = robust.window_positions(gid)
+
+    units = df["units"].to_numpy(dtype=float); sales = df["sales"].to_numpy(dtype=float)
+    price = sales/np.maximum(units, 1e-6)
+    zu, zs, zp = rolling_z(units, pos, w), rolling_z(sales, pos, w), rolling_mad_z(price, pos, w)
+
+    sku, reg, cat = (df[k].to_numpy() for k in KEYS)
+    ml = np.zeros(len(df), dtype=bool)
+    if clf is not None:
+        ml = forest.outliers(clf, np.c_[units, sales, price], zip(reg, cat))
+
+    th_mad, th_z = cfg["internal_anomaly"]["mad_th"], cfg["internal_anomaly"]["z_th"]
+    hit = (np.abs(zp)>=th_mad) | (np.abs(zu)>=th_z) | (np.abs(zs)>=th_z) | ml
+    dates = df["date"].dt.date.astype(str).to_numpy()
+    for i in np.flatnonzero(hit):
+        a_type, det = classify(zu[i], zs[i], zp[i], ml[i], cfg)
+        yield make_record(sku[i], reg[i], cat[i], dates[i], a_type, det,
+                          float(units[i]), float(sales[i]), float(price[i]), float(zu[i]), float(zs[i]), float(zp[i]))
+
+# On disk each series is three (w, window values, k) tuples rather than RollingState objects,
+# so the checkpoint unpickles from any entry point (a pickled class is recorded under the
+# module it was defined in, which is __main__ when run with -m).
+
+def load_checkpoint(path, w):
+    path=pathlib.Path(path)
+    if path.exists():
+        st=joblib.load(path)
+        if st.get("window")==w:
+            st["series"]={k: tuple(RollingState.from_state(r) for r in v) for k, v in st["series"].items()}
+            return st
+        print(f"Checkpoint {path} was built with window={st.get('window')}, starting fresh.")
+    return {"window": w, "watermark": None, "series": {}}
 
+def save_checkpoint(path, st):
+    path=pathlib.Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    raw={**st, "series": {k: tuple(r.__getstate__() for r in v) for k, v in st["series"].items()}}
+    tmp=path.with_suffix(path.suffix+".tmp")
+    joblib.dump(raw, tmp); os.replace(tmp, path)
+
+def detect_incremental(df, cfg, clf, st, since=None):
+    """Advance checkpointed per-series state over rows newer than `since` (the watermark the run started from) only."""
+    new = df if since is None else df[df["date"]>since]
+    if new.empty: return []
+    w = cfg["internal_anomaly"]["window"]
+    units = new["units"].to_numpy(dtype=float); sales = new["sales"].to_numpy(dtype=float)
+    price = sales/np.maximum(units, 1e-6)
+    ml = (forest.outliers(clf, np.c_[units, sales, price], zip(new["region"], new["category"])) if clf is not None
+          else np.zeros(len(new), dtype=bool))
+    dates = new["date"].dt.date.astype(str).to_numpy()
+
+    out=[]
+    for key, ix in sorted(new.groupby(KEYS, observed=True).indices.items()):
+        sku, reg, cat = key
+        ru, rs, rp = st["series"].setdefault(key, (RollingState(w), RollingState(w), RollingState(w)))
+        for i in ix:
+            ru.push(units[i]); rs.push(sales[i]); rp.push(price[i])
+            zu, zs, zp = ru.z(), rs.z(), rp.mad_z()
+            a_type, det = classify(zu, zs, zp, ml[i], cfg)
             if a_type:
-                anom = {
-                    "anomaly_id": f"{sku}_{str(row['date'].date())}",
-                    "date": str(row["date"].date()),
-                    "sku": sku, "category": cat, "region": reg, "type": a_type,
-                    "detector": det,
-                    "metrics": {"units": units, "sales": sales, "avg_price": price,
-                                "z_units": zu, "z_sales": zs, "mad_z_price": zp}
-                }
-                bus.produce(TOPIC_INT, anom); emitted+=1
-
-    print(f"Emitted {emitted} internal anomalies → {cfg['paths']['topics_dir']}/{TOPIC_INT}.jsonl")
+                out.append(make_record(sku, reg, cat, dates[i], a_type, det,
+                                       float(units[i]), float(sales[i]), float(price[i]), zu, zs, zp))
+    top = new["date"].max()
+    if st["watermark"] is None or top > st["watermark"]: st["watermark"] = top
+    return out
+
+ENGINES = {"vectorized": detect_vectorized, "reference": detect_reference}
+
+def load_model(cfg):
+    return forest.load(pathlib.Path(cfg["paths"]["models_dir"]) / MODEL, FEATURES)
+
+def detect(parts, cfg, clf, engine="vectorized", verify=False, st=None, since=None):
+    """Anomalies over sales frames that each hold whole series, incrementally when given checkpoint state st.
+
+    Returns (anomalies, the other engine's anomalies when verifying)."""
+    other = "reference" if engine=="vectorized" else "vectorized"
+    anoms, ref = [], []
+    for df in metrics.timed("load", parts):
+        metrics.count("records_in", len(df))
+        with metrics.phase("detect"):
+            df = df.sort_values("date")
+            if st is not None:
+                anoms += detect_incremental(df, cfg, clf, st, since)
+            else:
+                anoms += ENGINES[engine](df, cfg, clf)
+        if verify and st is None:
+            with metrics.phase("verify"):
+                ref += ENGINES[other](df, cfg, clf)
+    return anoms, ref
+
+def _partition_task(args):
+    cfg, cache, skus, chunk_rows, engine, verify, st, since = args
+    anoms, ref = detect(cache.chunks(chunk_rows, skus=skus), cfg, load_model(cfg), engine, verify, st, since)
+    return anoms, ref, st
+
+def detect_partitioned(cfg, workers, chunk_rows=0, engine="vectorized", verify=False, st=None, since=None):
+    """detect() with SKUs hash-partitioned over a process pool.
+
+    Workers get SKU positions in the sales cache and memory-map their rows from it (no
+    DataFrame is pickled). Each worker emits in SKU order, so the merge by SKU position
+    reproduces the single-process order; checkpoint state goes out and comes back per SKU.
+    """
+    cache = sales.SalesCache(cfg); skus = cache.skus
+    metrics.count("records_in", len(cache))
+    part = [[] for _ in range(workers)]
+    for i, s in enumerate(skus):
+        part[zlib.crc32(str(s).encode("utf-8")) % workers].append(i)
+    rank = {s: i for i, s in enumerate(skus)}
+    def state(ix):
+        if st is None: return None
+        mine = {skus[i] for i in ix}
+        return {**st, "watermark": None, "series": {k: v for k, v in st["series"].items() if k[0] in mine}}
+    tasks = [(cfg, cache, ix, chunk_rows, engine, verify, state(ix), since) for ix in part if ix]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        done = list(ex.map(_partition_task, tasks))
+    for _, _, ws in done:
+        if ws is None: continue
+        st["series"].update(ws["series"])
+        if ws["watermark"] is not None and (st["watermark"] is None or ws["watermark"] > st["watermark"]):
+            st["watermark"] = ws["watermark"]
+    by_sku = lambda r: rank[r["sku"]]
+    return (list(heapq.merge(*(d[0] for d in done), key=by_sku)),
+            list(heapq.merge(*(d[1] for d in done), key=by_sku)))
+
+def run(cfg, bus, df=None, engine="vectorized", verify=False, incremental=False, reset=False, chunk_rows=None, workers=1) -> list:
+    """Detect and emit internal anomalies; df is the standardized sales table if already loaded.
+
+    Otherwise the table comes from the sales cache, in chunks of whole SKUs when chunk_rows
+    (default sales.chunk_rows) is set, and split over `workers` processes (0 = all cores);
+    every series lives in one chunk and one worker, so results match a single pass.
+    """
+    chunk_rows = cfg["sales"]["chunk_rows"] if chunk_rows is None else chunk_rows
+    workers = workers or os.cpu_count()
+
+    ckpt = cfg["internal_anomaly"]["checkpoint"]
+    if reset and pathlib.Path(ckpt).exists():
+        pathlib.Path(ckpt).unlink()
+    st = load_checkpoint(ckpt, cfg["internal_anomaly"]["window"]) if incremental else None
+    since = st and st["watermark"]
+    verify = verify and not incremental
+    if df is None and workers > 1:
+        with metrics.phase("detect_partitioned"):
+            anoms, ref = detect_partitioned(cfg, workers, chunk_rows, engine, verify, st, since)
+    else:
+        parts = [df] if df is not None else sales.chunks(cfg, chunk_rows) if chunk_rows else [sales.load(cfg)]
+        anoms, ref = detect(parts, cfg, load_model(cfg), engine, verify, st, since)
+    if verify:
+        other = "reference" if engine=="vectorized" else "vectorized"
+        if json.dumps(ref) != json.dumps(anoms):  # as serialized, so NaN metrics compare equal
+            raise SystemExit(f"{engine} and {other} engines disagree ({len(anoms)} vs {len(ref)} anomalies)")
+        print(f"Verified {engine} against {other}: {len(anoms)} identical anomalies")
+
+    with metrics.phase("write"), bus.producer(TOPIC_INT) as w:
+        w.produce_many(anoms)
+    if incremental:
+        with metrics.phase("checkpoint"):
+            save_checkpoint(ckpt, st)
+        print(f"Checkpoint {ckpt}: {len(st['series'])} series, watermark {st['watermark']}")
+    metrics.count("records_out", len(anoms))
+
+    print(f"Emitted {len(anoms)} internal anomalies → {cfg['paths']['topics_dir']}/{TOPIC_INT}.jsonl")
+    return anoms
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--engine", choices=list(ENGINES), default="vectorized")
+    ap.add_argument("--verify", action="store_true", help="also run the reference engine and fail on any mismatch")
+    ap.add_argument("--incremental", action="store_true", help="resume per-series state from the checkpoint and only process rows after its watermark")
+    ap.add_argument("--reset", action="store_true", help="discard the incremental checkpoint before running")
+    ap.add_argument("--workers", type=int, default=1, help="processes; SKUs are hash-partitioned across them (0 = all cores)")
+    ap.add_argument("--chunk-rows", type=int, default=None, help="process whole SKUs in chunks of about this many rows (default sales.chunk_rows; 0 = all at once)")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    with metrics.run("internal_anomaly", cfg, args.profile):
+        run(cfg, bus, engine=args.engine, verify=args.verify, incremental=args.incremental, reset=args.reset,
+            chunk_rows=args.chunk_rows, workers=args.workers)
 
 if __name__ == "__main__":
     main()
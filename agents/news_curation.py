@@ -1,24 +1,15 @@
 #!/usr/bin/env python
-import argparse, yaml, pathlib
+import argparse, yaml, subprocess, sys
 from agents.common.io import FSBus
-from agents.common.text import clean_text, infer_event_type
-from agents.common.vectors import Vectorizer
-from annoy import AnnoyIndex
+from agents.common.text import clean_text, classifier
+from agents.common.vectors import Vectorizer, VectorStore, file_lock
+from agents.common import metrics
 
 TOPIC_RAW = "raw.news.html"
 TOPIC_CUR = "news.curated"
+GROUP = "news_curation"
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    args = ap.parse_args()
-
-    cfg = yaml.safe_load(open("config/config.yaml","r"))
-    bus = FSBus(cfg["paths"]["topics_dir"])
-    raw = bus.read_all(TOPIC_RAW)
-    if not raw:
-        print("No raw news found. Run agents/news_generate.py first."); return
-
+def curate(raw, clf):
     texts=[]; curated=[]
     for r in raw:
         text = clean_text((r.get("title","")+" "+r.get("summary","")).strip())
@@ -30,27 +21,128 @@ def main():
             "summary": r.get("summary",""),
             "region": r.get("region","EU"),
             "categories": r.get("categories",["Electronics"]),
-            "event_type": infer_event_type(text),
+            "event_type": None,
             "source_score": r.get("source_score",0.7),
             "text": text
         })
         texts.append(text)
+    for item, evt in zip(curated, clf.batch(texts, ["event_type"])["event_type"]):
+        item["event_type"] = evt
+    return curated, texts
 
-    vec = Vectorizer(cfg["paths"]["models_dir"], n_components=256)
-    Z = vec.fit(texts)
+def refit(bus, vec, store, new_texts=()):
+    """Fit the model on every curated text plus new_texts and rewrite the store.
+
+    Rows keep their vec_index, so published curated items stay valid; returns the ids
+    assigned to new_texts.
+    """
+    cols = bus.read_columns(TOPIC_CUR, ["vec_index","text"])
+    rows = {}
+    for i, t in zip(cols["vec_index"], cols["text"]):
+        rows.setdefault(int(i), t)  # first copy wins, as in correlate
+    n_old = max(rows)+1 if rows else 0
+    Z = vec.fit([rows.get(i, "") for i in range(n_old)] + list(new_texts))
+    store.write_base(Z, vec.version())
+    return list(range(n_old, n_old+len(new_texts)))
+
+def embed_new(cfg, bus, raw, vec, store) -> list:
+    """Curate raw items and add them to the vector store with the persisted model (refitting when
+    there is none or the store has outgrown it); returns the curated records with vec_index set.
+    The caller holds the store's writer lock."""
+    nc = cfg["news_curation"]
+    with metrics.phase("curate"):
+        curated, texts = curate(raw, classifier(cfg))
+    if not curated: return []
+    with metrics.phase("embed"):
+        if store.model_version != vec.version() or not vec.svd_path.exists():
+            ids = refit(bus, vec, store, texts)  # no store yet, or one built by another model
+        elif (nc["refit_growth"] and store.m["fitted_rows"]
+              and len(store)+len(texts) > nc["refit_growth"]*store.m["fitted_rows"]):
+            ids = refit(bus, vec, store, texts)
+        else:
+            ids = store.append(vec.transform(texts), vec.version())
+    for i, item in zip(ids, curated):
+        item["vec_index"] = int(i)
+    return curated
+
+def maybe_compact(cfg, store):
+    nc = cfg["news_curation"]
+    if not store.needs_compaction(nc["compact_max_deltas"], nc["compact_ratio"]): return
+    if nc["background_compaction"]:
+        subprocess.Popen([sys.executable, "-m", "agents.news_curation", "--compact"], start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        store.compact()
 
-    d = Z.shape[1]
-    idx = AnnoyIndex(d, "angular")
-    for i, v in enumerate(Z):
-        idx.add_item(i, v.tolist())
-    idx.build(10)
-    idx.save(str(pathlib.Path(cfg["paths"]["models_dir"]) / "annoy.index"))
+def run(cfg, bus, raw=None, incremental=False) -> list:
+    """Curate and embed raw news; returns the curated records it produced.
 
-    for i, item in enumerate(curated):
-        item["vec_index"] = i
-        bus.produce(TOPIC_CUR, item)
+    Full runs read the whole raw topic unless `raw` is given (records already in
+    memory, the topic's current content); incremental runs consume only what the
+    news_curation group has not seen.
+    """
+    vec = Vectorizer(cfg["paths"]["models_dir"], n_components=256)
+    store = VectorStore(cfg["paths"]["models_dir"])
+    cons = bus.consumer(TOPIC_RAW, GROUP)
+    if not incremental: cons.position = 0
+    try:
+        with file_lock(store.dir / ".writer.lock", timeout=0 if incremental else 60):
+            if raw is None or incremental:
+                with metrics.phase("read"):
+                    raw = list(cons.records())
+            else:
+                cons.position = cons.end()
+            if not raw:
+                print("No new raw news." if incremental and cons.position else
+                      "No raw news found. Run agents/news_generate.py first."); return []
+            metrics.count("records_in", len(raw))
+            if incremental:
+                curated = embed_new(cfg, bus, raw, vec, store)
+            else:
+                with metrics.phase("curate"):
+                    curated, texts = curate(raw, classifier(cfg))
+                with metrics.phase("embed"):
+                    store.write_base(vec.fit(texts), vec.version())
+                for i, item in enumerate(curated): item["vec_index"] = i
+
+            with metrics.phase("write"), bus.producer(TOPIC_CUR) as w:
+                w.produce_many(curated)
+            cons.commit()
+    except TimeoutError as e:
+        print(f"Another curation/refit run holds the vector store ({e}); new items will be picked up next run."); return []
 
+    if incremental: maybe_compact(cfg, store)
+    metrics.count("records_out", len(curated))
     print(f"Curated {len(curated)} items → {cfg['paths']['topics_dir']}/{TOPIC_CUR}.jsonl")
+    return curated
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--incremental", action="store_true",
+                    help="curate only raw news not seen before and embed it with the persisted model")
+    ap.add_argument("--compact", action="store_true", help="fold delta vector segments into a new Annoy base and exit")
+    ap.add_argument("--refit", action="store_true", help="refit TF-IDF/SVD on all curated news, re-embed in place and exit")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    vec = Vectorizer(cfg["paths"]["models_dir"], n_components=256)
+    store = VectorStore(cfg["paths"]["models_dir"])
+
+    # --compact usually runs as maybe_compact's background child: its own run name keeps it from
+    # overwriting the report of the curation run that launched it
+    name = "news_curation.compact" if args.compact else "news_curation.refit" if args.refit else "news_curation"
+    with metrics.run(name, cfg, args.profile):
+        if args.compact:
+            if store.compact(): print(f"Compacted vector store: {len(store)} rows in base")
+            return
+        if args.refit:
+            with file_lock(store.dir / ".writer.lock"):
+                refit(bus, vec, store)
+            print(f"Refitted model and re-embedded {len(store)} rows"); return
+        run(cfg, bus, incremental=args.incremental)
 
 if __name__ == "__main__":
     main()
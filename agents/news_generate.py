@@ -1,7 +1,9 @@
 #!/usr/bin/env python
-import argparse, yaml, pandas as pd, numpy as np, random
+import argparse, yaml, pathlib, pandas as pd, numpy as np, random
 from agents.common.io import FSBus, ensure_dir
-from agents.common.text import standardize_columns, clean_text, infer_event_type, infer_region, infer_category
+from agents.common import synth, sales, metrics
+from agents.common.text import clean_text, classifier
+from agents.common.robust import rolling_mad_z
 
 TOPIC_RAW = "raw.news.html"
 
@@ -12,9 +14,7 @@ def detect_simple_anomalies(g: pd.DataFrame):
         r = (x - x.rolling(w, min_periods=7).mean()) / (x.rolling(w, min_periods=7).std().replace(0,1))
         return r
     def mad_z(x, w=14):
-        med = x.rolling(w, min_periods=7).median()
-        mad = (x.rolling(w, min_periods=7).apply(lambda v: np.median(np.abs(v - np.median(v))), raw=True)).replace(0,1e-6)
-        return 0.6745*(x - med)/mad
+        return pd.Series(rolling_mad_z(x.to_numpy(dtype=float), w, min_periods=7), index=x.index)
     g["zu"] = rolling_z(g["units"])
     g["zs"] = rolling_z(g["sales"])
     g["zp"] = mad_z(g["price"])
@@ -22,7 +22,7 @@ def detect_simple_anomalies(g: pd.DataFrame):
                   np.where((np.abs(g["zu"])>=2.0)|(np.abs(g["zs"])>=2.0), "KPI anomaly", None))
     return g[g["atype"].notna()][["date","region","category","sku","atype","zu","zs","zp"]]
 
-def synth_title(cat, reg, evt):
+def synth_title(cat, reg, evt, rng=random):
     stems = {
         "RegulatoryChange":[
             "New tariff policy impacts {} in {}",
@@ -49,51 +49,92 @@ def synth_title(cat, reg, evt):
             "{} market watch across {}"
         ]
     }
-    tmpl = random.choice(stems.get(evt, stems["GeneralEvent"]))
+    tmpl = rng.choice(stems.get(evt, stems["GeneralEvent"]))
     try:
         return tmpl.format(cat, reg)
     except:
         return f"{evt} affects {cat} in {reg}"
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
-    args = ap.parse_args()
+def generate_synthetic(args, bus):
+    """Load-test workload: planted-anomaly sales CSV at skus × days scale plus matching raw news."""
+    out = pathlib.Path(args.sales_out); ensure_dir(out.parent)
+    planted = synth.write_sales_csv(out, args.skus, args.days, seed=args.seed, anomaly_rate=args.anomaly_rate, start=args.start)
+    news = synth.synth_news(planted["Date"].to_numpy(), planted["Region"].to_numpy(), planted["Product_Category"].to_numpy(), seed=args.seed) if len(planted) else []
+    if args.background_news:
+        news += synth.background_news(args.start, args.days, args.background_news, seed=args.seed)
+    with bus.producer(TOPIC_RAW, batch_size=50000) as w:
+        w.produce_many(news)
+    print(f"Wrote {args.skus*args.days} synthetic sales rows ({len(planted)} planted anomalies) → {out}")
+    print(f"Wrote {len(news)} synthetic raw news → {bus.topics_dir}/{TOPIC_RAW}; point paths.sales_csv at {out} to run the pipeline on it")
 
-    cfg = yaml.safe_load(open("config/config.yaml","r"))
-    bus = FSBus(cfg["paths"]["topics_dir"])
-
-    df = pd.read_csv("data/input/Adjusted_Retail_Sales_Data_with_Anomalies.csv")
-    df = standardize_columns(df)
+def run(cfg, bus, df=None) -> list:
+    """Raw news for the simple anomalies in the sales table; df is the standardized table if already loaded."""
+    with metrics.phase("load"):
+        df = sales.load(cfg) if df is None else df
+        if "row" in df: df = df.sort_values("row")  # source order: rows tied on date within a group keep it
+    metrics.count("records_in", len(df))
 
     anomalies = []
-    for (reg, cat), g in df.groupby(["region","category"]):
-        an = detect_simple_anomalies(g)
-        if not an.empty:
-            anomalies.append(an)
+    with metrics.phase("detect"):
+        for (reg, cat), g in df.groupby(["region","category"], observed=True):
+            an = detect_simple_anomalies(g)
+            if not an.empty:
+                anomalies.append(an)
     an_all = pd.concat(anomalies, ignore_index=True) if anomalies else pd.DataFrame(columns=["date","region","category","sku","atype","zu","zs","zp"])
 
-    random.seed(42)
-    count = 0
-    for _, r in an_all.iterrows():
-        evt = random.choice(["RegulatoryChange","LaborStrike","SupplyChainDisruption","ProductRecall","WeatherDisaster"])
-        title = synth_title(r["category"], r["region"], evt)
-        summary = f"{title}. Analysts expect short-term volatility. Category={r['category']}, Region={r['region']}."
-        item = {
-            "news_id": f"news-{str(pd.to_datetime(r['date']).date())}-{random.randint(1000,9999)}",
-            "published_at": pd.to_datetime(r["date"]).isoformat(),
+    rng = random.Random(42)
+    news = []
+    dates = pd.to_datetime(an_all["date"])
+    day = dates.dt.date.astype(str).to_numpy(); iso = [t.isoformat() for t in dates]
+    cats, regs = an_all["category"].to_numpy(), an_all["region"].to_numpy()
+    for i, (cat, reg) in enumerate(zip(cats, regs)):
+        evt = rng.choice(["RegulatoryChange","LaborStrike","SupplyChainDisruption","ProductRecall","WeatherDisaster"])
+        title = synth_title(cat, reg, evt, rng)
+        summary = f"{title}. Analysts expect short-term volatility. Category={cat}, Region={reg}."
+        news.append({
+            "news_id": f"news-{day[i]}-{rng.randint(1000,9999)}",
+            "published_at": iso[i],
             "title": title,
             "summary": summary,
             "html": f"<html><body><h1>{title}</h1><p>{summary}</p></body></html>",
-            "region": infer_region(title, r["region"]),
-            "categories": [infer_category(summary, r["category"])],
-            "event_type": infer_event_type(summary),
-            "source_score": round(random.uniform(0.6,0.95),2)
-        }
-        bus.produce(TOPIC_RAW, item)
-        count += 1
+            "region": None, "categories": None, "event_type": None,  # classified below, in batch
+            "source_score": round(rng.uniform(0.6,0.95),2)
+        })
+    with metrics.phase("classify"):
+        clf = classifier(cfg)
+        by_title = clf.batch([n["title"] for n in news], ["region"], {"region": regs})
+        by_summary = clf.batch([n["summary"] for n in news], ["category","event_type"], {"category": cats})
+    for i, item in enumerate(news):
+        item["region"] = by_title["region"][i]
+        item["categories"] = [by_summary["category"][i]]
+        item["event_type"] = by_summary["event_type"][i]
+    with metrics.phase("write"), bus.producer(TOPIC_RAW) as w:
+        w.produce_many(news)
+
+    metrics.count("records_out", len(news))
+    print(f"Wrote {len(news)} synthetic raw news → {cfg['paths']['topics_dir']}/{TOPIC_RAW}.jsonl")
+    return news
 
-    print(f"Wrote {count} synthetic raw news → {cfg['paths']['topics_dir']}/{TOPIC_RAW}.jsonl")
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None)
+    ap.add_argument("--synthetic", action="store_true", help="generate a seeded sales table with planted anomalies and matching news instead of reading the dataset")
+    ap.add_argument("--skus", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--start", default="2025-01-01")
+    ap.add_argument("--anomaly-rate", type=float, default=0.01)
+    ap.add_argument("--background-news", type=int, default=0, help="extra uncorrelated news items per day")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--sales-out", default="data/synthetic/sales.csv")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    with metrics.run("news_generate", cfg, args.profile):
+        if args.synthetic:
+            generate_synthetic(args, bus); return
+        run(cfg, bus)
 
 if __name__ == "__main__":
     main()
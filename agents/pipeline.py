@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+import argparse, yaml, json, hashlib, pathlib, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List, NamedTuple
+from agents.common.io import FSBus
+from agents.common import artifacts, metrics, sales
+from agents import news_generate, news_curation, external_anomaly, internal_anomaly, correlate, impact
+
+class Stage(NamedTuple):
+    deps: List[str]        # stages (or the "sales" source) whose outputs run() receives
+    cfg_keys: List[str]    # config sections that change the stage's output
+    module: object         # agent module; its source is part of the stage hash
+    topics: List[str]      # topics the stage (re)writes
+    reports: List[str]     # report files under outputs/reports it (re)writes
+    run: Callable          # outputs dict -> stage output
+    load: Callable         # () -> stage output as persisted, for skipped stages
+
+def build_stages(cfg, bus):
+    rep = lambda name: json.load(open(pathlib.Path(cfg["paths"]["outputs"]) / "reports" / name, "r"))
+    return {
+        "news_generate": Stage(["sales"], ["taxonomy"], news_generate, [news_generate.TOPIC_RAW], [],
+                               lambda o: news_generate.run(cfg, bus, df=o["sales"]),
+                               lambda: bus.read_all(news_generate.TOPIC_RAW)),
+        "news_curation": Stage(["news_generate"], ["news_curation","taxonomy"], news_curation, [news_curation.TOPIC_CUR], [],
+                               lambda o: news_curation.run(cfg, bus, raw=o["news_generate"]),
+                               lambda: bus.read_all(news_curation.TOPIC_CUR)),
+        "external_anomaly": Stage(["news_curation"], ["external_anomaly"], external_anomaly, [external_anomaly.TOPIC_EXT], [],
+                                  lambda o: external_anomaly.run(cfg, bus, cur=o["news_curation"]),
+                                  lambda: bus.read_all(external_anomaly.TOPIC_EXT)),
+        "internal_anomaly": Stage(["sales"], ["internal_anomaly"], internal_anomaly, [internal_anomaly.TOPIC_INT], [],
+                                  lambda o: internal_anomaly.run(cfg, bus, df=o["sales"]),
+                                  lambda: bus.read_all(internal_anomaly.TOPIC_INT)),
+        "correlate": Stage(["news_curation","external_anomaly","internal_anomaly"], ["correlate"], correlate, [], ["correlations.json"],
+                           lambda o: correlate.run(cfg, bus, cur=o["news_curation"], ext=o["external_anomaly"], itn=o["internal_anomaly"]),
+                           lambda: rep("correlations.json")),
+        "impact": Stage(["correlate","sales"], ["impact"], impact, [], ["impact.json"],
+                        lambda o: impact.run(cfg, corr=o["correlate"], df=o["sales"]),
+                        lambda: rep("impact.json")),
+    }
+
+def _sha1(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def file_hash(path, state) -> str:
+    """Content hash of an input file, recomputed only when its size or mtime changed."""
+    p = pathlib.Path(path); s = p.stat()
+    cached = state.get("_sources", {}).get(str(p))
+    if cached and cached["size"] == s.st_size and cached["mtime_ns"] == s.st_mtime_ns:
+        return cached["sha1"]
+    h = hashlib.sha1()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    state.setdefault("_sources", {})[str(p)] = {"size": s.st_size, "mtime_ns": s.st_mtime_ns, "sha1": h.hexdigest()}
+    return h.hexdigest()
+
+def stage_keys(cfg, stages, state) -> dict:
+    """Merkle-style keys: a stage's key covers its code, its config sections, its inputs' keys and
+    the version of the model artifact it loads (the module's MODEL, written by agents.train_iforest)."""
+    common = _sha1(*[pathlib.Path(p).read_text() for p in sorted((pathlib.Path(__file__).parent / "common").glob("*.py"))])
+    keys = {"sales": file_hash(cfg["paths"]["sales_csv"], state)}
+    def key(name):
+        if name not in keys:
+            st = stages[name]
+            keys[name] = _sha1(name, common, pathlib.Path(st.module.__file__).read_text(), cfg["paths"], cfg["transport"].get("format","jsonl"),
+                               [cfg.get(k) for k in st.cfg_keys], [key(d) for d in st.deps],
+                               artifacts.version(pathlib.Path(cfg["paths"]["models_dir"]) / st.module.MODEL) if hasattr(st.module, "MODEL") else None)
+        return keys[name]
+    for name in stages: key(name)
+    return keys
+
+class Outputs:
+    """Stage outputs shared between threads; skipped stages (and the sales table) are loaded on first use."""
+    def __init__(self, loaders):
+        self.loaders = loaders; self.values = {}; self.locks = {k: threading.Lock() for k in loaders}
+    def set(self, name, value):
+        self.values[name] = value
+    def __getitem__(self, name):
+        with self.locks[name]:
+            if name not in self.values:
+                with metrics.phase(f"load:{name}"):
+                    self.values[name] = self.loaders[name]()
+            return self.values[name]
+
+def run_pipeline(cfg, force=False, workers=2) -> dict:
+    """Run every stage as soon as its inputs are ready, up to `workers` at a time; returns per-stage status and seconds."""
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    stages = build_stages(cfg, bus)
+    state_path = pathlib.Path(cfg["paths"]["outputs"]) / "state" / "pipeline.json"
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+    keys = stage_keys(cfg, stages, state)
+    out = Outputs({"sales": lambda: sales.load(cfg), **{n: st.load for n, st in stages.items()}})
+    lock = threading.Lock(); summary = {}
+
+    def persisted(st):
+        return (all(bus.topic_path(t).exists() or bus.columnar(t).exists() for t in st.topics)
+                and all((pathlib.Path(cfg["paths"]["outputs"]) / "reports" / r).exists() for r in st.reports))
+
+    def save_state():
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state_path.with_suffix(".tmp"); tmp.write_text(json.dumps(state, indent=1)); os.replace(tmp, state_path)
+
+    def execute(name):
+        st = stages[name]; t0 = time.perf_counter()
+        with metrics.stage(name) as rec:
+            if not force and state.get(name) == keys[name] and persisted(st):
+                print(f"↷ {name}: inputs and config unchanged, skipped")
+                rec["status"] = "skipped"
+                return "skipped", 0.0
+            print(f"▶ {name}")
+            for t in st.topics: bus.truncate(t)
+            out.set(name, st.run(out))
+            with lock:
+                state[name] = keys[name]; save_state()
+        return "ran", time.perf_counter() - t0
+
+    done, running = set(), {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        while len(done) < len(stages):
+            for name, st in stages.items():
+                if name not in done and name not in running.values() and all(d in done or d not in stages for d in st.deps):
+                    running[ex.submit(execute, name)] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in finished:
+                name = running.pop(f)
+                summary[name] = f.result(); done.add(name)
+    with lock:
+        save_state()
+    return {n: summary[n] for n in stages}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--force", action="store_true", help="run every stage even if its inputs and config are unchanged")
+    ap.add_argument("--workers", type=int, default=2, help="stages run concurrently when their inputs are ready")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    t0 = time.perf_counter()
+    with metrics.run("pipeline", cfg, args.profile):
+        summary = run_pipeline(cfg, force=args.force, workers=args.workers)
+    for name, (status, secs) in summary.items():
+        print(f"  {name:<17} {status:<8} {secs:6.2f}s")
+    print(f"✅ Pipeline done in {time.perf_counter()-t0:.2f}s")
+
+if __name__ == "__main__":
+    main()
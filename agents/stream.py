@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import argparse, yaml, asyncio
+from agents.common.io import FSBus
+from agents.common.stream import make_bus, micro_batches
+from agents.common.vectors import Vectorizer, VectorStore, file_lock
+from agents.common import metrics
+from agents import news_curation, external_anomaly, correlate
+
+STAGES = ["curation", "external", "correlate"]
+
+def consumers(cfg, fs, bus, stages):
+    """(name, subscription, handler, output topic) for each requested stage."""
+    sc = cfg["transport"]["stream"]; n = sc["batch_size"]
+    out = []
+    if "curation" in stages:
+        vec = Vectorizer(cfg["paths"]["models_dir"], n_components=256)
+        def curate(raw):
+            store = VectorStore(cfg["paths"]["models_dir"])
+            with file_lock(store.dir / ".writer.lock"):
+                cur = news_curation.embed_new(cfg, fs, raw, vec, store)
+            news_curation.maybe_compact(cfg, store)
+            return cur
+        out.append(("curation", bus.subscribe(news_curation.TOPIC_RAW, news_curation.GROUP, n), curate, news_curation.TOPIC_CUR))
+    if "external" in stages:
+        # batch runs commit this group's offset too, so the stream resumes after what they published
+        out.append(("external", bus.subscribe(external_anomaly.TOPIC_CUR, external_anomaly.GROUP, n),
+                    external_anomaly.StreamScorer(cfg), external_anomaly.TOPIC_EXT))
+    if "correlate" in stages:
+        view = correlate.StreamCorrelator(cfg)  # a materialized view: rebuilt from the start of both topics
+        out.append(("correlate.news", bus.subscribe(correlate.TOPIC_CUR, None, n), view.add_news, None))
+        out.append(("correlate.internal", bus.subscribe(correlate.TOPIC_INT, None, n), view.add_anomalies, None))
+    return out
+
+async def serve(cfg, stages, mode=None, run_for=None):
+    fs = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    bus = make_bus(cfg, fs, mode)
+    sc = cfg["transport"]["stream"]
+    tasks = []
+    for name, sub, handler, topic in consumers(cfg, fs, bus, stages):
+        publish = (lambda recs, t=topic: bus.publish(t, recs)) if topic else None
+        tasks.append(asyncio.create_task(micro_batches(sub, handler, publish, sc["batch_size"], sc["max_wait_s"],
+                                                       sc["queue_chunks"], name)))
+    print(f"Streaming {', '.join(stages)} on the {type(bus).__name__}; Ctrl-C to stop", flush=True)
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=run_for, return_when=asyncio.FIRST_EXCEPTION)
+        for t in done: t.result()
+    finally:
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await bus.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["fs","kafka"], default=None, help="fs: in-process broker on the topic files (default from transport.mode)")
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {STAGES}")
+    ap.add_argument("--run-for", type=float, default=None, help="stop after this many seconds (default: run until interrupted)")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown: raise SystemExit(f"Unknown stages {sorted(unknown)}; choose from {STAGES}")
+    try:
+        with metrics.run("stream", cfg, args.profile):
+            asyncio.run(serve(cfg, stages, args.mode, args.run_for))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+import argparse, datetime, os, pathlib, shutil, time, yaml, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dateutil import parser as dtp
+from agents.common.io import FSBus
+from agents.common import artifacts, forest, metrics, sales
+from agents.common.vectors import Vectorizer, VectorStore
+from agents import external_anomaly, internal_anomaly
+
+# Trains the Isolation Forests the detectors load at start: internal on [units, sales, price]
+# per sales row, external on [burst_z, novelty, support, source_score] per curated item.
+# Each training set covers the last `iforest.history_days` and is subsampled to `max_rows`;
+# --per-segment adds a forest per (region, category) with enough rows, fitted concurrently.
+# The live artifact is replaced atomically and a copy is kept under models/iforest/.
+
+def _window(dates, days):
+    """Mask of the last `days` days of datetime64 dates (all when days is 0)."""
+    if not days or not len(dates): return np.ones(len(dates), dtype=bool)
+    return dates > np.nanmax(dates) - np.timedelta64(days, "D")
+
+def internal_features(cfg, bus, days):
+    """(X, {segment: rows}, input hash) from the sales cache, as internal_anomaly computes them."""
+    df = sales.load(cfg, ["date", "region", "category", "units", "sales"])
+    df = df[_window(df["date"].to_numpy(), days)]
+    units = df["units"].to_numpy(dtype=float); sale = df["sales"].to_numpy(dtype=float)
+    X = np.c_[units, sale, sale/np.maximum(units, 1e-6)]
+    ok = np.isfinite(X).all(axis=1)
+    X, df = X[ok], df[ok]
+    segs = {k: ix for k, ix in df.groupby(["region", "category"], observed=True).indices.items()}
+    return X, segs, artifacts.input_hash(["internal", sales.SalesCache(cfg).dir.name, days, len(X)])
+
+def external_features(cfg, bus, days):
+    """(X, {segment: rows}, input hash) from replaying external_anomaly's signals over the whole curated topic."""
+    cur = bus.read_columns(external_anomaly.TOPIC_CUR, external_anomaly.COLUMNS)
+    if not len(cur["news_id"]): return np.zeros((0, len(external_anomaly.FEATURES))), {}, None
+    vec = Vectorizer(cfg["paths"]["models_dir"])
+    dates = [dtp.parse(p).date() for p in cur["published_at"]]
+    state = {"keys": {}}
+    by_key = external_anomaly.group_items(cur, dates, state)
+    todo = sorted(i for daymap in by_key.values() for ix in daymap.values() for i in ix)
+    Z = external_anomaly.embed(cur, todo, vec, VectorStore(cfg["paths"]["models_dir"]))
+    row = np.full(len(dates), -1); row[todo] = np.arange(len(todo))
+    rows, X = external_anomaly.signals(cur, by_key, Z, row, state, cfg["external_anomaly"])  # history warms the state
+    keep = np.flatnonzero(_window(np.array([dates[r[1]] for r in rows], dtype="datetime64[D]"), days))
+    X = X[keep]; segs = {}
+    for j, i in enumerate(keep): segs.setdefault(rows[i][0], []).append(j)
+    ihash = artifacts.input_hash(["external", vec.version(), cfg["external_anomaly"], days, len(cur["news_id"])])
+    return X, {k: np.array(ix) for k, ix in segs.items()}, ihash
+
+TARGETS = {"internal": (internal_anomaly, internal_features), "external": (external_anomaly, external_features)}
+
+def fit(X, tc, n_jobs, seed):
+    """IsolationForest on at most tc["max_rows"] rows of X (uniformly subsampled, seeded)."""
+    from sklearn.ensemble import IsolationForest
+    if len(X) > tc["max_rows"]:
+        X = X[np.sort(np.random.default_rng(seed).choice(len(X), tc["max_rows"], replace=False))]
+    ms = tc["max_samples"]
+    ms = min(ms, len(X)) if isinstance(ms, int) else ms
+    return IsolationForest(n_estimators=tc["n_estimators"], max_samples=ms, contamination=tc["contamination"],
+                           n_jobs=n_jobs, random_state=seed).fit(X)
+
+def publish(cfg, model, name, version, keep, **meta) -> dict:
+    """Save the live artifact (with metadata) and archive a copy as models/iforest/<stem>-<version>.joblib, keeping `keep`."""
+    path = pathlib.Path(cfg["paths"]["models_dir"]) / name
+    m = artifacts.save(model, path, version=version, **meta)
+    arch = path.parent / "iforest" / f"{path.stem}-{version}{path.suffix}"; arch.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(path, arch); shutil.copy2(artifacts.meta_path(path), artifacts.meta_path(arch))  # same mtime: meta stays valid
+    for old in sorted(arch.parent.glob(f"{path.stem}-*{path.suffix}"))[:-max(1, keep)]:
+        old.unlink(); artifacts.meta_path(old).unlink(missing_ok=True)
+    return m
+
+def train(cfg, bus, target, per_segment=None, n_jobs=None):
+    """Fit and publish the target's model; returns its metadata, or None when there is too little data."""
+    tc = cfg["iforest"]; module, features = TARGETS[target]
+    per_segment = tc["per_segment"] if per_segment is None else per_segment
+    n_jobs = (tc["n_jobs"] if n_jobs is None else n_jobs) or os.cpu_count()
+    with metrics.phase(f"features:{target}"):
+        X, segs, ihash = features(cfg, bus, tc["history_days"])
+    metrics.count("records_in", len(X))
+    if len(X) < tc["min_rows"]:
+        print(f"{target}: {len(X)} training rows (< iforest.min_rows={tc['min_rows']}), model not written"); return None
+
+    t0 = time.perf_counter()
+    with metrics.phase(f"fit:{target}"):
+        model = fit(X, tc, n_jobs, tc["seed"])
+        big = {k: ix for k, ix in segs.items() if len(ix) >= tc["min_segment_rows"]} if per_segment else {}
+        if big:  # trees release the GIL while building, so segment fits share one thread pool
+            with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+                fits = list(ex.map(lambda ix: fit(X[ix], tc, 1, tc["seed"]), big.values()))
+            model = forest.SegmentForest(model, dict(zip(big, fits)))
+    secs = time.perf_counter() - t0
+
+    version = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ") + f"-{(ihash or '')[:8]}"
+    with metrics.phase(f"write:{target}"):
+        m = publish(cfg, model, module.MODEL, version, tc["keep_versions"], dim=X.shape[1], input_hash=ihash,
+                    features=module.FEATURES, rows=len(X), fit_rows=min(len(X), tc["max_rows"]),
+                    history_days=tc["history_days"], fit_seconds=round(secs, 3),
+                    params={k: tc[k] for k in ("n_estimators", "max_samples", "contamination", "seed")},
+                    segments=[list(map(str, k)) for k in big])
+    metrics.count("records_out")
+    print(f"{target}: {module.MODEL} {version} on {m['fit_rows']:,}/{len(X):,} rows, {len(big)} segment forests, {secs:.2f}s fit")
+    return m
+
+def run(cfg, bus, targets=("internal", "external"), per_segment=None, n_jobs=None) -> dict:
+    return {t: train(cfg, bus, t, per_segment, n_jobs) for t in targets}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--targets", default="internal,external", help="comma-separated: internal, external")
+    ap.add_argument("--per-segment", action=argparse.BooleanOptionalAction, default=None,
+                    help="also fit a forest per (region, category) (default iforest.per_segment)")
+    ap.add_argument("--n-jobs", type=int, default=None, help="threads for tree building and segment fits (default iforest.n_jobs; 0 = all cores)")
+    ap.add_argument("--history-days", type=int, default=None, help="train on the last N days only (default iforest.history_days; 0 = all)")
+    ap.add_argument("--profile", default=None, help="cprofile and/or tracemalloc (comma-separated) for the run report")
+    args = ap.parse_args()
+
+    cfg = yaml.safe_load(open("config/config.yaml","r"))
+    if args.history_days is not None: cfg["iforest"]["history_days"] = args.history_days
+    targets = [t for t in args.targets.split(",") if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown: raise SystemExit(f"Unknown targets {sorted(unknown)}")
+    bus = FSBus(cfg["paths"]["topics_dir"], cfg["transport"].get("format","jsonl"))
+    with metrics.run("train_iforest", cfg, args.profile):
+        run(cfg, bus, targets, args.per_segment, args.n_jobs)
+
+if __name__ == "__main__":
+    main()
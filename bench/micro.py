@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for the hot kernels, each paired with its production replacement where there is one.
+
+    python -m bench.micro --n 100000
+"""
+import argparse, pathlib, tempfile, time, tracemalloc, numpy as np
+from agents.internal_anomaly import Rolling, RollingState
+from agents.external_anomaly import ewma_z, BurstStats, novelty, RecentVectors
+from agents.impact import its_effect, its_effect_batch
+from agents.common import synth
+
+def measure(fn, repeat=3):
+    """(best wall seconds, peak traced MB of one call)."""
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); best = min(best, time.perf_counter()-t)
+    tracemalloc.start()
+    try:
+        fn(); peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak / 2**20
+
+def kernels(n: int, seed: int = 0):
+    """name -> (items processed, zero-argument callable) for n input rows."""
+    rng = np.random.default_rng(seed)
+    x = rng.lognormal(4, 0.3, n)
+
+    def rolling(cls, w=28):
+        def go():
+            r = cls(w)
+            for v in x:
+                r.push(v); r.z(); r.mad_z()
+        return go
+
+    counts = rng.poisson(20, n).astype(float)
+    def ewma_trailing():  # external_anomaly before BurstStats: ewma_z over the trailing 30 days, per day
+        for i in range(len(counts)): ewma_z(counts[max(0, i-29):i+1])
+    def burst():
+        b = BurstStats()
+        for i, c in enumerate(counts): b.add(c, i)
+
+    d, k = 256, 200
+    V = rng.normal(size=(n, d)); V /= np.linalg.norm(V, axis=1, keepdims=True)
+    def novelty_list():
+        hist = []
+        for v in V:
+            novelty(v, hist); hist.append(v); hist = hist[-k:]
+    def novelty_ring(batch=256):
+        buf = RecentVectors(k, d)
+        for s in range(0, n, batch):
+            buf.novelty(V[s:s+batch]); buf.extend(V[s:s+batch])
+
+    L, t0 = 35, 28; m = max(1, n // L)
+    Y = rng.lognormal(4, 0.3, (m, L))
+    def its_loop():
+        for y in Y: its_effect(y, t0)
+
+    texts = news_texts(n, seed)
+    tmp = tempfile.TemporaryDirectory()
+    from agents.common.vectors import Vectorizer
+    Vectorizer(tmp.name, cache=False).fit(texts[:min(n, 20000)])
+    def transform(cache):
+        def go():
+            Vectorizer(tmp.name, cache=cache).transform(texts)
+        return go
+    transform(True)()  # fill the embedding cache for the warm run
+
+    import yaml
+    from agents.common.text import KeywordClassifier
+    taxonomy = yaml.safe_load(open(pathlib.Path(__file__).resolve().parents[1] / "config" / "config.yaml"))["taxonomy"]
+    def keywords():
+        KeywordClassifier(taxonomy).batch(texts)  # fresh token memo each call
+
+    return {
+        "Rolling.z/mad_z": (n, rolling(Rolling)),
+        "RollingState.z/mad_z": (n, rolling(RollingState)),
+        "ewma_z (trailing 30)": (n, ewma_trailing),
+        "BurstStats.add": (n, burst),
+        "novelty (list)": (n, novelty_list),
+        "RecentVectors.novelty": (n, novelty_ring),
+        "its_effect": (m, its_loop),
+        "its_effect_batch": (m, lambda: its_effect_batch(Y, t0)),
+        "Vectorizer.transform (cold)": (n, transform(False)),
+        "Vectorizer.transform (cached)": (n, transform(True)),
+        "KeywordClassifier.batch": (n, keywords),
+    }, tmp
+
+def news_texts(n: int, seed: int = 0) -> list:
+    """Curated-style texts for n synthetic news items, distinct per item (the id is a min_df-filtered token)."""
+    days = np.repeat(np.datetime64("2025-01-01"), n)
+    news = synth.synth_news(days, np.array(synth.REGIONS)[np.arange(n) % len(synth.REGIONS)],
+                            np.array(list(synth.CATEGORIES))[np.arange(n) % len(synth.CATEGORIES)], seed=seed)
+    return [f"{r['title']} {r['summary']} {r['news_id']}" for r in news]
+
+def run(n: int, repeat: int = 3, seed: int = 0, only=None) -> list:
+    ks, tmp = kernels(n, seed)
+    out = []
+    try:
+        for name, (items, fn) in ks.items():
+            if only and not any(o.lower() in name.lower() for o in only): continue
+            wall, peak = measure(fn, repeat)
+            out.append({"bench": f"micro:{name}", "scale": n, "items": items, "wall_s": wall,
+                        "throughput": items / wall if wall else None, "peak_mb": peak})
+    finally:
+        tmp.cleanup()
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--only", default="", help="comma-separated substrings of kernel names")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    rows = run(args.n, args.repeat, args.seed, [o for o in args.only.split(",") if o])
+    print(f"{'kernel':<32}{'items':>10}{'seconds':>10}{'items/s':>14}{'peak MB':>10}")
+    for r in rows:
+        print(f"{r['bench'][6:]:<32}{r['items']:>10,}{r['wall_s']:>10.3f}{r['throughput']:>14,.0f}{r['peak_mb']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
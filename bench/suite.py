@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Scaling benchmarks: every agent and the full pipeline on seeded synthetic sales, plus bench.micro.
+
+    python -m bench.suite --scales 1e3,1e4,1e5 [--baseline bench/baseline.json] [--save-baseline]
+
+Each scale gets its own workspace (config/config.yaml with paths.sales_csv pointing at the
+synthetic CSV). Agents run as `python -m agents.<name>` subprocesses in the chain's order, so
+wall time and peak RSS (from wait4) are the agent's own. Results go to bench/results/<time>.json;
+with a baseline, rows slower or larger than it by more than the tolerance are flagged and the
+exit status is 1.
+"""
+import argparse, datetime, json, math, os, pathlib, platform, shutil, subprocess, sys, tempfile, time, yaml
+from agents.common import synth
+from agents.common.io import FSBus
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+# agent -> (topics it writes, topic whose records are its input, or "sales")
+AGENTS = {
+    "sales_cache": ([], "sales"),
+    "news_generate": (["raw.news.html"], "sales"),
+    "news_curation": (["news.curated"], "raw.news.html"),
+    "train_iforest": ([], "sales"),
+    "external_anomaly": (["news.anomalies"], "news.curated"),
+    "internal_anomaly": (["internal.anomalies"], "sales"),
+    "correlate": ([], "internal.anomalies"),
+    "impact": ([], "internal.anomalies"),
+}
+BUILD_CACHE = "import yaml; from agents.common import sales; sales.SalesCache(yaml.safe_load(open('config/config.yaml')))"
+
+def shape(rows: int):
+    """(skus, days) with skus*days >= rows: a year of history once there is enough data."""
+    days = min(365, max(60, rows // 10))
+    return math.ceil(rows / days), days
+
+def workspace(root: pathlib.Path, rows: int, seed: int):
+    cfg = yaml.safe_load(open(ROOT / "config" / "config.yaml"))
+    cfg["paths"]["sales_csv"] = "data/input/sales.csv"
+    (root / "config").mkdir(parents=True); (root / "data" / "input").mkdir(parents=True)
+    (root / "config" / "config.yaml").write_text(yaml.safe_dump(cfg, sort_keys=False))
+    skus, days = shape(rows)
+    synth.write_sales_csv(root / "data" / "input" / "sales.csv", skus, days, seed=seed)
+    return cfg, skus * days
+
+def timed_run(cmd, cwd):
+    """(wall seconds, peak RSS MB) of a subprocess; raises on failure."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")])}
+    with tempfile.TemporaryFile() as err:
+        t = time.perf_counter()
+        p = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=err)
+        _, status, ru = os.wait4(p.pid, 0)  # unlike RUSAGE_CHILDREN, the peak of this child alone
+        wall = time.perf_counter() - t
+        p.returncode = os.waitstatus_to_exitcode(status)
+        if p.returncode:
+            err.seek(0)
+            raise SystemExit(f"{' '.join(cmd)} failed in {cwd}:\n{err.read().decode(errors='replace')}")
+    return wall, ru.ru_maxrss / 1024 if sys.platform != "darwin" else ru.ru_maxrss / 2**20
+
+def count(bus: FSBus, topic: str) -> int:
+    if bus.stored_format(topic) == "columnar": return len(bus.columnar(topic))
+    p = bus.topic_path(topic)
+    if not p.exists(): return 0
+    with open(p, "rb") as f: return sum(1 for _ in f)
+
+def bench_scale(rows: int, agents, seed: int, keep: bool):
+    root = pathlib.Path(tempfile.mkdtemp(prefix=f"bench-{rows}-"))
+    out = []
+    try:
+        cfg, n_sales = workspace(root, rows, seed)
+        bus = FSBus(root / cfg["paths"]["topics_dir"], cfg["transport"].get("format", "jsonl"))
+        for name in AGENTS:
+            if name not in agents: continue
+            writes, src = AGENTS[name]
+            for t in writes: bus.truncate(t)
+            items = n_sales if src == "sales" else count(bus, src)
+            cmd = [sys.executable, "-c", BUILD_CACHE] if name == "sales_cache" else [sys.executable, "-m", f"agents.{name}"]
+            wall, peak = timed_run(cmd, root)
+            out.append({"bench": f"agent:{name}", "scale": rows, "items": items, "wall_s": wall,
+                        "throughput": items / wall, "peak_mb": peak})
+        if "pipeline" in agents:  # cold chain: only the input CSV and the sales cache survive
+            for d in ("topics", "reports", "state", "models"): shutil.rmtree(root / cfg["paths"]["outputs"] / d, ignore_errors=True)
+            wall, peak = timed_run([sys.executable, "-m", "agents.pipeline", "--force"], root)
+            out.append({"bench": "pipeline", "scale": rows, "items": n_sales, "wall_s": wall,
+                        "throughput": n_sales / wall, "peak_mb": peak})
+    finally:
+        if keep: print(f"  workspace kept at {root}")
+        else: shutil.rmtree(root, ignore_errors=True)
+    return out
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    import numpy, pandas, sklearn
+    return {"time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": numpy.__version__, "pandas": pandas.__version__, "sklearn": sklearn.__version__}
+
+def compare(results, baseline, tol, mem_tol, min_seconds):
+    """Rows of results with their baseline ratios; a row regresses when slower/larger beyond the tolerance."""
+    base = {(r["bench"], r["scale"]): r for r in baseline["results"]}
+    for r in results:
+        b = base.get((r["bench"], r["scale"]))
+        if b is None: continue
+        r["vs_baseline"] = {"wall": r["wall_s"] / b["wall_s"] if b["wall_s"] else None,
+                            "peak_mb": r["peak_mb"] / b["peak_mb"] if b["peak_mb"] else None}
+        slow = b["wall_s"] >= min_seconds and r["wall_s"] > b["wall_s"] * (1 + tol)
+        big = b["peak_mb"] >= 1 and r["peak_mb"] > b["peak_mb"] * (1 + mem_tol)
+        r["regression"] = [k for k, bad in (("wall", slow), ("memory", big)) if bad]
+    return [r for r in results if r.get("regression")]
+
+def report(results):
+    print(f"{'bench':<38}{'scale':>10}{'items':>12}{'seconds':>10}{'items/s':>14}{'peak MB':>10}{'vs base':>10}")
+    for r in results:
+        vs = r.get("vs_baseline", {}).get("wall")
+        flag = " ← " + "/".join(r["regression"]) if r.get("regression") else ""
+        print(f"{r['bench']:<38}{r['scale']:>10,}{r['items']:>12,}{r['wall_s']:>10.3f}{r['throughput']:>14,.0f}"
+              f"{r['peak_mb']:>10.1f}{(f'{vs:.2f}x' if vs else '-'):>10}{flag}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scales", default="1e3,1e4,1e5", help="comma-separated sales row counts, e.g. 1e3,1e4,1e5,1e6,1e7")
+    ap.add_argument("--agents", default=",".join(list(AGENTS) + ["pipeline"]),
+                    help="stages to time, in chain order (sales_cache = CSV ingestion; pipeline = the full chain)")
+    ap.add_argument("--micro", action=argparse.BooleanOptionalAction, default=True, help="also run bench.micro at each scale")
+    ap.add_argument("--micro-max", type=float, default=1e5, help="cap on the micro-benchmark input size (the reference kernels are slow)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None, help="results file (default bench/results/<UTC time>.json)")
+    ap.add_argument("--baseline", default=str(ROOT / "bench" / "baseline.json"))
+    ap.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed wall-time slowdown vs the baseline")
+    ap.add_argument("--mem-tolerance", type=float, default=0.25, help="allowed peak-memory growth vs the baseline")
+    ap.add_argument("--min-seconds", type=float, default=0.05, help="baseline timings below this are too noisy to flag")
+    ap.add_argument("--keep", action="store_true", help="keep the per-scale workspaces")
+    args = ap.parse_args()
+
+    scales = [int(float(s)) for s in args.scales.split(",") if s]
+    agents = [a for a in args.agents.split(",") if a]
+    unknown = set(agents) - set(AGENTS) - {"pipeline"}
+    if unknown: raise SystemExit(f"Unknown agents {sorted(unknown)}")
+
+    results = []
+    for rows in scales:
+        print(f"▶ scale {rows:,}", flush=True)
+        results += bench_scale(rows, agents, args.seed, args.keep)
+        if args.micro:
+            from bench import micro
+            results += micro.run(min(rows, int(args.micro_max)), repeat=1 if rows >= 10**5 else 3)
+
+    regressions = []
+    bp = pathlib.Path(args.baseline)
+    if bp.exists() and not args.save_baseline:
+        regressions = compare(results, json.loads(bp.read_text()), args.tolerance, args.mem_tolerance, args.min_seconds)
+    report(results)
+
+    doc = {"env": environment(), "args": vars(args), "results": results}
+    out = pathlib.Path(args.out) if args.out else ROOT / "bench" / "results" / f"{doc['env']['time'].replace(':', '')[:17]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True); out.write_text(json.dumps(doc, indent=1))
+    print(f"Results → {out}")
+    if args.save_baseline:
+        bp.write_text(json.dumps(doc, indent=1)); print(f"Baseline → {bp}")
+    elif not bp.exists():
+        print(f"No baseline at {bp}; rerun with --save-baseline to record one.")
+    if regressions:
+        print(f"✗ {len(regressions)} regression(s) beyond +{args.tolerance:.0%} time / +{args.mem_tolerance:.0%} memory")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
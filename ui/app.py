@@ -1,55 +1,212 @@
-import streamlit as st, pandas as pd, json
+import streamlit as st, pandas as pd, json, sys, yaml
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from agents.common.io import FSBus
+
 out_dir = Path("data/outputs")
+cfg = yaml.safe_load(open("config/config.yaml","r"))
+
+@st.cache_resource(show_spinner=False)
+def get_bus(topics_dir, fmt):
+    return FSBus(topics_dir, fmt)  # one per server, not one per rerun
+
+bus = get_bus(str(out_dir/"topics"), cfg["transport"].get("format","jsonl"))
 
+st.set_page_config(page_title="Multi-Agent Anomaly Demo", layout="wide")
 st.sidebar.title("Multi-Agent Anomaly Demo")
 choice = st.sidebar.radio("View", ["Curated News", "External Anomalies", "Internal Anomalies", "Correlations", "Impact Analysis"])
 
-def df_jsonl(path):
-    try:
-        return pd.read_json(path, lines=True)
-    except Exception:
-        return pd.DataFrame()
-
-if choice == "Curated News":
-    st.subheader("Curated News Articles")
-    p = out_dir/"topics/news.curated.jsonl"
-    if not p.exists():
-        st.warning("No curated news yet. Run: bash scripts/run_all_fs.sh")
-    else:
-        st.dataframe(df_jsonl(p))
+# Data layer. Parsed topics and reports are cached under the file's (mtime, size), so
+# widget interactions never re-read them and a rewritten file is parsed once. Frames are
+# shared read-only via cache_resource (cache_data would copy them on every rerun); each
+# view is one row per record with date/region/category/sku columns for the filters.
 
-elif choice == "External Anomalies":
-    st.subheader("External Anomalies")
-    p = out_dir/"topics/news.anomalies.jsonl"
-    if not p.exists():
-        st.warning("No external anomalies yet. Run the pipeline.")
-    else:
-        st.dataframe(df_jsonl(p))
+def version(path: Path):
+    if not path.exists(): return None
+    s = path.stat()
+    return (s.st_mtime_ns, s.st_size)
 
-elif choice == "Internal Anomalies":
-    st.subheader("Internal Anomalies")
-    p = out_dir/"topics/internal.anomalies.jsonl"
-    if not p.exists():
-        st.warning("No internal anomalies yet.")
-    else:
-        st.dataframe(df_jsonl(p))
+def topic_version(topic):
+    if bus.stored_format(topic) == "columnar":
+        return version(bus.columnar(topic).index_path)
+    return version(bus.topic_path(topic))
 
-elif choice == "Correlations":
-    st.subheader("Correlations")
-    p = out_dir/"reports/correlations.json"
-    if not p.exists():
-        st.warning("No correlations report yet.")
-    else:
-        data = json.load(open(p))
-        st.json(data)
-
-elif choice == "Impact Analysis":
-    st.subheader("Impact Analysis")
-    p = out_dir/"reports/impact.json"
-    if not p.exists():
-        st.warning("No impact report yet.")
+def report_version(name):
+    return version(out_dir/"reports"/name)
+
+def expand(df, col, prefix=""):
+    """Dict-valued column → one column per key."""
+    if col not in df: return df
+    wide = pd.DataFrame([v if isinstance(v, dict) else {} for v in df[col]], index=df.index).add_prefix(prefix)
+    return pd.concat([df.drop(columns=col), wide], axis=1)
+
+@st.cache_resource(max_entries=8, show_spinner="Reading topic…")
+def read_topic(topic, ver):
+    if ver is None: return pd.DataFrame()
+    if bus.stored_format(topic) == "columnar":
+        df = pd.DataFrame(bus.read_columns(topic))
     else:
-        data = json.load(open(p))
-        st.json(data)
+        try:
+            df = pd.read_json(bus.topic_path(topic), lines=True, dtype=False, convert_dates=False)
+        except ValueError:
+            return pd.DataFrame()
+    if "published_at" in df:
+        df["date"] = pd.to_datetime(df["published_at"], errors="coerce").dt.normalize()
+    elif "date" in df:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    if "categories" in df and "category" not in df:
+        df["category"] = [c[0] if isinstance(c, list) and c else None for c in df["categories"]]
+    for c in ("metrics", "signals"):
+        df = expand(df, c)
+    return df
+
+@st.cache_resource(max_entries=4, show_spinner="Reading report…")
+def read_report(name, ver):
+    return json.load(open(out_dir/"reports"/name)) if ver is not None else []
+
+def anomaly_attrs():
+    a = read_topic("internal.anomalies", topic_version("internal.anomalies"))
+    if a.empty: return pd.DataFrame(columns=["internal_anomaly_id","date","region","category","sku","type"])
+    return (a.drop_duplicates("anomaly_id", keep="last")[["anomaly_id","date","region","category","sku","type"]]
+             .rename(columns={"anomaly_id": "internal_anomaly_id"}))
+
+def news_attrs():
+    n = read_topic("news.curated", topic_version("news.curated"))
+    if n.empty: return pd.DataFrame(columns=["news_id","event_type","title"])
+    return n.drop_duplicates("news_id", keep="last")[["news_id","event_type","title"]]
+
+@st.cache_resource(max_entries=4, show_spinner="Indexing correlations…")
+def correlation_table(ver, anomalies_ver, news_ver):
+    """One row per (anomaly, candidate); anomalies without a match keep a row with rank 0."""
+    rows = []
+    for e in read_report("correlations.json", ver):
+        ms = e.get("top_matches") or [None]
+        for k, m in enumerate(ms, 1):
+            rows.append({"internal_anomaly_id": e["internal_anomaly_id"], "rank": k if m else 0,
+                         "news_id": m and m["news_id"], "overall": m and m["overall"],
+                         **{f"{s}_score": v for s, v in ((m or {}).get("subs") or {}).items()}})
+    df = pd.DataFrame(rows)
+    if df.empty: return df
+    return df.merge(anomaly_attrs(), how="left").merge(news_attrs(), how="left", on="news_id")
+
+@st.cache_resource(max_entries=4, show_spinner="Indexing impact…")
+def impact_table(ver, anomalies_ver, news_ver):
+    rows = []
+    for e in read_report("impact.json", ver):
+        imp = dict(e["impact"])
+        for k in ("ci_abs", "ci_pct"):
+            if k in imp: imp[f"{k}_lo"], imp[f"{k}_hi"] = imp.pop(k)
+        rows.append({"internal_anomaly_id": e["internal_anomaly_id"], "news_id": e["best_cause"]["news_id"],
+                     "overall": e["best_cause"]["overall"], **imp, "metric": e["metric"],
+                     "window_start": e["window_start"], "window_end": e["window_end"]})
+    df = pd.DataFrame(rows)
+    if df.empty: return df
+    return df.merge(anomaly_attrs(), how="left").merge(news_attrs(), how="left", on="news_id")
+
+def load_view(name):
+    """(frame, version key, message shown when there is nothing yet)."""
+    if name in TOPICS:
+        topic, msg = TOPICS[name]; ver = topic_version(topic)
+        return read_topic(topic, ver), (topic, ver), msg
+    report, table, msg = REPORTS[name]
+    key = (report_version(report), topic_version("internal.anomalies"), topic_version("news.curated"))
+    df = table(*key) if key[0] is not None else pd.DataFrame()
+    return df, (report,) + key, msg
+
+TOPICS = {"Curated News": ("news.curated", "No curated news yet. Run: bash scripts/run_all_fs.sh"),
+          "External Anomalies": ("news.anomalies", "No external anomalies yet. Run the pipeline."),
+          "Internal Anomalies": ("internal.anomalies", "No internal anomalies yet.")}
+REPORTS = {"Correlations": ("correlations.json", correlation_table, "No correlations report yet."),
+           "Impact Analysis": ("impact.json", impact_table, "No impact report yet.")}
+
+# Filters are applied server-side; only the current page is sent to the browser.
+
+def filter_widgets(df):
+    """Sidebar filters for the view's columns; returns them as a hashable tuple."""
+    st.sidebar.markdown("**Filters**")
+    dates = None
+    if "date" in df and df["date"].notna().any():
+        lo, hi = df["date"].min().date(), df["date"].max().date()
+        rng = st.sidebar.date_input("Date range", (lo, hi), min_value=lo, max_value=hi)
+        if isinstance(rng, (list, tuple)) and len(rng) == 2: dates = (str(rng[0]), str(rng[1]))
+    picks = []
+    for c in ("region", "category", "event_type", "type"):
+        if c in df and df[c].notna().any():
+            opts = sorted(df[c].dropna().astype(str).unique())
+            picks.append((c, tuple(st.sidebar.multiselect(c.replace("_", " ").capitalize(), opts))))
+    sku = st.sidebar.text_input("SKU (comma-separated)") if "sku" in df else ""
+    skus = tuple(s.strip() for s in sku.split(",") if s.strip())
+    return dates, tuple(picks), skus
+
+def apply_filters(df, flt):
+    dates, picks, skus = flt
+    m = pd.Series(True, index=df.index)
+    if dates: m &= df["date"].between(pd.Timestamp(dates[0]), pd.Timestamp(dates[1]))
+    for c, vals in picks:
+        if vals: m &= df[c].astype(str).isin(vals)
+    if skus: m &= df["sku"].isin(skus)
+    return df[m] if not m.all() else df
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def aggregates(view, key, flt):
+    """Counts per day and segment (and top causes for the reports) of the filtered view, cached per filter set."""
+    df = apply_filters(load_view(view)[0], flt)
+    if view == "Correlations": df = df[df["rank"] == 1]
+    out = {"rows": len(df)}
+    if df.empty: return out
+    by = "event_type" if "event_type" in df and view in TOPICS else "type" if "type" in df else None
+    if "date" in df:
+        d = df[df["date"].notna()]
+        out["per_day"] = (d.groupby([d["date"].dt.date, by]).size().unstack(fill_value=0) if by
+                          else d.groupby(d["date"].dt.date).size().rename("count").to_frame())
+    seg = [c for c in ("region", "category") if c in df]
+    if seg:
+        out["per_segment"] = df.groupby(seg, dropna=False).size().rename("count").reset_index()
+    if view in REPORTS and "news_id" in df:
+        agg = {"anomalies": ("internal_anomaly_id", "nunique"), "mean_score": ("overall", "mean")}
+        if "effect_abs" in df: agg["total_effect_abs"] = ("effect_abs", "sum")
+        out["top_events"] = (df.groupby("event_type").agg(**agg).sort_values("anomalies", ascending=False).reset_index()
+                             if "event_type" in df and df["event_type"].notna().any() else None)
+        out["top_news"] = (df.groupby(["news_id", "title"], dropna=False).agg(**agg)
+                             .sort_values("anomalies", ascending=False).head(20).reset_index())
+    return out
+
+def show_table(df, view):
+    cols = [c for c in df.columns if c not in ("html", "text")]
+    scalar = [c for c in cols if not len(df) or not isinstance(df[c].iloc[0], (list, dict))]
+    c1, c2, c3 = st.columns([2, 1, 1])
+    sort = c1.selectbox("Sort by", ["(source order)"] + scalar, key=f"sort:{view}")
+    desc = c2.toggle("Descending", key=f"desc:{view}")
+    size = c3.selectbox("Rows per page", [50, 100, 500, 1000], index=1, key=f"size:{view}")
+    if sort != "(source order)":
+        df = df.sort_values(sort, ascending=not desc, kind="stable")
+    pages = max(1, -(-len(df) // size))
+    page = st.number_input(f"Page (1–{pages})", min_value=1, max_value=pages, value=1, key=f"page:{view}")
+    st.caption(f"{len(df):,} rows · page {page} of {pages}")
+    st.dataframe(df[cols].iloc[(page-1)*size: page*size], use_container_width=True, hide_index=True)
+
+def show_summary(agg, view):
+    if not agg["rows"]:
+        st.info("Nothing matches the filters."); return
+    st.metric("Anomalies" if view != "Curated News" else "News items", f"{agg['rows']:,}")
+    if "per_day" in agg:
+        st.markdown("**Per day**"); st.bar_chart(agg["per_day"])
+    if "per_segment" in agg:
+        st.markdown("**Per segment**"); st.dataframe(agg["per_segment"], use_container_width=True, hide_index=True)
+    if agg.get("top_events") is not None:
+        st.markdown("**Top causes by event type** (best match per anomaly)"); st.dataframe(agg["top_events"], use_container_width=True, hide_index=True)
+    if "top_news" in agg:
+        st.markdown("**Top cause articles**"); st.dataframe(agg["top_news"], use_container_width=True, hide_index=True)
+
+st.subheader(choice)
+df, key, empty_msg = load_view(choice)
+if df.empty:
+    st.warning(empty_msg)
+else:
+    flt = filter_widgets(df)
+    table, summary = st.tabs(["Table", "Summary"])
+    with table:
+        show_table(apply_filters(df, flt), choice)
+    with summary:
+        show_summary(aggregates(choice, key, flt), choice)